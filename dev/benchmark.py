@@ -0,0 +1,225 @@
+"""
+Time the model access layer, the bulk inserts and the export against a seeded synthetic dataset, and store the results
+as JSON so runs can be compared over time.
+
+    python dev/benchmark.py --generate 200000 --output results.json
+    python dev/benchmark.py --output new.json --compare results.json
+
+The database is DATABASE_URL (see db.py), use sqlite:///benchmark.db for a local run. With --compare, the exit code is
+1 when a case got slower than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session, joinedload, lazyload, selectinload
+
+from db import get_engine
+from generators.workload import generate_workload
+from models.blobs import BlobStore
+from models.cache import settings_cache
+from models.db_model import Base, Participants, Posts, PostsInteractions, Studies, StudyUiSettings
+from models.read_models import posts_by_study_id, posts_interactions_by_post_id
+from queries.export import stream_study_results
+from queries.ingest import ingest
+
+
+def _pick(session: Session):
+    """
+    :return: The ids the cases work on: the first study, its most interacted post, its most active participant, the
+    ui settings of the study and the session id of the participant.
+    """
+    study_id = session.scalar(select(func.min(Studies.id)))
+    post_id = session.scalar(select(PostsInteractions.fk_post_id).group_by(PostsInteractions.fk_post_id)
+                             .order_by(func.count().desc()).limit(1))
+    participant_id = session.scalar(select(PostsInteractions.fk_participant_id)
+                                    .group_by(PostsInteractions.fk_participant_id)
+                                    .order_by(func.count().desc()).limit(1))
+    ui_settings_id = session.scalar(select(Studies.fk_ui_settings).where(Studies.id == study_id))
+    session_id = session.scalar(select(Participants.session_id).where(Participants.id == participant_id))
+    return study_id, post_id, participant_id, ui_settings_id, session_id
+
+
+def _cases(engine, study_id, post_id, participant_id, ui_settings_id, session_id, insert_rows):
+    """
+    :return: (name, function, teardown) of every case, each function opening its own session. teardown, called
+    untimed after each call when not None, undoes what the function wrote.
+    """
+    def in_session(call):
+        def run():
+            with Session(engine) as session:
+                call(session)
+        return run
+
+    with Session(engine) as session:
+        template = session.execute(select(PostsInteractions).limit(1)).scalar_one()
+        row = {column.key: getattr(template, column.key) for column in PostsInteractions.__table__.columns
+               if column.key != 'id'}
+        last_id = session.scalar(select(func.max(PostsInteractions.id)))
+        audit = session.execute(select(Studies.result_last_download_time, Studies.fk_result_last_download_by)
+                                .where(Studies.id == study_id)).one()
+
+    def bulk_insert():
+        ingest(engine, PostsInteractions, ({**row, 'order': -1} for _ in range(insert_rows)), batch_size=5000)
+
+    def remove_inserted():
+        # Through the primary key, a filter on order alone would scan the table.
+        with engine.begin() as connection:
+            connection.execute(PostsInteractions.__table__.delete().where(PostsInteractions.id > last_id))
+
+    def export():
+        with open(os.devnull, 'w') as output, Session(engine) as session:
+            stream_study_results(session, study_id, output, output_format='csv')
+
+    def restore_audit():
+        with engine.begin() as connection:
+            connection.execute(update(Studies).where(Studies.id == study_id)
+                               .values(result_last_download_time=audit[0], fk_result_last_download_by=audit[1]))
+
+    def avatar(store):
+        def read(session):
+            avatar_id = session.scalar(select(Participants.fk_avatar_blob).where(Participants.id == participant_id))
+            bytes(store.get(session, avatar_id))
+        return in_session(read)
+
+    cases = [
+        ("studies.get_by_id.joinedload", in_session(lambda s: Studies.get_by_id(s, study_id, loading=joinedload))),
+        ("studies.get_by_id.selectinload",
+         in_session(lambda s: Studies.get_by_id(s, study_id, loading=selectinload))),
+        ("studies.get_by_id.lazyload", in_session(lambda s: Studies.get_by_id(s, study_id, loading=lazyload))),
+        ("ui_settings.get_by_id", in_session(lambda s: StudyUiSettings.get_by_id(s, ui_settings_id))),
+        ("ui_settings.get_by_id.cached",
+         in_session(lambda s: StudyUiSettings.get_by_id(s, ui_settings_id, use_cache=True))),
+        ("posts.get_all_by_study_id", in_session(lambda s: Posts.get_all_by_study_id(s, study_id))),
+        ("posts.get_all_by_study_id.read_model", in_session(lambda s: posts_by_study_id(s, study_id))),
+        ("posts.get_feed_page", in_session(lambda s: Posts.get_feed_page(s, study_id, participant_id))),
+        ("posts_interactions.get_all_by_post_id",
+         in_session(lambda s: PostsInteractions.get_all_by_post_id(s, post_id))),
+        ("posts_interactions.get_all_by_post_id.read_model",
+         in_session(lambda s: posts_interactions_by_post_id(s, post_id))),
+        ("participants.get_by_session_id", in_session(lambda s: s.execute(
+            select(Participants).where(Participants.session_id == session_id)).scalar_one())),
+        ("participants.avatar", avatar(BlobStore())),
+        ("participants.avatar.file_cache", avatar(BlobStore(tempfile.mkdtemp(prefix='benchmark-blobs-')))),
+        ("posts_interactions.bulk_insert.{}".format(insert_rows), bulk_insert, remove_inserted),
+        ("export.csv", export, restore_audit),
+    ]
+    return [case if len(case) == 3 else case + (None,) for case in cases]
+
+
+def run_case(function, repeat: int, warmup=1, teardown=None) -> dict:
+    """
+    :param teardown: Called after each call of function, outside of the timings.
+    :return: Timings of `repeat` calls of function, in seconds.
+    """
+    for _ in range(warmup):
+        function()
+        if teardown is not None:
+            teardown()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+        if teardown is not None:
+            teardown()
+    return {
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'stdev': statistics.stdev(timings) if repeat > 1 else 0.0,
+        'ops_per_second': repeat / sum(timings),
+    }
+
+
+def _metadata(engine) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    with Session(engine) as session:
+        sizes = {table.name: session.scalar(select(func.count()).select_from(table))
+                 for table in Base.metadata.sorted_tables}
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'dialect': engine.dialect.name,
+        'table_sizes': sizes,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Print the median ratio of every case shared by both runs.
+    :param threshold: Ratio above which a case is reported as a regression.
+    :return: True when no case regressed.
+    """
+    ok = True
+    print("\n{:<45} {:>12} {:>12} {:>8}".format("case", "baseline ms", "current ms", "ratio"))
+    for name, current in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        before = baseline['cases'][name]['median']
+        ratio = current['median'] / before if before else float('inf')
+        regressed = ratio > threshold
+        ok = ok and not regressed
+        print("{:<45} {:>12.3f} {:>12.3f} {:>7.2f}x{}".format(name, before * 1000, current['median'] * 1000, ratio,
+                                                             "  \033[91mREGRESSION\033[0m" if regressed else ""))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generate', type=int, default=0,
+                        help="Create the tables and insert a synthetic dataset with this many interactions first.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic dataset.")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed calls per case.")
+    parser.add_argument('--insert-rows', type=int, default=10000, help="Rows of the bulk insert case.")
+    parser.add_argument('--filter', default='', help="Only run the cases whose name contains this.")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    parser.add_argument('--compare', help="JSON results of a previous run to compare with.")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio reported as a regression.")
+    arguments = parser.parse_args()
+
+    engine = get_engine()
+    if arguments.generate:
+        Base.metadata.create_all(engine)
+        print(generate_workload(engine, interactions=arguments.generate, seed=arguments.seed, verbose=True))
+
+    with Session(engine) as session:
+        ids = _pick(session)
+    if None in ids:
+        sys.exit("The database is empty, use --generate.")
+
+    results = {'metadata': _metadata(engine), 'cases': {}}
+    for name, function, teardown in _cases(engine, *ids, insert_rows=arguments.insert_rows):
+        if arguments.filter not in name:
+            continue
+        settings_cache.clear()
+        results['cases'][name] = timing = run_case(function, arguments.repeat, teardown=teardown)
+        print("{:<50} median {:>9.3f} ms  min {:>9.3f} ms  {:>9.1f} ops/s".format(
+            name, timing['median'] * 1000, timing['min'] * 1000, timing['ops_per_second']))
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline:
+            if not compare(results, json.load(baseline), arguments.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Show the query plans of the hot lookups with and without their secondary index.
+
+On PostgreSQL each index is dropped inside a transaction that is rolled back, so the database is left untouched. On
+SQLite the query is planned with NOT INDEXED instead. Use --seed on an empty database to insert enough rows for the
+planner to prefer the indexes.
+
+    python dev/explain-indexes.py --seed 200000
+"""
+import argparse
+
+from sqlalchemy import text
+
+from db import get_engine
+from models.db_model import Base
+from generators.workload import generate_workload
+
+HOT_QUERIES = [
+    ("ix_posts_study_id",
+     "SELECT * FROM posts WHERE fk_linked_study = :key", 1),
+    ("ix_posts_interactions_post_participant",
+     "SELECT * FROM posts_interactions WHERE fk_post_id = :key", 1),
+    ("ix_posts_interactions_participant_order",
+     'SELECT * FROM posts_interactions WHERE fk_participant_id = :key ORDER BY "order"', 1),
+    ("ix_comments_interactions_fk_comment_id",
+     "SELECT * FROM comments_interactions WHERE fk_comment_id = :key", 1),
+    ("ix_participants_session_id",
+     "SELECT * FROM participants WHERE session_id = :key", "study1-participant1"),
+]
+""" (index name, query, bound value) of the lookups the indexes are meant for."""
+
+
+def explain(connection, query, value) -> str:
+    prefix = "EXPLAIN QUERY PLAN " if connection.dialect.name == 'sqlite' else "EXPLAIN "
+    rows = connection.execute(text(prefix + query), {'key': value}).all()
+    return "\n".join("    " + str(row[-1]) for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=0, help="Create the tables and insert this many interactions.")
+    arguments = parser.parse_args()
+
+    engine = get_engine()
+    if arguments.seed:
+        Base.metadata.create_all(engine)
+        generate_workload(engine, interactions=arguments.seed, verbose=True)
+        if engine.dialect.name == 'postgresql':
+            with engine.begin() as connection:
+                connection.execute(text("ANALYZE"))
+
+    for index_name, query, value in HOT_QUERIES:
+        print("\033[1m{}\033[0m\n  {}".format(index_name, query))
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                print("  \033[92mwith index:\033[0m\n" + explain(connection, query, value))
+                if connection.dialect.name == 'sqlite':
+                    table = query.split(" FROM ")[1].split(" ")[0]
+                    query = query.replace(" FROM {} ".format(table), " FROM {} NOT INDEXED ".format(table))
+                else:
+                    connection.execute(text('DROP INDEX "{}"'.format(index_name)))
+                print("  \033[91mwithout index:\033[0m\n" + explain(connection, query, value))
+                transaction.rollback()
+
+
+if __name__ == '__main__':
+    main()
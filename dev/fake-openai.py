@@ -0,0 +1,137 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, to run the generators offline.
+
+Batch prompts (see generators/OpenAI/batch_generator.py) get a JSON reply with one post per request, other prompts
+a short text. --invalid-rate makes a share of the batch posts too short, to exercise the partial retries. --rpm
+enforces a requests per minute quota the way the API does, answering 429 with retry-after-ms above it, and
+--error-rate fails a share of the requests with a 429 or a 500, to exercise generators/OpenAI/client.py. Like the API,
+json_schema response formats are refused with a 400 for the models not supporting them.
+
+    python dev/fake-openai.py --port 8808 --delay 0.2 --rpm 120 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8808/v1 OPENAI_API_KEY=fake python dev/openai-test.py 20
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from generators.OpenAI.batch_generator import RESPONSE_FORMAT, response_format
+
+_REQUESTS = "Requests: "
+
+
+def _reply(prompt: str, invalid_rate: float, rng: random.Random) -> str:
+    if _REQUESTS not in prompt:
+        return "Fake reply to: " + prompt[:60]
+    posts = []
+    for spec in json.loads(prompt.split(_REQUESTS, 1)[1]):
+        short = rng.random() < invalid_rate
+        length = 10 if short else spec['min_char'] + rng.randint(0, spec['max_char'] - spec['min_char'])
+        posts.append({
+            'index': spec['index'], 'theme': spec['theme'], 'is_true': spec['is_true'],
+            'headline': spec.get('headline') or "Fake {} headline {}".format(spec['theme'], rng.getrandbits(48)),
+            'content': ("Lorem ipsum dolor sit amet. " * (length // 28 + 1))[:length],
+        })
+    return json.dumps({'posts': posts})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    delay = 0.0
+    invalid_rate = 0.0
+    error_rate = 0.0
+    rpm = None
+    rng = random.Random(0)
+    lock = threading.Lock()
+    accepted = deque()
+    """ Time of the requests accepted during the last minute."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, payload: dict, headers=()):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _rejection(self):
+        """
+        :return: The (status, headers) of an injected or rate limit error, None to accept the request.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.rng.random() < self.error_rate:
+                return (429, [('retry-after-ms', '200')]) if self.rng.random() < 0.5 else (500, [])
+            while self.accepted and self.accepted[0] <= now - 60:
+                self.accepted.popleft()
+            if self.rpm is not None and len(self.accepted) >= self.rpm:
+                retry_after = self.accepted[0] + 60 - now
+                return 429, [('retry-after-ms', str(int(retry_after * 1000) + 1))]
+            self.accepted.append(now)
+        return None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        requested_format = (body.get('response_format') or {}).get('type')
+        if requested_format == 'json_schema' and response_format(body['model']) is not RESPONSE_FORMAT:
+            self._send(400, {'error': {'message': "response_format json_schema is not supported with this model",
+                                       'type': 'invalid_request_error', 'code': None}})
+            return
+        rejection = self._rejection()
+        if rejection is not None:
+            status, headers = rejection
+            self._send(status, {'error': {'message': 'Injected error', 'type': 'fake', 'code': status}}, headers)
+            return
+        time.sleep(self.delay * self.rng.uniform(0.5, 1.5))
+        prompt = body['messages'][-1]['content']
+        with self.lock:
+            content = _reply(prompt, self.invalid_rate, self.rng)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        self._send(200, {
+            'id': 'fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+
+def serve(port=0, delay=0.0, invalid_rate=0.0, error_rate=0.0, rpm=None, seed=0) -> ThreadingHTTPServer:
+    """
+    Start the server in a background thread.
+    :return: The server, its base_url is http://127.0.0.1:<server.server_port>/v1.
+    """
+    handler = type('Handler', (_Handler,), {'delay': delay, 'invalid_rate': invalid_rate, 'error_rate': error_rate,
+                                            'rpm': rpm, 'rng': random.Random(seed), 'lock': threading.Lock(),
+                                            'accepted': deque()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8808)
+    parser.add_argument('--delay', type=float, default=0.0, help="Mean seconds before each reply.")
+    parser.add_argument('--invalid-rate', type=float, default=0.0, help="Share of batch posts made too short.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests failed with a 429 or a 500.")
+    parser.add_argument('--rpm', type=int, help="Requests accepted per minute, 429 above.")
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    server = serve(arguments.port, arguments.delay, arguments.invalid_rate, arguments.error_rate, arguments.rpm,
+                   arguments.seed)
+    print("Serving on http://127.0.0.1:{}/v1".format(server.server_port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Count the queries needed to render a feed page with the interactions and comments of its posts, loading them post by
+post and with the batched loaders of models/loader.py.
+
+    python dev/feed-queries.py --posts 50
+
+The database is DATABASE_URL (see db.py), seed it with python -m generators.workload.
+"""
+import argparse
+import sys
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from db import get_engine
+from instrumentation import query_budget
+from models.db_model import Comments, Posts, PostsInteractions, Sources, Studies
+from models.loader import Loaders
+
+
+def render_per_post(session: Session, posts: list) -> int:
+    """
+    :return: The number of rows rendered, loading the rows of each post separately.
+    """
+    rendered = 0
+    for post in posts:
+        rendered += 1 + len(PostsInteractions.get_all_by_post_id(session, post.id, loading=None))
+        rendered += len(session.execute(select(Comments).where(Comments.fk_post_id == post.id)).scalars().all())
+        rendered += Sources.get_by_id(session, post.fk_source_id) is not None
+    return rendered
+
+
+def render_batched(session: Session, posts: list) -> int:
+    """
+    :return: The number of rows rendered, loading the rows of every post at once.
+    """
+    loaders = Loaders(session)
+    post_ids = [post.id for post in posts]
+    interactions = loaders.get(PostsInteractions, 'fk_post_id').load_many(post_ids)
+    comments = loaders.get(Comments, 'fk_post_id').load_many(post_ids)
+    sources = loaders.get(Sources, 'id').load_many(post.fk_source_id for post in posts)
+    rendered = 0
+    for post in posts:
+        rendered += 1 + len(interactions[post.id]) + len(comments[post.id]) + len(sources[post.fk_source_id])
+    return rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=50, help="Posts of the feed page.")
+    arguments = parser.parse_args()
+
+    engine = get_engine()
+    with Session(engine) as session:
+        study_id = session.scalar(select(func.min(Studies.id)))
+        if study_id is None:
+            sys.exit("The database is empty, seed it with python -m generators.workload.")
+        page = select(Posts).where(Posts.fk_linked_study == study_id).order_by(Posts.id).limit(arguments.posts)
+        for name, render in (('per post', render_per_post), ('batched', render_batched)):
+            session.expunge_all()
+            posts = session.execute(page).scalars().all()
+            with query_budget(sys.maxsize, engine) as counter:
+                rendered = render(session, posts)
+            print("{:<10} {:>5} queries for {} rows".format(name, counter['count'], rendered))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Compare the ORM helpers with the read models of models/read_models.py: rows per second and peak memory.
+
+Each case runs in a new interpreter, so its peak resident memory is not hidden by a previous case. The memory reported
+is the peak growth over the interpreter once the modules are imported and the database connected.
+
+    python dev/read-models-benchmark.py --generate 1000000
+    python dev/read-models-benchmark.py --repeat 3 --filter all
+
+The database is DATABASE_URL (see db.py), use sqlite:///benchmark.db for a local run.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from db import get_engine
+from generators.workload import generate_workload
+from models.db_model import Base, Posts, PostsInteractions, Studies
+from models.read_models import (PostInteractionRow, fetch_rows, iter_rows, posts_by_study_id,
+                                posts_interactions_by_post_id)
+
+CASES = {
+    'posts_interactions.all.orm': lambda s, ids: s.query(PostsInteractions).all(),
+    'posts_interactions.all.read_model': lambda s, ids: fetch_rows(s, PostInteractionRow),
+    'posts_interactions.all.read_model.iter': lambda s, ids: sum(1 for _ in iter_rows(s, PostInteractionRow)),
+    'posts_interactions.get_all_by_post_id.orm': lambda s, ids: PostsInteractions.get_all_by_post_id(s, ids['post']),
+    'posts_interactions.get_all_by_post_id.read_model':
+        lambda s, ids: posts_interactions_by_post_id(s, ids['post']),
+    'posts.get_all_by_study_id.orm': lambda s, ids: Posts.get_all_by_study_id(s, ids['study']),
+    'posts.get_all_by_study_id.read_model': lambda s, ids: posts_by_study_id(s, ids['study']),
+}
+""" Name and call of each case. A call returns the rows read, or their number for the streaming cases."""
+
+
+def _peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _pick(session: Session) -> dict:
+    """
+    :return: The ids the cases work on: the first study and its most interacted post.
+    """
+    return {
+        'study': session.scalar(select(func.min(Studies.id))),
+        'post': session.scalar(select(PostsInteractions.fk_post_id).group_by(PostsInteractions.fk_post_id)
+                               .order_by(func.count().desc()).limit(1)),
+    }
+
+
+def run_case(name: str) -> dict:
+    """
+    Run a case once in this interpreter.
+    :return: The rows read, the seconds taken and the peak memory growth in kilobytes.
+    """
+    engine = get_engine()
+    with Session(engine) as session:
+        ids = _pick(session)
+    # The size of an interpreter that only did the imports and opened the pool, subtracted from the peak.
+    baseline = _peak_rss_kb()
+    with Session(engine) as session:
+        start = time.perf_counter()
+        result = CASES[name](session, ids)
+        seconds = time.perf_counter() - start
+        rows = result if isinstance(result, int) else len(result)
+        peak = _peak_rss_kb()
+    return {'rows': rows, 'seconds': seconds, 'peak_rss_kb': peak - baseline}
+
+
+def measure(name: str, repeat: int) -> dict:
+    """
+    Run a case repeat times, each time in a new interpreter.
+    :return: The rows read, the best time, rows per second and the lowest peak memory growth.
+    """
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', name], capture_output=True,
+                                text=True, env=os.environ.copy())
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    seconds = min(run['seconds'] for run in runs)
+    return {'rows': runs[0]['rows'], 'seconds': seconds,
+            'rows_per_second': runs[0]['rows'] / seconds if seconds > 0 else 0.0,
+            'peak_rss_kb': min(run['peak_rss_kb'] for run in runs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generate', type=int, default=0,
+                        help="Create the tables and insert a synthetic dataset with this many interactions first.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case, the best one is kept.")
+    parser.add_argument('--filter', default='', help="Only run the cases whose name contains this.")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.run:
+        print(json.dumps(run_case(arguments.run)))
+        return
+
+    if arguments.generate:
+        engine = get_engine()
+        Base.metadata.create_all(engine)
+        print(generate_workload(engine, interactions=arguments.generate, verbose=True))
+
+    results = {}
+    for name in CASES:
+        if arguments.filter not in name:
+            continue
+        results[name] = timing = measure(name, arguments.repeat)
+        print("{:<50} {:>9} rows {:>9.3f} s {:>11.0f} rows/s {:>9.1f} MB peak".format(
+            name, timing['rows'], timing['seconds'], timing['rows_per_second'], timing['peak_rss_kb'] / 1024))
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Batched post generation: one chat completion returns several complete posts as JSON, instead of two completions (title
+then content) per post with generate_post.
+
+The reply is validated against POST_BATCH_SCHEMA and against the requested post specs. Posts that are missing,
+invalid, too short or duplicated are requested again, alone, in a smaller follow-up batch.
+"""
+import asyncio
+import json
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, List, NamedTuple, Optional
+
+from generators.OpenAI.cache import HeadlineDeduplicator
+from generators.OpenAI.post_generator import PostDetails, _build_post_model, default_client
+from models.db_model import Posts
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+POST_BATCH_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'posts': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'index': {'type': 'integer'},
+                    'theme': {'type': 'string'},
+                    'is_true': {'type': 'boolean'},
+                    'headline': {'type': 'string'},
+                    'content': {'type': 'string'},
+                },
+                'required': ['index', 'theme', 'is_true', 'headline', 'content'],
+                'additionalProperties': False,
+            },
+        },
+    },
+    'required': ['posts'],
+    'additionalProperties': False,
+}
+""" JSON schema of a reply, also sent as response_format so the API enforces it."""
+
+RESPONSE_FORMAT = {'type': 'json_schema', 'json_schema': {'name': 'post_batch', 'strict': True,
+                                                          'schema': POST_BATCH_SCHEMA}}
+
+JSON_OBJECT_FORMAT = {'type': 'json_object'}
+""" JSON mode, for the models without structured outputs such as gpt-3.5-turbo, the default of PostDetails."""
+
+JSON_SCHEMA_MODELS = ('gpt-4o', 'gpt-4.1', 'gpt-5', 'o1', 'o3', 'o4')
+""" Prefixes of the models accepting RESPONSE_FORMAT, except the ones of NO_JSON_SCHEMA_MODELS."""
+
+NO_JSON_SCHEMA_MODELS = ('gpt-4o-2024-05-13', 'o1-mini', 'o1-preview')
+
+LENGTH_TOLERANCE = 0.8
+""" Share of min_char a content must reach. Models count characters loosely, the rest is asked again."""
+
+_TYPES = {'object': dict, 'array': list, 'string': str, 'integer': int, 'boolean': bool}
+
+
+class BatchGeneration(NamedTuple):
+    posts: List[Posts]
+    """ Generated posts, in no particular order."""
+    failed: List[PostDetails]
+    """ Details of the posts still invalid after every attempt."""
+
+
+def schema_errors(value, schema: dict, path='$') -> list:
+    """
+    Validate a decoded JSON value against the subset of JSON schema used by POST_BATCH_SCHEMA.
+    :return: A description of every error, empty when the value is valid.
+    """
+    expected = _TYPES[schema['type']]
+    # bool is a subclass of int, but not a JSON integer.
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        return ["{}: expected {}".format(path, schema['type'])]
+    errors = []
+    if expected is dict:
+        properties = schema.get('properties', {})
+        errors += ["{}: missing {}".format(path, key) for key in schema.get('required', ()) if key not in value]
+        if schema.get('additionalProperties') is False:
+            errors += ["{}: unexpected {}".format(path, key) for key in value if key not in properties]
+        for key, subschema in properties.items():
+            if key in value:
+                errors += schema_errors(value[key], subschema, "{}.{}".format(path, key))
+    elif expected is list:
+        for position, item in enumerate(value):
+            errors += schema_errors(item, schema['items'], "{}[{}]".format(path, position))
+    return errors
+
+
+def _spec(index: int, details: PostDetails) -> dict:
+    spec = {'index': index, 'theme': details.theme, 'is_true': details.is_info_true,
+            'min_char': details.min_char, 'max_char': details.max_char}
+    if details.force_title is not None:
+        spec['headline'] = details.force_title
+    return spec
+
+
+def build_batch_prompt(details_list: List[PostDetails]) -> str:
+    """
+    Build the prompt requesting every post of details_list at once.
+    :param details_list: PostDetails of the posts, their position in the list is their index.
+    :return: The prompt.
+    """
+    specs = json.dumps([_spec(index, details) for index, details in enumerate(details_list)])
+    return (
+        "Generate {count} social media posts, one per request of the list below. Each post is informative, has a "
+        "headline and a content whose length is between min_char and max_char characters, and does not end with "
+        "hashtags '#'. When is_true is false the post must present false information as a fact. Do not generate "
+        "headlines like '10 proven facts', '10 proven benefits' or '10 proven reasons', and do not repeat the headline "
+        "in the content. When a request has a headline, use it as is. Answer with a JSON object whose 'posts' list "
+        "holds one post per request, repeating its index, theme and is_true.\n"
+        "Requests: {specs}").format(count=len(details_list), specs=specs)
+
+
+def parse_batch(reply: str, details_list: List[PostDetails],
+                deduplicator: Optional[HeadlineDeduplicator] = None) -> dict:
+    """
+    Validate a reply, post by post.
+    :param reply: The content of the completion.
+    :param details_list: PostDetails the reply answers, by index.
+    :param deduplicator: When given, posts with a headline too close to a previous one are rejected.
+    :return: The valid posts by index. Indexes missing from it have to be requested again.
+    """
+    try:
+        decoded = json.loads(reply)
+    except ValueError:
+        return {}
+    if not isinstance(decoded, dict) or not isinstance(decoded.get('posts'), list):
+        return {}
+
+    posts = {}
+    for item in decoded['posts']:
+        if schema_errors(item, POST_BATCH_SCHEMA['properties']['posts']['items']):
+            continue
+        index = item['index']
+        if not 0 <= index < len(details_list) or index in posts:
+            continue
+        details = details_list[index]
+        headline = (details.force_title or item['headline']).strip()
+        content = item['content'].strip()
+        if (item['is_true'] != details.is_info_true or not headline
+                or len(content) < details.min_char * LENGTH_TOLERANCE
+                or (details.no_hashtag and '#' in content)):
+            continue
+        if deduplicator is not None and details.force_title is None and not deduplicator.add(headline):
+            continue
+        posts[index] = _build_post_model(details, headline, content)
+    return posts
+
+
+def response_format(model: str, structured: Optional[bool] = None) -> Optional[dict]:
+    """
+    :param model: The model the request is sent to.
+    :param structured: True for RESPONSE_FORMAT, False for none, None to pick RESPONSE_FORMAT when the model supports
+    it and JSON_OBJECT_FORMAT otherwise.
+    :return: The response_format of a batch request, None to send none.
+    """
+    if structured is not None:
+        return RESPONSE_FORMAT if structured else None
+    if model.startswith(JSON_SCHEMA_MODELS) and not model.startswith(NO_JSON_SCHEMA_MODELS):
+        return RESPONSE_FORMAT
+    return JSON_OBJECT_FORMAT
+
+
+def _request(details_list: List[PostDetails], structured: Optional[bool]) -> dict:
+    model = details_list[0].ai_model
+    request = {'model': model, 'messages': [{"role": "user", "content": build_batch_prompt(details_list)}]}
+    reply_format = response_format(model, structured)
+    if reply_format is not None:
+        request['response_format'] = reply_format
+    return request
+
+
+def generate_post_batch(details_list: List[PostDetails], client=None, max_attempts=3,
+                        structured: Optional[bool] = None,
+                        deduplicator: Optional[HeadlineDeduplicator] = None) -> BatchGeneration:
+    """
+    Generate several posts with a single completion, then request the invalid ones again.
+    :param details_list: PostDetails of the posts. They must share the same ai_model.
+    :param client: OpenAI client to use, for instance a CachedChatClient. The shared client by default.
+    :param max_attempts: Number of completions a post can take before being reported as failed.
+    :param structured: Send POST_BATCH_SCHEMA as response_format, see response_format(). By default it is sent to the
+    models supporting it, the others get JSON mode. The reply is validated either way.
+    :param deduplicator: See generate_post.
+    :return: The generated posts and the details of the failed ones.
+    """
+    if client is None:
+        client = default_client()
+    posts, pending = [], list(details_list)
+    for _ in range(max_attempts):
+        if not pending:
+            break
+        completion = client.chat.completions.create(**_request(pending, structured))
+        valid = parse_batch(completion.choices[0].message.content, pending, deduplicator)
+        posts += valid.values()
+        pending = [details for index, details in enumerate(pending) if index not in valid]
+    return BatchGeneration(posts, pending)
+
+
+async def generate_post_batch_async(details_list: List[PostDetails], client: 'AsyncOpenAI', max_attempts=3,
+                                    structured: Optional[bool] = None,
+                                    deduplicator: Optional[HeadlineDeduplicator] = None) -> BatchGeneration:
+    """
+    Async counterpart of generate_post_batch.
+    """
+    posts, pending = [], list(details_list)
+    for _ in range(max_attempts):
+        if not pending:
+            break
+        completion = await client.chat.completions.create(**_request(pending, structured))
+        valid = parse_batch(completion.choices[0].message.content, pending, deduplicator)
+        posts += valid.values()
+        pending = [details for index, details in enumerate(pending) if index not in valid]
+    return BatchGeneration(posts, pending)
+
+
+async def generate_posts_batched(details_list: Iterable[PostDetails], batch_size=5, concurrency=4,
+                                 client: Optional['AsyncOpenAI'] = None, max_attempts=3,
+                                 structured: Optional[bool] = None,
+                                 deduplicator: Optional[HeadlineDeduplicator] = None) -> AsyncIterator[Posts]:
+    """
+    Generate many posts, batch_size per completion, with at most `concurrency` completions in flight. Posts are
+    yielded as soon as their batch is finished. Posts still failing after max_attempts are skipped, so fewer posts
+    than requested may be yielded.
+    :param details_list: PostDetails of every post to generate.
+    :param batch_size: Posts requested per completion.
+    :param concurrency: Maximum number of batches in flight.
+    :param client: Async OpenAI client to use, see generate_posts.
+    :param max_attempts: See generate_post_batch.
+    :param structured: See generate_post_batch.
+    :param deduplicator: See generate_post.
+    :return: An async iterator over the newly created Posts.
+    """
+    assert batch_size > 0 and concurrency > 0, 'batch_size and concurrency must be greater than 0'
+    if client is None:
+        client = default_client(is_async=True)
+    details_list = list(details_list)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(batch):
+        async with semaphore:
+            return await generate_post_batch_async(batch, client, max_attempts, structured, deduplicator)
+
+    tasks = [asyncio.ensure_future(run(details_list[start:start + batch_size]))
+             for start in range(0, len(details_list), batch_size)]
+    try:
+        for next_finished in asyncio.as_completed(tasks):
+            for post in (await next_finished).posts:
+                yield post
+    finally:
+        for task in tasks:
+            task.cancel()
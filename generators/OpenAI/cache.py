@@ -0,0 +1,217 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from types import SimpleNamespace
+from typing import Optional
+
+
+class CacheMissError(LookupError):
+    """ Raised in replay only mode when a completion is not in the cache."""
+
+
+class DuplicateHeadlineError(ValueError):
+    """ Raised when no headline different enough from the previous ones could be generated."""
+
+
+def _completion(content: str):
+    """
+    :return: An object shaped like the chat completions of the OpenAI client, as far as the generators use them.
+    """
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))])
+
+
+class GenerationCache:
+    """
+    On-disk, content-addressed store of chat completions, in a SQLite file.
+
+    A prompt is keyed by the hash of the model and the messages. Since the same prompt is sent many times to get
+    different posts (the title prompt only depends on the theme and the truth flag), a prompt keeps several
+    completions: the n-th identical request of a run gets the n-th stored completion, and only requests past the stored
+    ones reach the API. Running the same seeding twice therefore replays the first run exactly.
+
+    The least recently used completions are evicted above max_entries.
+    """
+
+    def __init__(self, path='.generation-cache.sqlite', max_entries=100000, replay_only=False):
+        """
+        :param path: SQLite file of the cache.
+        :param max_entries: Maximum number of completions kept.
+        :param replay_only: Never call the API, raise CacheMissError instead. Meant for CI.
+        """
+        self.max_entries = max_entries
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self._occurrences = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " prompt_hash TEXT NOT NULL,"
+            " occurrence INTEGER NOT NULL,"
+            " model TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (prompt_hash, occurrence))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_completions_last_used ON completions (last_used)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT count(*) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def prompt_hash(model: str, messages) -> str:
+        payload = json.dumps({'model': model, 'messages': messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def next_key(self, model: str, messages) -> tuple:
+        """
+        :return: The (prompt hash, occurrence) key of the next request of this prompt in the current run.
+        """
+        prompt_hash = self.prompt_hash(model, messages)
+        with self._lock:
+            occurrence = self._occurrences.get(prompt_hash, 0)
+            self._occurrences[prompt_hash] = occurrence + 1
+        return prompt_hash, occurrence
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content FROM completions WHERE prompt_hash = ? AND occurrence = ?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.replay_only:
+                    raise CacheMissError("No cached completion for prompt {} #{}".format(*key))
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE completions SET last_used = ? WHERE prompt_hash = ? AND occurrence = ?", (time.time(), *key))
+            self._connection.commit()
+        return row[0]
+
+    def put(self, key: tuple, model: str, content: str):
+        with self._lock:
+            # Replacing a completion leaves the size unchanged, only new rows count towards max_entries.
+            replaced = self._connection.execute(
+                "UPDATE completions SET model = ?, content = ?, last_used = ? WHERE prompt_hash = ? AND occurrence = ?",
+                (model, content, time.time(), *key)).rowcount
+            if not replaced:
+                self._connection.execute(
+                    "INSERT INTO completions (prompt_hash, occurrence, model, content, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)", (*key, model, content, time.time()))
+                self._size += 1
+            if self._size > self.max_entries:
+                # Evict a tenth of the cache at once rather than one row per insertion.
+                self._connection.execute(
+                    "DELETE FROM completions WHERE rowid IN ("
+                    " SELECT rowid FROM completions ORDER BY last_used LIMIT ?)",
+                    (self._size - self.max_entries + self.max_entries // 10,))
+                self._size = self._connection.execute("SELECT count(*) FROM completions").fetchone()[0]
+            self._connection.commit()
+
+    def reset_run(self):
+        """
+        Start a new run: the next requests of every prompt are served from the first stored completion again.
+        """
+        with self._lock:
+            self._occurrences.clear()
+
+    def close(self):
+        self._connection.close()
+
+
+class _CachedCompletions:
+    def __init__(self, completions, cache: GenerationCache):
+        self._completions = completions
+        self._cache = cache
+
+    def create(self, model, messages, **kwargs):
+        key = self._cache.next_key(model, messages)
+        content = self._cache.get(key)
+        if content is None:
+            content = self._completions.create(model=model, messages=messages, **kwargs).choices[0].message.content
+            self._cache.put(key, model, content)
+        return _completion(content)
+
+
+class _AsyncCachedCompletions(_CachedCompletions):
+    async def create(self, model, messages, **kwargs):
+        key = self._cache.next_key(model, messages)
+        content = self._cache.get(key)
+        if content is None:
+            completion = await self._completions.create(model=model, messages=messages, **kwargs)
+            content = completion.choices[0].message.content
+            self._cache.put(key, model, content)
+        return _completion(content)
+
+
+class CachedChatClient:
+    """
+    Wrap an OpenAI (or AsyncOpenAI) client so client.chat.completions.create goes through a GenerationCache first.
+    In replay only mode the wrapped client may be None.
+    """
+
+    def __init__(self, client, cache: GenerationCache, is_async=False):
+        completions = client.chat.completions if client is not None else None
+        completions_class = _AsyncCachedCompletions if is_async else _CachedCompletions
+        self.chat = SimpleNamespace(completions=completions_class(completions, cache))
+        self.cache = cache
+
+
+class HeadlineDeduplicator:
+    """
+    Detect headlines that repeat, or nearly repeat, a headline seen before.
+
+    Headlines are normalized (case, accents, punctuation and spacing) and compared first by exact hash, then by the
+    Jaccard similarity of their character shingles.
+    """
+
+    _NON_WORD = re.compile(r"[^\w\s]")
+    _SPACES = re.compile(r"\s+")
+
+    def __init__(self, threshold=0.8, shingle_size=5):
+        """
+        :param threshold: Jaccard similarity from which two headlines are considered the same.
+        :param shingle_size: Number of characters per shingle.
+        """
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self._hashes = set()
+        self._shingles = []
+        self._lock = threading.Lock()
+
+    def normalize(self, headline: str) -> str:
+        text = unicodedata.normalize('NFKD', headline).encode('ascii', 'ignore').decode('ascii').lower()
+        text = self._NON_WORD.sub(" ", text)
+        return self._SPACES.sub(" ", text).strip()
+
+    def _shingle(self, normalized: str) -> frozenset:
+        size = self.shingle_size
+        if len(normalized) <= size:
+            return frozenset([normalized])
+        return frozenset(normalized[i:i + size] for i in range(len(normalized) - size + 1))
+
+    def is_duplicate(self, headline: str) -> bool:
+        normalized = self.normalize(headline)
+        if hashlib.sha1(normalized.encode('utf-8')).digest() in self._hashes:
+            return True
+        shingles = self._shingle(normalized)
+        for known in self._shingles:
+            if len(shingles & known) / len(shingles | known) >= self.threshold:
+                return True
+        return False
+
+    def add(self, headline: str) -> bool:
+        """
+        Record a headline, unless it duplicates a known one.
+        :return: True if the headline was new and has been recorded.
+        """
+        normalized = self.normalize(headline)
+        with self._lock:
+            if self.is_duplicate(headline):
+                return False
+            self._hashes.add(hashlib.sha1(normalized.encode('utf-8')).digest())
+            self._shingles.append(self._shingle(normalized))
+        return True
@@ -0,0 +1,329 @@
+"""
+Shared, rate limited OpenAI client.
+
+Requests go through one token bucket for the requests per minute and one for the tokens per minute of their model,
+filled at `headroom` of the quota, so the provider limit is approached without being reached. The tokens of a request
+are estimated before sending it and corrected with the usage of the reply. Rate limits (429), timeouts, connection
+errors and server errors are retried with exponential backoff and full jitter, waiting at least the retry-after the
+server asks for; a 429 also lowers the request rate of the model, which then climbs back slowly.
+
+    client = shared_client()
+    client.chat.completions.create(model=..., messages=...)
+    print(client.report())
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, NamedTuple, Optional
+
+
+class ModelLimits(NamedTuple):
+    requests_per_minute: float
+    tokens_per_minute: float
+
+
+DEFAULT_LIMITS = ModelLimits(requests_per_minute=500, tokens_per_minute=200000)
+""" Quota of the models missing from the limits given to the client. OPENAI_RPM_LIMIT and OPENAI_TPM_LIMIT override
+it."""
+
+RETRIED_STATUS = {408, 409, 429, 500, 502, 503, 504}
+""" HTTP status of the errors worth retrying."""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second, holding at most `capacity` tokens. Reservations may
+    overdraw it: the caller then waits until the debt is paid back, which keeps the callers in order under load.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds=5.0):
+        """
+        :param per_minute: Tokens added per minute.
+        :param burst_seconds: Capacity of the bucket, in seconds of refill.
+        """
+        self.burst_seconds = burst_seconds
+        self._lock = threading.Lock()
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def set_rate(self, per_minute: float):
+        with self._lock:
+            self._refill()
+            self.rate = per_minute / 60
+            self.capacity = max(1.0, self.rate * self.burst_seconds)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount tokens.
+        :return: Seconds to wait before using them.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def give_back(self, amount: float):
+        """
+        Correct a reservation, amount being negative when more tokens were used than reserved.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class _ModelState:
+    """
+    Buckets and counters of a model.
+    """
+
+    def __init__(self, limits: ModelLimits, headroom: float):
+        self.limits = limits
+        self.headroom = headroom
+        self.factor = 1.0
+        """ Share of the quota currently used, lowered by rate limit errors."""
+        self.requests = TokenBucket(limits.requests_per_minute * headroom)
+        self.tokens = TokenBucket(limits.tokens_per_minute * headroom)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.sent = 0
+        self.succeeded = 0
+        self.used_tokens = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.waited_seconds = 0.0
+
+    def _apply_factor(self):
+        self.requests.set_rate(self.limits.requests_per_minute * self.headroom * self.factor)
+        self.tokens.set_rate(self.limits.tokens_per_minute * self.headroom * self.factor)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate_limited += 1
+            self.factor = max(0.1, self.factor * 0.7)
+            self._apply_factor()
+
+    def speed_up(self):
+        with self.lock:
+            if self.factor < 1.0:
+                self.factor = min(1.0, self.factor + 0.02)
+                self._apply_factor()
+
+    def stats(self) -> dict:
+        minutes = (time.monotonic() - self.started) / 60
+        requests_per_minute = self.succeeded / minutes if minutes > 0 else 0.0
+        tokens_per_minute = self.used_tokens / minutes if minutes > 0 else 0.0
+        return {
+            'requests': self.succeeded,
+            'attempts': self.sent,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'tokens': self.used_tokens,
+            'waited_seconds': self.waited_seconds,
+            'requests_per_minute': requests_per_minute,
+            'tokens_per_minute': tokens_per_minute,
+            'request_quota_used': requests_per_minute / self.limits.requests_per_minute,
+            'token_quota_used': tokens_per_minute / self.limits.tokens_per_minute,
+            'rate_factor': self.factor,
+        }
+
+
+def estimate_tokens(messages, max_tokens: Optional[int] = None, completion_tokens=500) -> int:
+    """
+    Rough token count of a request, about 4 characters per token, plus the expected completion.
+    """
+    prompt = sum(len(message.get('content') or '') for message in messages) // 4 + 4 * len(messages)
+    return prompt + (max_tokens if max_tokens is not None else completion_tokens)
+
+
+def _retry_after(error) -> Optional[float]:
+    """
+    :return: The seconds the server asked to wait before retrying, from the retry-after-ms or retry-after headers.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+def _is_retried(error) -> bool:
+    if getattr(error, 'status_code', None) in RETRIED_STATUS:
+        return True
+    from openai import APIConnectionError, APITimeoutError
+
+    return isinstance(error, (APIConnectionError, APITimeoutError))
+
+
+class _RateLimitedCompletions:
+    def __init__(self, owner: 'RateLimitedClient'):
+        self._owner = owner
+
+    def _before(self, model, messages, kwargs) -> tuple:
+        owner = self._owner
+        state = owner.model_state(model)
+        estimate = estimate_tokens(messages, kwargs.get('max_tokens'), owner.completion_tokens)
+        wait = max(state.requests.reserve(1), state.tokens.reserve(estimate))
+        with state.lock:
+            state.sent += 1
+            state.waited_seconds += wait
+        return state, estimate, wait
+
+    @staticmethod
+    def _after(state: _ModelState, estimate: int, completion):
+        usage = getattr(completion, 'usage', None)
+        used = getattr(usage, 'total_tokens', None) or estimate
+        state.tokens.give_back(estimate - used)
+        with state.lock:
+            state.succeeded += 1
+            state.used_tokens += used
+        state.speed_up()
+
+    def _delay(self, state: _ModelState, error, attempt: int) -> Optional[float]:
+        """
+        :return: Seconds to wait before the next attempt, None to give up and raise the error.
+        """
+        if attempt >= self._owner.max_retries or not _is_retried(error):
+            return None
+        if getattr(error, 'status_code', None) == 429:
+            state.slow_down()
+        with state.lock:
+            state.retries += 1
+        backoff = random.uniform(0, min(self._owner.max_delay, self._owner.base_delay * 2 ** attempt))
+        return max(backoff, _retry_after(error) or 0.0)
+
+    def create(self, model, messages, **kwargs):
+        attempt = 0
+        while True:
+            state, estimate, wait = self._before(model, messages, kwargs)
+            time.sleep(wait)
+            try:
+                completion = self._owner.client.chat.completions.create(model=model, messages=messages, **kwargs)
+            except Exception as error:
+                state.tokens.give_back(estimate)
+                delay = self._delay(state, error, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._after(state, estimate, completion)
+            return completion
+
+
+class _AsyncRateLimitedCompletions(_RateLimitedCompletions):
+    async def create(self, model, messages, **kwargs):
+        attempt = 0
+        while True:
+            state, estimate, wait = self._before(model, messages, kwargs)
+            await asyncio.sleep(wait)
+            try:
+                completion = await self._owner.client.chat.completions.create(model=model, messages=messages,
+                                                                              **kwargs)
+            except Exception as error:
+                state.tokens.give_back(estimate)
+                delay = self._delay(state, error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._after(state, estimate, completion)
+            return completion
+
+
+class RateLimitedClient:
+    """
+    Wrap an OpenAI (or AsyncOpenAI) client so client.chat.completions.create is scheduled within the quota of each
+    model and retried on transient errors. Wrap it in a CachedChatClient, not the other way around, so cache hits do
+    not use the quota.
+    """
+
+    def __init__(self, client, limits: Optional[Dict[str, ModelLimits]] = None, default_limits=None,
+                 is_async=False, headroom=0.9, max_retries=6, base_delay=0.5, max_delay=60.0,
+                 completion_tokens=500):
+        """
+        :param client: The OpenAI or AsyncOpenAI client, created with max_retries=0 so retries are only done here.
+        :param limits: Quota of each model.
+        :param default_limits: Quota of the other models, DEFAULT_LIMITS or the environment by default.
+        :param is_async: The client is an AsyncOpenAI.
+        :param headroom: Share of the quota aimed at. The 5 seconds of burst of the buckets stay within a minute quota
+        as long as headroom is at most 0.9.
+        :param max_retries: Retries of a request before raising its error.
+        :param base_delay: Backoff of the first retry, doubled at each retry, in seconds.
+        :param max_delay: Maximum backoff, in seconds.
+        :param completion_tokens: Expected completion tokens of requests without max_tokens.
+        """
+        self.client = client
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits or ModelLimits(
+            float(os.environ.get('OPENAI_RPM_LIMIT', DEFAULT_LIMITS.requests_per_minute)),
+            float(os.environ.get('OPENAI_TPM_LIMIT', DEFAULT_LIMITS.tokens_per_minute)))
+        self.headroom = headroom
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens
+        self._states = {}
+        self._lock = threading.Lock()
+        completions_class = _AsyncRateLimitedCompletions if is_async else _RateLimitedCompletions
+        self.chat = SimpleNamespace(completions=completions_class(self))
+
+    def model_state(self, model: str) -> _ModelState:
+        with self._lock:
+            if model not in self._states:
+                self._states[model] = _ModelState(self.limits.get(model, self.default_limits), self.headroom)
+            return self._states[model]
+
+    def stats(self) -> dict:
+        """
+        :return: Throughput of each model since its first request, and the share of its quota it represents.
+        """
+        with self._lock:
+            states = dict(self._states)
+        return {model: state.stats() for model, state in states.items()}
+
+    def report(self) -> str:
+        lines = []
+        for model, stats in self.stats().items():
+            lines.append(
+                "{model}: {requests} requests ({requests_per_minute:.0f}/min, {request_quota_used:.0%} of quota), "
+                "{tokens} tokens ({tokens_per_minute:.0f}/min, {token_quota_used:.0%} of quota), {retries} retries, "
+                "{rate_limited} rate limited, {waited_seconds:.1f}s throttled".format(model=model, **stats))
+        return "\n".join(lines)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_client(is_async=False, timeout=60.0) -> RateLimitedClient:
+    """
+    The client of the process, created on first call with the API key of the environment or of the .env file. Its
+    HTTP connections are reused by every request.
+    :param is_async: Get the AsyncOpenAI based client. Use it from a single event loop.
+    :param timeout: Seconds before a request is abandoned and retried, used on creation only.
+    """
+    with _shared_lock:
+        if is_async not in _shared:
+            from dotenv import load_dotenv
+            from openai import AsyncOpenAI, OpenAI
+
+            load_dotenv()
+            client = (AsyncOpenAI if is_async else OpenAI)(max_retries=0, timeout=timeout)
+            _shared[is_async] = RateLimitedClient(client, is_async=is_async)
+        return _shared[is_async]
@@ -1,11 +1,12 @@
+import asyncio
 from random import randrange
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, Optional
 
-from openai import OpenAI
-from dotenv import load_dotenv
+from generators.OpenAI.cache import HeadlineDeduplicator, DuplicateHeadlineError
 from models.db_model import Posts
 
-# Load API-KEY from a .env file.
-load_dotenv()
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 
 # @todo add a percentage a posts that can be 'list' or 'top 10' style.
@@ -61,66 +62,64 @@ class PostDetails:
         pass
 
 
-def generate_post(post_details: PostDetails, verbose=False) -> Posts:
+def default_client(is_async=False):
     """
-    Uses OpenAI API to generate a post with random content and matching title. This only fill content and headline!
-    :param verbose: Print debugging information about the prompts and results.
+    The client used when none is given: the rate limited client shared by the process, see
+    generators/OpenAI/client.py. The openai package is only imported on first call, so importing the generators stays
+    cheap.
+    :param is_async: Get the AsyncOpenAI based client instead.
+    :return: The shared RateLimitedClient.
+    """
+    from generators.OpenAI.client import shared_client
+
+    return shared_client(is_async)
+
+
+def _build_title_prompt(post_details: PostDetails) -> str:
+    """
+    Build the prompt used to request the headline of a post.
     :param post_details: PostDetails that holds information about the post creation.
-   :return: A newly created and filled Post
-   """
-    # Preparing the title prompt based on our parameters.
-    ai_instruction_title = (
-        (post_details.force_title if (post_details.force_title is not None)
-         else
-         "Generate the title, and only the title, of a social media post. The content must be \033[1m{is_true}\033[0m "
-         "and be about\033[1m{theme}\033[0m. The post must be informative. Do not generate title like '10 proven "
-         "facts' or '10 proven benefits'"
-         "or '10 proven reasons'.".format(
-             is_true="true" if post_details.is_info_true else "fake",
-             theme=post_details.theme)))
-
-    client = OpenAI()
-
-    # Request for creating the title.
-    completion_headline = client.chat.completions.create(
-        model=post_details.ai_model,
-        messages=[
-            {"role": "user", "content": ai_instruction_title},
-        ]
-    )
-    if verbose:
-        print("\033[92mTitle prompt:\033[0m\n{}".format(ai_instruction_title))
-        print("\033[92mHeadline:\n\033[0m\033[1m{}\033[0m".format(completion_headline.choices[0].message.content))
+    :return: The title prompt.
+    """
+    return (post_details.force_title if (post_details.force_title is not None)
+            else
+            "Generate the title, and only the title, of a social media post. The content must be {is_true} and be "
+            "about {theme}. The post must be informative. Do not generate title like '10 proven facts' or '10 proven "
+            "benefits' or '10 proven reasons'.".format(
+                is_true="true" if post_details.is_info_true else "fake",
+                theme=post_details.theme))
 
-    # Preparing the content prompt based on our parameters and the result of the title prompt.
-    ai_instruction_content = ((
-        "Generate the content of a social media post based on this title: \033[1m{title}\033[0m. The "
-        "content must be \033[1m{is_true}\033[0m. The post"
-        "must be informative. Limit the size from \033[1m{min_char}\033[0m to \033[1m{max_char}\033[0m characters. Do "
-        "not add any"
+
+def _build_content_prompt(post_details: PostDetails, title: str) -> str:
+    """
+    Build the prompt used to request the content of a post, based on its already generated title.
+    :param post_details: PostDetails that holds information about the post creation.
+    :param title: The generated headline of the post.
+    :return: The content prompt.
+    """
+    return ((
+        "Generate the content of a social media post based on this title: {title}. The content must be {is_true}. "
+        "The post must be informative. Limit the size from {min_char} to {max_char} characters. Do not add any "
         "hashtag '#' at the end. Avoid repeating the title in the content.").format(
-        title=completion_headline.choices[0].message.content,
-        is_true=post_details.is_info_true,
+        title=title,
+        is_true="true" if post_details.is_info_true else "fake",
         min_char=post_details.min_char,
         max_char=post_details.max_char)
     )
 
-    # Request for creating the content, based on given title.
-    completion_content = client.chat.completions.create(
-        model=post_details.ai_model,
-        messages=[
-            {"role": "user", "content": ai_instruction_content},
-        ]
-    )
-    if verbose:
-        print("\033[96mContent prompt:\033[0m\n{}".format(ai_instruction_content))
-        print("\033[96mContent:\n\033[0m{}".format(completion_content.choices[0].message.content))
 
-    # Create the post with the generated contents. Other values does not matter here.
-    post_model = Posts(
+def _build_post_model(post_details: PostDetails, headline: str, content: str) -> Posts:
+    """
+    Create the post with the generated contents. Other values does not matter here.
+    :param post_details: PostDetails used to generate the post.
+    :param headline: The generated headline.
+    :param content: The generated content.
+    :return: A newly created and filled Post
+    """
+    return Posts(
         ms_id='0',
-        headline=completion_headline.choices[0].message.content,
-        content=completion_content.choices[0].message.content,
+        headline=headline,
+        content=content,
         is_true_fact=post_details.is_info_true,
         number_of_likes=10,
         number_of_dislike=12,
@@ -136,15 +135,151 @@ def generate_post(post_details: PostDetails, verbose=False) -> Posts:
         changes_to_credibility_on_flag=18,
         fk_source_id=1
     )
-    return post_model
-
-
-# Test call of our generation function.
-post = generate_post(
-    PostDetails(
-        is_true_percentage=0,
-        no_hashtag=False,
-        min_char=600,
-        max_char=800,
-        specific_theme=None),
-    verbose=True)
+
+
+def generate_post(post_details: PostDetails, verbose=False, client=None,
+                  deduplicator: Optional[HeadlineDeduplicator] = None, max_title_attempts=3) -> Posts:
+    """
+    Uses OpenAI API to generate a post with random content and matching title. This only fill content and headline!
+    :param verbose: Print debugging information about the prompts and results.
+    :param post_details: PostDetails that holds information about the post creation.
+    :param client: OpenAI client to use, for instance a CachedChatClient. The shared client by default.
+    :param deduplicator: When given, headlines too close to a previous one are generated again, before the content is
+    requested.
+    :param max_title_attempts: Number of headlines requested before giving up with DuplicateHeadlineError.
+   :return: A newly created and filled Post
+   """
+    # Preparing the title prompt based on our parameters.
+    ai_instruction_title = _build_title_prompt(post_details)
+
+    if client is None:
+        client = default_client()
+
+    for _ in range(max_title_attempts):
+        # Request for creating the title.
+        completion_headline = client.chat.completions.create(
+            model=post_details.ai_model,
+            messages=[
+                {"role": "user", "content": ai_instruction_title},
+            ]
+        )
+        if verbose:
+            print("\033[92mTitle prompt:\033[0m\n{}".format(ai_instruction_title))
+            print("\033[92mHeadline:\n\033[0m\033[1m{}\033[0m".format(completion_headline.choices[0].message.content))
+        if deduplicator is None or deduplicator.add(completion_headline.choices[0].message.content):
+            break
+    else:
+        raise DuplicateHeadlineError("Only duplicated headlines after {} attempts for theme '{}'".format(
+            max_title_attempts, post_details.theme))
+
+    # Preparing the content prompt based on our parameters and the result of the title prompt.
+    ai_instruction_content = _build_content_prompt(post_details, completion_headline.choices[0].message.content)
+
+    # Request for creating the content, based on given title.
+    completion_content = client.chat.completions.create(
+        model=post_details.ai_model,
+        messages=[
+            {"role": "user", "content": ai_instruction_content},
+        ]
+    )
+    if verbose:
+        print("\033[96mContent prompt:\033[0m\n{}".format(ai_instruction_content))
+        print("\033[96mContent:\n\033[0m{}".format(completion_content.choices[0].message.content))
+
+    return _build_post_model(post_details,
+                             completion_headline.choices[0].message.content,
+                             completion_content.choices[0].message.content)
+
+
+async def _generate_post_async(client: 'AsyncOpenAI', post_details: PostDetails, semaphore: asyncio.Semaphore,
+                               deduplicator: Optional[HeadlineDeduplicator] = None, max_title_attempts=3) -> Posts:
+    """
+    Async counterpart of generate_post. The title and content requests of a single post stay sequential, since the
+    content prompt needs the title, but the semaphore slot is held for both so a post is never left half generated.
+    :param client: The async OpenAI client used for the requests.
+    :param post_details: PostDetails that holds information about the post creation.
+    :param semaphore: Semaphore bounding the number of posts in flight.
+    :param deduplicator: See generate_post.
+    :param max_title_attempts: See generate_post.
+    :return: A newly created and filled Post
+    """
+    async with semaphore:
+        for _ in range(max_title_attempts):
+            completion_headline = await client.chat.completions.create(
+                model=post_details.ai_model,
+                messages=[
+                    {"role": "user", "content": _build_title_prompt(post_details)},
+                ]
+            )
+            headline = completion_headline.choices[0].message.content
+            if deduplicator is None or deduplicator.add(headline):
+                break
+        else:
+            raise DuplicateHeadlineError("Only duplicated headlines after {} attempts for theme '{}'".format(
+                max_title_attempts, post_details.theme))
+
+        completion_content = await client.chat.completions.create(
+            model=post_details.ai_model,
+            messages=[
+                {"role": "user", "content": _build_content_prompt(post_details, headline)},
+            ]
+        )
+    return _build_post_model(post_details, headline, completion_content.choices[0].message.content)
+
+
+async def generate_posts(details_list: Iterable[PostDetails], concurrency=8, client: Optional['AsyncOpenAI'] = None,
+                         deduplicator: Optional[HeadlineDeduplicator] = None,
+                         failed: Optional[list] = None) -> AsyncIterator[Posts]:
+    """
+    Generate many posts concurrently, with at most `concurrency` posts being generated at the same time.
+    Posts are yielded as soon as they are finished, so the order does not match details_list. A post whose generation
+    fails is reported and skipped, the other posts go on.
+    :param details_list: PostDetails of every post to generate.
+    :param concurrency: Maximum number of posts in flight.
+    :param client: Async OpenAI client to use. Pass one with a custom base_url to target a local fake server, or a
+    CachedChatClient(..., is_async=True).
+    :param deduplicator: See generate_post.
+    :param failed: If given, receives the (PostDetails, error) of every post that could not be generated.
+    :return: An async iterator over the newly created Posts.
+    """
+    assert concurrency > 0, 'concurrency must be greater than 0'
+    if client is None:
+        client = default_client(is_async=True)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(details: PostDetails):
+        try:
+            return await _generate_post_async(client, details, semaphore, deduplicator)
+        except Exception as e:
+            print("The post on '{}' could not be generated: {}".format(details.theme, e))
+            if failed is not None:
+                failed.append((details, e))
+            return None
+
+    tasks = [asyncio.ensure_future(generate(details)) for details in details_list]
+    try:
+        for next_finished in asyncio.as_completed(tasks):
+            post = await next_finished
+            if post is not None:
+                yield post
+    finally:
+        # The consumer stopped early: do not leave requests running in the background.
+        for task in tasks:
+            task.cancel()
+
+
+def main():
+    # Test call of our generation function.
+    generate_post(
+        PostDetails(
+            is_true_percentage=0,
+            no_hashtag=False,
+            min_char=600,
+            max_char=800,
+            specific_theme=None),
+        verbose=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+"""
+Seed the posts of a study through a pipeline of three stages connected by bounded queues:
+
+    generate (LLM or stub) -> transform (validate and build the row) -> insert (batched, committed)
+
+Each stage runs its own number of worker threads, the generate stage can run in worker processes instead. Every
+committed batch records its posts in seeding_checkpoints within the same transaction, so running the same command
+again after a crash only generates the missing posts. The stub generator runs fully offline.
+
+    python -m generators.seeding --study 1 --posts 2000 --generator stub --generate-workers 8
+    python -m generators.seeding --study 1 --posts 200 --generator openai --generate-workers 16 --processes
+"""
+import argparse
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.engine import Engine
+
+from models.db_model import Posts, SeedingCheckpoints
+from queries.ingest import BatchIngestor
+
+_STOP = object()
+""" Sent through the queues once a stage has no more items."""
+
+
+class SeedingJob(NamedTuple):
+    study_id: int
+    posts: int
+    true_percentage: int = 50
+    source_ids: tuple = (1,)
+    seed: int = 0
+    stub_delay: float = 0.0
+    """ Seconds the stub generator sleeps per post, to simulate the latency of an LLM."""
+    min_content_length: int = 50
+    """ Generated contents shorter than this are rejected by the transform stage."""
+
+
+def _rng(job: SeedingJob, item: int) -> random.Random:
+    """
+    :return: A random generator specific to a post, so a resumed run generates the same posts.
+    """
+    return random.Random("{}-{}-{}".format(job.seed, job.study_id, item))
+
+
+def stub_generate(job: SeedingJob, item: int) -> dict:
+    """
+    Offline generator, producing deterministic placeholder posts.
+    """
+    rng = _rng(job, item)
+    if job.stub_delay:
+        time.sleep(job.stub_delay)
+    is_true_fact = rng.randrange(100) < job.true_percentage
+    return {
+        'headline': "Stub headline {} of study {}".format(item, job.study_id),
+        'content': " ".join(rng.choice(("lorem", "ipsum", "dolor", "sit", "amet"))
+                            for _ in range(rng.randint(20, 80))),
+        'is_true_fact': is_true_fact,
+    }
+
+
+def openai_generate(job: SeedingJob, item: int) -> dict:
+    """
+    Generate a post with generate_post. The OpenAI client is created once per worker process.
+    """
+    from generators.OpenAI.post_generator import PostDetails, default_client, generate_post
+
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = default_client()
+    post = generate_post(PostDetails(is_true_percentage=job.true_percentage, no_hashtag=True), client=_openai_client)
+    return {'headline': post.headline, 'content': post.content, 'is_true_fact': post.is_true_fact}
+
+
+_openai_client = None
+
+GENERATORS = {'stub': stub_generate, 'openai': openai_generate}
+
+
+def transform(job: SeedingJob, item: int, generated: dict) -> dict:
+    """
+    Validate a generated post and build its posts row.
+    :raise ValueError: If the generated post is unusable.
+    """
+    headline, content = (generated.get('headline') or '').strip(), (generated.get('content') or '').strip()
+    if not headline:
+        raise ValueError("empty headline")
+    if len(content) < job.min_content_length:
+        raise ValueError("content of {} characters".format(len(content)))
+    rng = _rng(job, item)
+    return {
+        'ms_id': str(item), 'fk_linked_study': job.study_id, 'fk_source_id': rng.choice(job.source_ids),
+        'headline': headline, 'content': content, 'is_true_fact': bool(generated['is_true_fact']),
+        'number_of_likes': 0, 'number_of_dislike': 0, 'number_of_shared': 0, 'number_of_flagged': 0,
+        'changes_to_follower_on_like': rng.randint(0, 20), 'changes_to_follower_on_dislike': rng.randint(-20, 0),
+        'changes_to_follower_on_share': rng.randint(0, 30), 'changes_to_follower_on_flag': rng.randint(-30, 30),
+        'changes_to_credibility_on_like': rng.randint(-20, 20),
+        'changes_to_credibility_on_dislike': rng.randint(-20, 20),
+        'changes_to_credibility_on_share': rng.randint(-30, 30),
+        'changes_to_credibility_on_flag': rng.randint(-30, 30),
+    }
+
+
+class StageMetrics:
+    """
+    Throughput of a stage, updated by its workers.
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, processed=0, failed=0):
+        with self._lock:
+            self.busy_seconds += seconds
+            self.processed += processed
+            self.failed += failed
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def items_per_second(self) -> float:
+        return self.processed / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """
+        :return: Share of the time the workers spent working rather than waiting on the queues.
+        """
+        return self.busy_seconds / (self.seconds * self.workers) if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return "{:<10} {:>7} ok {:>5} failed {:>9.1f} items/s  {:>4.0%} busy ({} workers)".format(
+            self.name, self.processed, self.failed, self.items_per_second, self.utilization, self.workers)
+
+
+class _Stage:
+    """
+    Worker threads taking items from inbox and putting their results in outbox. The last worker to stop sends one
+    _STOP per worker of the next stage.
+    """
+
+    def __init__(self, name: str, workers: int, inbox: queue.Queue, outbox: Optional[queue.Queue], downstream: int):
+        assert workers > 0, 'workers must be greater than 0'
+        self.metrics = StageMetrics(name, workers)
+        self.inbox = inbox
+        self.outbox = outbox
+        self.downstream = downstream
+        self._running = workers
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, name="{}-{}".format(name, i), daemon=True)
+                        for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def process(self, item):
+        """
+        Handle one item, returning the item for the next stage or None to drop it.
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Called by each worker once the inbox is exhausted.
+        """
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                break
+            start = time.perf_counter()
+            try:
+                result = self.process(item)
+            except Exception as e:
+                number = item[0] if isinstance(item, tuple) else item
+                print("{}: post {} failed: {}".format(self.metrics.name, number, e))
+                self.metrics.record(time.perf_counter() - start, failed=1)
+                continue
+            self.metrics.record(time.perf_counter() - start, processed=1)
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+        self.stop()
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last:
+            self.metrics.finished = time.perf_counter()
+            if self.outbox is not None:
+                for _ in range(self.downstream):
+                    self.outbox.put(_STOP)
+
+
+class _GenerateStage(_Stage):
+    def __init__(self, job: SeedingJob, generate: Callable, executor: Optional[ProcessPoolExecutor], retries: int,
+                 *args):
+        super().__init__(*args)
+        self.job = job
+        self.generate = generate
+        self.executor = executor
+        self.retries = retries
+
+    def process(self, item):
+        for attempt in range(self.retries + 1):
+            try:
+                if self.executor is not None:
+                    return item, self.executor.submit(self.generate, self.job, item).result()
+                return item, self.generate(self.job, item)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+
+
+class _TransformStage(_Stage):
+    def __init__(self, job: SeedingJob, *args):
+        super().__init__(*args)
+        self.job = job
+
+    def process(self, item):
+        number, generated = item
+        return number, transform(self.job, number, generated)
+
+
+class _InsertStage(_Stage):
+    """
+    Each worker owns a BatchIngestor, committing its batch along with the matching checkpoints.
+    """
+
+    def __init__(self, job: SeedingJob, engine: Engine, batch_size: int, verbose: bool, *args):
+        super().__init__(*args)
+        self.job = job
+        self.engine = engine
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self._local = threading.local()
+
+    def _worker(self):
+        if not hasattr(self._local, 'ingestor'):
+            self._new_ingestor()
+        return self._local
+
+    def _new_ingestor(self):
+        local = self._local
+        local.items = []
+        local.ingestor = BatchIngestor(self.engine, Posts, self.batch_size, self.verbose, on_flush=self._checkpoint)
+
+    def _checkpoint(self, connection, rows):
+        connection.execute(insert(SeedingCheckpoints),
+                           [{'fk_study_id': self.job.study_id, 'item': item} for item in self._local.items])
+
+    def _flush(self):
+        local = self._worker()
+        try:
+            local.ingestor.flush()
+        except Exception as e:
+            # Dropped without checkpoint: the next run generates these posts again.
+            print("insert: batch of {} posts lost: {}".format(len(local.items), e))
+            self.metrics.record(0.0, processed=-len(local.items), failed=len(local.items))
+            self._new_ingestor()
+            return
+        local.items = []
+
+    def process(self, item):
+        number, row = item
+        local = self._worker()
+        local.items.append(number)
+        if local.ingestor.add(row):
+            self._flush()
+
+    def stop(self):
+        self._flush()
+
+
+def completed_items(engine: Engine, study_id: int) -> set:
+    """
+    :return: The posts of a study already inserted by previous runs.
+    """
+    with engine.connect() as connection:
+        return set(connection.execute(select(SeedingCheckpoints.item)
+                                      .where(SeedingCheckpoints.fk_study_id == study_id)).scalars())
+
+
+def seed_study(engine: Engine, job: SeedingJob, generator='stub', generate_workers=4, transform_workers=1,
+               insert_workers=1, processes=False, queue_size=100, batch_size=50, retries=2, verbose=False) -> list:
+    """
+    Generate and insert the posts of job.study_id missing from the checkpoints.
+    :param engine: The engine to insert with.
+    :param job: What to seed.
+    :param generator: A name of GENERATORS, or a function (job, item) -> dict with headline, content and
+    is_true_fact. It must be a module level function when processes is True.
+    :param generate_workers: Number of posts generated at the same time.
+    :param transform_workers: Number of transform threads.
+    :param insert_workers: Number of insert threads, each with its own batch and connection.
+    :param processes: Generate in a pool of generate_workers processes instead of threads.
+    :param queue_size: Capacity of each queue between two stages.
+    :param batch_size: Posts per committed batch.
+    :param retries: Attempts of the generation of a post after the first failure.
+    :param verbose: Print each committed batch.
+    :return: The StageMetrics of the generate, transform and insert stages.
+    """
+    generate = GENERATORS[generator] if isinstance(generator, str) else generator
+    done = completed_items(engine, job.study_id)
+    todo = [item for item in range(job.posts) if item not in done]
+    if verbose:
+        print("{} posts to seed, {} already done".format(len(todo), job.posts - len(todo)))
+
+    generated, transformed = queue.Queue(queue_size), queue.Queue(queue_size)
+    feed = queue.Queue(queue_size)
+    executor = ProcessPoolExecutor(generate_workers) if processes else None
+    stages = [
+        _GenerateStage(job, generate, executor, retries, 'generate', generate_workers, feed, generated,
+                       transform_workers),
+        _TransformStage(job, 'transform', transform_workers, generated, transformed, insert_workers),
+        _InsertStage(job, engine, batch_size, verbose, 'insert', insert_workers, transformed, None, 0),
+    ]
+    try:
+        for stage in stages:
+            stage.start()
+        for item in todo:
+            feed.put(item)
+        for _ in range(generate_workers):
+            feed.put(_STOP)
+        for stage in stages:
+            stage.join()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return [stage.metrics for stage in stages]
+
+
+def main():
+    from db import get_engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--study', type=int, required=True, help="Id of the study to seed, it must exist.")
+    parser.add_argument('--posts', type=int, required=True, help="Total number of posts of the study.")
+    parser.add_argument('--generator', choices=sorted(GENERATORS), default='stub')
+    parser.add_argument('--true-percentage', type=int, default=50)
+    parser.add_argument('--sources', type=int, nargs='+', default=[1], help="Ids of the sources of the posts.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stub-delay', type=float, default=0.0, help="Simulated generation latency, in seconds.")
+    parser.add_argument('--generate-workers', type=int, default=4)
+    parser.add_argument('--transform-workers', type=int, default=1)
+    parser.add_argument('--insert-workers', type=int, default=1)
+    parser.add_argument('--processes', action='store_true', help="Generate in worker processes.")
+    parser.add_argument('--queue-size', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--verbose', action='store_true')
+    arguments = parser.parse_args()
+
+    job = SeedingJob(study_id=arguments.study, posts=arguments.posts, true_percentage=arguments.true_percentage,
+                     source_ids=tuple(arguments.sources), seed=arguments.seed, stub_delay=arguments.stub_delay)
+    metrics = seed_study(get_engine(), job, arguments.generator, arguments.generate_workers,
+                         arguments.transform_workers, arguments.insert_workers, arguments.processes,
+                         arguments.queue_size, arguments.batch_size, verbose=arguments.verbose)
+    for stage in metrics:
+        print(stage)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+Offline, seeded generator of a realistic dataset for the whole schema, for benchmarks and local testing.
+
+Post popularity and participant activity follow Zipf-like distributions, fake posts get flagged more than true ones,
+and the follower/credibility values of the interactions follow the score changes of the posts, so the dataset is
+consistent with queries.score_replay.
+
+    python -m generators.workload --interactions 1000000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models.blobs import blob_store
+from models.db_model import (AdminUsers, Comments, CommentsInteractions, Participants, Posts, PostsInteractions,
+                             Sources, Studies, StudyAdvancedSettings, StudyBasicSettings, StudyPagesSettings,
+                             StudyUiSettings)
+from queries.ingest import ingest
+
+REACTIONS = (('like', 0.55), ('dislike', 0.25), ('none', 0.20))
+""" Distribution of reaction_type."""
+
+DEFAULT_AVATARS = 5
+""" Distinct avatars shared by the participants, as with gen_random_default_avatars."""
+
+AVATAR_BYTES = 4096
+""" Size of the synthetic avatars and styles."""
+
+
+class WorkloadSummary(NamedTuple):
+    study_ids: list
+    sources: int
+    posts: int
+    comments: int
+    participants: int
+    posts_interactions: int
+    comments_interactions: int
+
+
+def _zipf_weights(count: int, exponent: float, rng: random.Random) -> list:
+    """
+    :return: Cumulative weights of count items, the popularity of the k-th item being 1 / k^exponent, shuffled.
+    """
+    weights = [1 / (rank ** exponent) for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return list(accumulate(weights))
+
+
+def _ids(engine: Engine, query) -> list:
+    with engine.connect() as connection:
+        return list(connection.execute(query).scalars())
+
+
+def generate_workload(engine: Engine, studies=1, sources=20, posts_per_study=500, comments_per_post=2,
+                      participants_per_study=1000, interactions=100000, comment_interaction_ratio=0.2, seed=0,
+                      batch_size=10000, verbose=False) -> WorkloadSummary:
+    """
+    Insert a synthetic dataset. Tables must exist, rows already present are left untouched.
+    :param engine: The engine to insert with.
+    :param studies: Number of studies, each with its own settings, posts and participants.
+    :param sources: Number of sources, shared by every study.
+    :param posts_per_study: Number of posts of each study.
+    :param comments_per_post: Number of comments of each post.
+    :param participants_per_study: Number of participants of each study.
+    :param interactions: Total number of post interactions, spread over the studies.
+    :param comment_interaction_ratio: Number of comment interactions per post interaction.
+    :param seed: Seed of the random generator, the same seed gives the same dataset.
+    :param batch_size: Rows per insert batch.
+    :param verbose: Print the insertion throughput.
+    :return: What has been inserted.
+    """
+    rng = random.Random(seed)
+    # Separate generator, so the blobs do not change the rest of the dataset.
+    blob_rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+
+    with Session(engine) as session:
+        admin = AdminUsers(access_right=1, created_at=start)
+        avatar_ids = blob_store.put_many(session, (blob_rng.randbytes(AVATAR_BYTES) for _ in range(DEFAULT_AVATARS)))
+        source_blob_ids = blob_store.put_many(session, (blob_rng.randbytes(AVATAR_BYTES) for _ in range(2 * sources)))
+        source_rows = [Sources(ms_id=str(i), name="Source {}".format(i), fk_style_blob=source_blob_ids[2 * i],
+                               fk_avatar_blob=source_blob_ids[2 * i + 1], max_posts=posts_per_study,
+                               true_post_percentage=rng.randint(20, 80), created_at=start)
+                       for i in range(sources)]
+        session.add(admin)
+        session.add_all(source_rows)
+        session.flush()
+        study_rows = []
+        for i in range(studies):
+            study = Studies(
+                ui_settings=StudyUiSettings(display_posts_in_feed=True, display_followers=True,
+                                            display_credibility=True, display_progress=True,
+                                            display_number_of_reactions=True, allow_multiple_reactions=False,
+                                            post_enabled_reactions=True, comment_enabled_reactions=True),
+                basic_settings=StudyBasicSettings(name="Study {}".format(i), description="Synthetic study",
+                                                  prompt="", length=posts_per_study, require_reactions=True,
+                                                  require_comments=False, require_identification=False),
+                advanced_settings=StudyAdvancedSettings(minimum_comment_length=10, prompt_delay_seconds=0,
+                                                        react_delay_seconds=0, gen_completion_code=0,
+                                                        completion_code_digits=6,
+                                                        gen_random_default_avatars=DEFAULT_AVATARS),
+                pages_settings=StudyPagesSettings(pre_intro="", pre_intro_delay_seconds=0, rules="",
+                                                  rules_delay_seconds=0, post_intro="", post_intro_delay_seconds=0,
+                                                  debrief=""),
+                opened_by=admin, closed_by=admin, opened_at=start, created_at=start)
+            study_rows.append(study)
+        session.add_all(study_rows)
+        session.commit()
+        source_ids = [source.id for source in source_rows]
+        study_ids = [study.id for study in study_rows]
+
+    totals = dict(posts=0, comments=0, participants=0, posts_interactions=0, comments_interactions=0)
+    for study_number, study_id in enumerate(study_ids):
+        study_interactions = interactions // studies + (1 if study_number < interactions % studies else 0)
+
+        posts = [{
+            'ms_id': str(i), 'fk_linked_study': study_id, 'headline': "Synthetic headline {}".format(i),
+            'content': "Synthetic content " * rng.randint(10, 40), 'is_true_fact': rng.random() < 0.5,
+            'number_of_likes': rng.randint(0, 500), 'number_of_dislike': rng.randint(0, 200),
+            'number_of_shared': rng.randint(0, 100), 'number_of_flagged': rng.randint(0, 50),
+            'changes_to_follower_on_like': rng.randint(0, 20), 'changes_to_follower_on_dislike': rng.randint(-20, 0),
+            'changes_to_follower_on_share': rng.randint(0, 30), 'changes_to_follower_on_flag': rng.randint(-30, 30),
+            'changes_to_credibility_on_like': rng.randint(-20, 20),
+            'changes_to_credibility_on_dislike': rng.randint(-20, 20),
+            'changes_to_credibility_on_share': rng.randint(-30, 30),
+            'changes_to_credibility_on_flag': rng.randint(-30, 30),
+            'fk_source_id': rng.choice(source_ids), 'created_at': start,
+        } for i in range(posts_per_study)]
+        ingest(engine, Posts, posts, batch_size, verbose)
+        post_ids = _ids(engine, select(Posts.id).where(Posts.fk_linked_study == study_id).order_by(Posts.id))
+        for post, post_id in zip(posts, post_ids):
+            post['id'] = post_id
+
+        ingest(engine, Comments, ({'fk_source_id': rng.choice(source_ids), 'fk_post_id': post_id,
+                                   'content': "Synthetic comment", 'created_at': start}
+                                  for post_id in post_ids for _ in range(comments_per_post)), batch_size, verbose)
+        comment_ids = _ids(engine, select(Comments.id).join(Posts, Comments.fk_post_id == Posts.id)
+                           .where(Posts.fk_linked_study == study_id))
+
+        ingest(engine, Participants, ({
+            'ms_id': i, 'fk_linked_study': study_id, 'session_id': "study{}-participant{}".format(study_id, i),
+            'fk_avatar_blob': avatar_ids[i % DEFAULT_AVATARS], 'username': "participant{}".format(i),
+            'nb_follower': 100, 'credibility_score': 50,
+            'game_start_time': start, 'game_finish_time': start + timedelta(hours=1), 'created_at': start,
+        } for i in range(participants_per_study)), batch_size, verbose)
+        participant_ids = _ids(engine, select(Participants.id).where(Participants.fk_linked_study == study_id)
+                               .order_by(Participants.id))
+
+        # Skewed activity: a few participants interact a lot, most only a little.
+        activity = _zipf_weights(len(participant_ids), 0.8, rng)
+        counts = dict.fromkeys(participant_ids, 0)
+        for participant_id in rng.choices(participant_ids, cum_weights=activity, k=study_interactions):
+            counts[participant_id] += 1
+        popularity = _zipf_weights(len(posts), 1.1, rng)
+
+        def post_interactions():
+            for participant_id, count in counts.items():
+                followers, credibility = 100, 50
+                for order, post in enumerate(rng.choices(posts, cum_weights=popularity, k=count)):
+                    reaction = rng.choices(REACTIONS, cum_weights=(0.55, 0.80, 1.0))[0][0]
+                    shared = rng.random() < 0.10
+                    flagged = rng.random() < (0.03 if post['is_true_fact'] else 0.15)
+                    follower_delta = ((post['changes_to_follower_on_like'] if reaction == 'like' else 0)
+                                      + (post['changes_to_follower_on_dislike'] if reaction == 'dislike' else 0)
+                                      + (post['changes_to_follower_on_share'] if shared else 0)
+                                      + (post['changes_to_follower_on_flag'] if flagged else 0))
+                    credibility_delta = ((post['changes_to_credibility_on_like'] if reaction == 'like' else 0)
+                                         + (post['changes_to_credibility_on_dislike'] if reaction == 'dislike' else 0)
+                                         + (post['changes_to_credibility_on_share'] if shared else 0)
+                                         + (post['changes_to_credibility_on_flag'] if flagged else 0))
+                    first_time = int(rng.lognormvariate(8, 0.8))
+                    yield {
+                        'order': order, 'fk_participant_id': participant_id, 'fk_post_id': post['id'],
+                        'reaction_type': reaction, 'flagged': flagged, 'shared': shared, 'fk_comment_id': None,
+                        'first_time_to_interact_ms': first_time,
+                        'last_interaction_time_ms': first_time + int(rng.expovariate(1 / 2000)),
+                        'user_follower_before': followers, 'user_follower_after': followers + follower_delta,
+                        'user_credibility_before': credibility,
+                        'user_credibility_after': credibility + credibility_delta,
+                        'created_at': start + timedelta(seconds=rng.randint(0, 30 * 24 * 3600)),
+                    }
+                    followers += follower_delta
+                    credibility += credibility_delta
+
+        totals['posts_interactions'] += ingest(engine, PostsInteractions, post_interactions(), batch_size,
+                                               verbose).rows
+
+        comment_interactions = int(study_interactions * comment_interaction_ratio)
+        if comment_ids:
+            totals['comments_interactions'] += ingest(engine, CommentsInteractions, ({
+                'fk_comment_id': rng.choice(comment_ids), 'fk_participant_id': rng.choice(participant_ids),
+                'reaction_type': rng.choices(REACTIONS, cum_weights=(0.55, 0.80, 1.0))[0][0],
+                'first_time_to_interact_ms': int(rng.lognormvariate(8, 0.8)), 'last_interaction_time_ms': 0,
+                'created_at': start + timedelta(seconds=rng.randint(0, 30 * 24 * 3600)),
+            } for _ in range(comment_interactions)), batch_size, verbose).rows
+
+        totals['posts'] += len(post_ids)
+        totals['comments'] += len(comment_ids)
+        totals['participants'] += len(participant_ids)
+
+    return WorkloadSummary(study_ids=study_ids, sources=len(source_ids), **totals)
+
+
+def main():
+    from db import get_engine
+    from models.db_model import Base
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--studies', type=int, default=1)
+    parser.add_argument('--sources', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=500, help="Posts per study.")
+    parser.add_argument('--participants', type=int, default=1000, help="Participants per study.")
+    parser.add_argument('--interactions', type=int, default=100000, help="Post interactions, for all studies.")
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    print(generate_workload(engine, studies=arguments.studies, sources=arguments.sources,
+                            posts_per_study=arguments.posts, participants_per_study=arguments.participants,
+                            interactions=arguments.interactions, seed=arguments.seed, verbose=True))
+
+
+if __name__ == '__main__':
+    main()
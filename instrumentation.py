@@ -0,0 +1,238 @@
+"""
+Query instrumentation for the SQLAlchemy engines.
+
+Nothing is hooked until QueryProfiler.attach() or query_budget() is used, so a disabled profiler costs nothing.
+
+    profiler = QueryProfiler(slow_threshold_ms=100)
+    profiler.attach(get_engine())
+    ...
+    print(profiler.report())
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, NamedTuple, Optional, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+""" Upper bounds of the latency histogram buckets, a last bucket holds everything slower."""
+
+_PARAMETER_LIST = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,?)+\)")
+_VALUES_LIST = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.IGNORECASE)
+_POSITIONAL = re.compile(r"\$\d+")
+_NUMBER = re.compile(r"\b\d+\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    Reduce a statement to its shape: literals and parameters become '?', and lists of parameters or of VALUES rows
+    collapse to one, so every execution of the same query shares a key whatever its parameters.
+    """
+    statement = _STRING.sub("?", statement)
+    # Before the numbers, which would leave $? behind.
+    statement = _POSITIONAL.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _PARAMETER_LIST.sub("(?)", statement)
+    statement = _VALUES_LIST.sub(r"\1", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+def _sync_engine(engine: Union[Engine, 'AsyncEngine']) -> Engine:
+    return getattr(engine, 'sync_engine', engine)
+
+
+class StatementStats:
+    """
+    Latency of every execution of a normalized statement.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, duration_ms: float):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.histogram[bisect_left(HISTOGRAM_BOUNDS_MS, duration_ms)] += 1
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def percentile_ms(self, percentile: float) -> float:
+        """
+        :return: The upper bound of the bucket holding the percentile, inf if it is in the last bucket.
+        """
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_MS + (float('inf'),), self.histogram):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class SlowQuery(NamedTuple):
+    statement: str
+    parameters: object
+    duration_ms: float
+    plan: Optional[str]
+
+
+class QueryProfiler:
+    """
+    Record the latency of every statement of the attached engines, keyed by normalized SQL, the number of ORM
+    queries of each session (in session.info['query_count']), and a log of the slow queries with their parameters
+    and their plan.
+    """
+
+    def __init__(self, slow_threshold_ms=200.0, explain_slow=True, max_slow_queries=1000):
+        """
+        :param slow_threshold_ms: Duration from which a statement is logged as slow.
+        :param explain_slow: Capture the EXPLAIN of slow SELECT statements.
+        :param max_slow_queries: Number of slow queries kept, the oldest are dropped.
+        """
+        self.slow_threshold_ms = slow_threshold_ms
+        self.explain_slow = explain_slow
+        self.statements = {}
+        self.slow_queries = deque(maxlen=max_slow_queries)
+        self._lock = threading.Lock()
+        self._engines = []
+        self._explaining = threading.local()
+
+    def attach(self, engine: Union[Engine, 'AsyncEngine']):
+        engine = _sync_engine(engine)
+        if engine in self._engines:
+            return
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        if not self._engines:
+            event.listen(Session, 'do_orm_execute', self._count_session_query)
+        self._engines.append(engine)
+
+    def detach(self, engine: Optional[Union[Engine, 'AsyncEngine']] = None):
+        """
+        Stop recording an engine, or every attached engine if None. Recorded data is kept.
+        """
+        engines = list(self._engines) if engine is None else [_sync_engine(engine)]
+        for engine in engines:
+            if engine not in self._engines:
+                continue
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.remove(engine, 'handle_error', self._handle_error)
+            self._engines.remove(engine)
+        if not self._engines and event.contains(Session, 'do_orm_execute', self._count_session_query):
+            event.remove(Session, 'do_orm_execute', self._count_session_query)
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+            self.slow_queries.clear()
+
+    def report(self, limit=20) -> str:
+        """
+        :return: The statements with the largest total time, one per line.
+        """
+        with self._lock:
+            rows = sorted(self.statements.items(), key=lambda item: item[1].total_ms, reverse=True)[:limit]
+        lines = ["{:>8} {:>10} {:>9} {:>9} {:>9}  {}".format("count", "total ms", "mean ms", "p95 ms", "max ms", "sql")]
+        for statement, stats in rows:
+            lines.append("{:>8} {:>10.1f} {:>9.2f} {:>9} {:>9.1f}  {}".format(
+                stats.count, stats.total_ms, stats.mean_ms, stats.percentile_ms(95), stats.max_ms, statement[:200]))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _count_session_query(orm_execute_state):
+        info = orm_execute_state.session.info
+        info['query_count'] = info.get('query_count', 0) + 1
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @staticmethod
+    def _handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_start_time'):
+            connection.info['query_start_time'].pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._explaining, 'active', False):
+            return
+        duration_ms = (time.perf_counter() - conn.info['query_start_time'].pop()) * 1000
+        key = normalize_sql(statement)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+            stats.add(duration_ms)
+
+        if duration_ms >= self.slow_threshold_ms:
+            plan = None
+            if self.explain_slow and not executemany and statement.lstrip()[:6].upper() == 'SELECT':
+                plan = self._explain(conn, statement, parameters)
+            self.slow_queries.append(SlowQuery(statement, parameters, duration_ms, plan))
+
+    def _explain(self, conn, statement, parameters) -> Optional[str]:
+        prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == 'sqlite' else "EXPLAIN "
+        self._explaining.active = True
+        try:
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                return "\n".join(str(row[-1]) for row in cursor.fetchall())
+            finally:
+                cursor.close()
+        except Exception as e:
+            return "EXPLAIN failed: {}".format(e)
+        finally:
+            self._explaining.active = False
+
+
+class QueryBudgetExceeded(AssertionError):
+    """ Raised by query_budget() when a block issues more statements than allowed."""
+
+
+@contextmanager
+def query_budget(max_queries: int, engine: Optional[Union[Engine, 'AsyncEngine']] = None):
+    """
+    Assert that the block issues at most max_queries statements, typically to catch N+1 queries in tests.
+
+        with query_budget(3, engine) as counter:
+            Posts.get_all_by_study_id(session, 1)
+
+    :param max_queries: The number of statements allowed.
+    :param engine: The engine to watch. Every engine when None.
+    :return: A dict whose 'count' and 'statements' are filled as the block runs.
+    """
+    target = Engine if engine is None else _sync_engine(engine)
+    counter = {'count': 0, 'statements': []}
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter['count'] += 1
+        counter['statements'].append(statement)
+
+    event.listen(target, 'before_cursor_execute', _count)
+    try:
+        yield counter
+    finally:
+        event.remove(target, 'before_cursor_execute', _count)
+    if counter['count'] > max_queries:
+        raise QueryBudgetExceeded("{} queries issued, the budget is {}:\n{}".format(
+            counter['count'], max_queries, "\n".join(counter['statements'])))
@@ -0,0 +1,101 @@
+"""
+Async counterparts of the lookup helpers of models.db_model, for AsyncSession.
+
+Lazy loading would need IO outside of an await, so every helper eagerly loads the relationships declared in the
+eager_relationships of the class and applies raiseload to the others: touching a relationship that was not loaded
+raises a clear error instead of trying to query.
+"""
+from typing import Optional, Type
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+
+from models.cache import settings_cache
+from models.db_model import (ModelType, loading_options, Posts, PostsInteractions, Sources, StudyAdvancedSettings,
+                             StudyBasicSettings, StudyPagesSettings, StudyUiSettings)
+
+CACHEABLE = (StudyUiSettings, StudyBasicSettings, StudyAdvancedSettings, StudyPagesSettings, Sources)
+""" Classes whose rows can be served from the settings cache."""
+
+
+def _async_options(table_class: Type[ModelType], loading) -> list:
+    return loading_options(table_class, loading) + [raiseload('*')]
+
+
+async def get_by_id(session: AsyncSession, table_class: Type[ModelType], query_id, loading=joinedload,
+                    use_cache=False) -> Optional[ModelType]:
+    """
+    :param session: The active AsyncSession
+    :param table_class: The class representing the database table to query
+    :param query_id: The id of the row to be retrieved
+    :param loading: Loading strategy for the eager_relationships of table_class
+    :param use_cache: Read through the settings cache. Only for the classes of CACHEABLE.
+    :return: The queried row as an instance of the table_class, a read-only snapshot of it (see models.cache) with
+    use_cache, or None if an error occurred
+    """
+    assert query_id > 0, 'id must be greater than 0'
+    if use_cache:
+        assert table_class in CACHEABLE, '{} is not cacheable'.format(table_class.__name__)
+        cached = settings_cache.lookup(table_class, query_id)
+        if cached is not None:
+            return cached
+        generation = settings_cache.generation(table_class, query_id)
+        return settings_cache.store(table_class, query_id, await get_by_id(session, table_class, query_id, loading),
+                                    generation)
+
+    try:
+        result = await session.execute(select(table_class)
+                                       .where(table_class.id == query_id)
+                                       .options(*_async_options(table_class, loading)))
+    except SQLAlchemyError as e:
+        error = str(e)
+        print(error)
+        return None
+    return result.unique().scalars().first()
+
+
+async def get_all_posts_by_study_id(session: AsyncSession, study_id, loading=selectinload):
+    """Retrieve all posts matching a study ID, see Posts.get_all_by_study_id.
+
+    :param session: The active AsyncSession.
+    :param study_id: The id of the study.
+    :param loading: Loading strategy for linked_study and source.
+    :return: A list of posts.
+    """
+    try:
+        result = await session.execute(select(Posts)
+                                       .where(Posts.fk_linked_study == study_id)
+                                       .options(*_async_options(Posts, loading)))
+    except SQLAlchemyError as e:
+        error = str(getattr(e, 'orig', e))
+        print(error)
+        return None
+    return list(result.unique().scalars().all())
+
+
+async def get_all_interactions_by_post_id(session: AsyncSession, post_id, loading=selectinload):
+    """Retrieve all posts interactions matching a post ID, see PostsInteractions.get_all_by_post_id.
+
+    :param session: The active AsyncSession.
+    :param post_id: The id of the post.
+    :param loading: Loading strategy for participant and post.
+    :return: A list of posts interactions.
+    """
+    try:
+        result = await session.execute(select(PostsInteractions)
+                                       .where(PostsInteractions.fk_post_id == post_id)
+                                       .options(*_async_options(PostsInteractions, loading)))
+    except SQLAlchemyError as e:
+        error = str(getattr(e, 'orig', e))
+        print(error)
+        return None
+    return list(result.unique().scalars().all())
+
+
+async def get_feed_page(session: AsyncSession, study_id, participant_id, after_id=0, limit=20):
+    """
+    Async counterpart of Posts.get_feed_page, with the same parameters and result.
+    """
+    return await session.run_sync(Posts.get_feed_page, study_id, participant_id, after_id, limit)
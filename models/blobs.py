@@ -0,0 +1,169 @@
+"""
+Content addressed storage of the avatars and styles, see the Blobs model.
+
+Identical contents are stored once: put() hashes the data and returns the id of the existing row when the content is
+already stored, so the default avatars shared by many participants take a single row. Sources and participants only
+hold the id of their blobs, so loading them no longer transfers the images.
+
+Reads return memoryviews over the buffer of the driver, or over a read only memory map of the local file cache when
+the store has a cache directory (BLOB_CACHE_DIR for blob_store). Blobs never change once stored, so cached files
+never need to be invalidated.
+
+    avatar_id = blob_store.put(session, png_bytes)
+    participant.fk_avatar_blob = avatar_id
+    image = blob_store.get(session, participant.fk_avatar_blob)
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.db_model import Blobs
+
+UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+""" INSERT ... ON CONFLICT constructs of the dialects deduplicating in a single statement."""
+
+
+def blob_hash(data) -> str:
+    """
+    :return: The hexadecimal sha256 of data, the key of its blob.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """
+    Write and read Blobs rows, optionally through a local file cache.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        :param cache_dir: Directory of the local file cache, None to always read from the database.
+        """
+        self.cache_dir = cache_dir
+        self._hashes: Dict[int, str] = {}
+        """ Hash of the blob ids already seen. Ids and contents never change, so it is never invalidated."""
+        self._lock = threading.Lock()
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _read_cache(self, digest: str) -> Optional[memoryview]:
+        try:
+            with open(self._cache_path(digest), 'rb') as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    return memoryview(b'')
+                # The mapping stays valid once the file is closed, the memoryview keeps it alive.
+                return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError:
+            return None
+
+    def _write_cache(self, digest: str, data):
+        path = self._cache_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside then renamed, so concurrent readers never see a partial file.
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, path)
+        except OSError as e:
+            print("Could not cache blob {}: {}".format(digest, e))
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def _remember(self, blob_id: int, digest: str):
+        with self._lock:
+            self._hashes[blob_id] = digest
+
+    def put(self, session, data: bytes) -> int:
+        """
+        Store data, unless the same content is already stored.
+        :param session: The active SQLAlchemy session object. The row is inserted in its transaction.
+        :param data: The content, bytes or any buffer.
+        :return: The id of the blob holding data.
+        """
+        return self.put_many(session, [data])[0]
+
+    def put_many(self, session, contents: Iterable[bytes]) -> List[int]:
+        """
+        Store several contents with one insert and one select.
+        :param session: The active SQLAlchemy session object. The rows are inserted in its transaction.
+        :param contents: The contents, bytes or any buffers. Duplicates are stored once.
+        :return: The id of the blob of each content, in order.
+        """
+        # Byte views over the buffers, hashed and sent to the driver without copying them.
+        contents = [memoryview(data).cast('B') for data in contents]
+        digests = [blob_hash(data) for data in contents]
+        rows = {digest: {'hash': digest, 'size': len(data), 'data': data}
+                for digest, data in zip(digests, contents)}
+        if not rows:
+            return []
+
+        dialect = session.get_bind().dialect.name
+        if dialect in UPSERTS:
+            session.execute(UPSERTS[dialect](Blobs.__table__).on_conflict_do_nothing(index_elements=['hash']),
+                            list(rows.values()))
+            ids = dict(session.execute(select(Blobs.hash, Blobs.id).where(Blobs.hash.in_(rows))).all())
+        else:
+            ids = dict(session.execute(select(Blobs.hash, Blobs.id).where(Blobs.hash.in_(rows))).all())
+            missing = [row for digest, row in rows.items() if digest not in ids]
+            if missing:
+                session.execute(Blobs.__table__.insert(), missing)
+                ids = dict(session.execute(select(Blobs.hash, Blobs.id).where(Blobs.hash.in_(rows))).all())
+
+        for digest, blob_id in ids.items():
+            self._remember(blob_id, digest)
+            if self.cache_dir is not None:
+                self._write_cache(digest, rows[digest]['data'])
+        return [ids[digest] for digest in digests]
+
+    def get(self, session, blob_id: Optional[int]) -> Optional[memoryview]:
+        """
+        :param session: The active SQLAlchemy session object
+        :param blob_id: The id of the blob, for instance Participants.fk_avatar_blob. None is accepted.
+        :return: The content of the blob, None if blob_id is None or unknown.
+        """
+        if blob_id is None:
+            return None
+        return self.get_many(session, [blob_id]).get(blob_id)
+
+    def get_many(self, session, blob_ids: Iterable[Optional[int]]) -> Dict[int, memoryview]:
+        """
+        Read several blobs with a single query, the cached ones without any query once their hash is known.
+        :param session: The active SQLAlchemy session object
+        :param blob_ids: The ids of the blobs. None values are ignored.
+        :return: The content of each blob found, by id.
+        """
+        wanted = {blob_id for blob_id in blob_ids if blob_id is not None}
+        found = {}
+        if self.cache_dir is not None:
+            with self._lock:
+                known = {blob_id: self._hashes[blob_id] for blob_id in wanted if blob_id in self._hashes}
+            for blob_id, digest in known.items():
+                data = self._read_cache(digest)
+                if data is not None:
+                    found[blob_id] = data
+        missing = wanted - found.keys()
+        if not missing:
+            return found
+
+        # Core select: the contents are not kept in the identity map of the session.
+        for blob_id, digest, data in session.execute(
+                select(Blobs.id, Blobs.hash, Blobs.data).where(Blobs.id.in_(missing))):
+            self._remember(blob_id, digest)
+            if self.cache_dir is not None:
+                self._write_cache(digest, data)
+            found[blob_id] = memoryview(data)
+        return found
+
+
+blob_store = BlobStore(os.environ.get('BLOB_CACHE_DIR'))
+""" Store of the process, caching in BLOB_CACHE_DIR when it is set."""
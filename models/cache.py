@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Type
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+_SNAPSHOT_TYPES: Dict[Type, type] = {}
+""" NamedTuple of the column values of each cached class, built on first use."""
+
+
+def snapshot_type(table_class: Type) -> type:
+    """
+    :return: The read-only row type of table_class snapshots: a NamedTuple named <class>Snapshot whose fields are the
+    column attributes of the class.
+    """
+    row_type = _SNAPSHOT_TYPES.get(table_class)
+    if row_type is None:
+        fields = [(attribute.key, Any) for attribute in inspect(table_class).column_attrs]
+        # setdefault: threads racing on the first use all get the same type.
+        row_type = _SNAPSHOT_TYPES.setdefault(table_class, NamedTuple(table_class.__name__ + 'Snapshot', fields))
+    return row_type
+
+
+class ReadThroughCache:
+    """
+    Process-wide cache of rows that do not change once written, keyed by (model, id).
+
+    Entries expire after ttl_seconds and the least recently used entries are evicted above max_entries. Rows are
+    stored and returned as read-only snapshots (see snapshot_type()) holding the column values of the row: they can
+    be shared by every session and thread, cannot be modified nor merged into a session, and have no relationships.
+    Load the row through a session to modify it.
+
+    Each key has a generation, increased by invalidate(). A row loaded on a miss is only stored if the generation of
+    its key did not change during the load, so a row read before a concurrent update cannot overwrite the
+    invalidation with stale values.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=300.0):
+        """
+        :param max_entries: Maximum number of rows kept.
+        :param ttl_seconds: Time after which a row is read again from the database.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._generations: Dict[tuple, int] = {}
+        """ Invalidations of each key, and of each class under (table_class,). Only invalidated keys are present."""
+        self._lock = threading.Lock()
+        self._watching = False
+
+    def get(self, table_class: Type, query_id, loader: Callable[[], Optional[object]]):
+        """
+        Return a snapshot of the row, reading it with loader on a miss.
+        :param table_class: The mapped class of the row.
+        :param query_id: The id of the row.
+        :param loader: Called on a miss, returns the row as an instance of table_class or None.
+        :return: A snapshot_type() row, or None if the row does not exist.
+        """
+        snapshot = self.lookup(table_class, query_id)
+        if snapshot is not None:
+            return snapshot
+        generation = self.generation(table_class, query_id)
+        return self.store(table_class, query_id, loader(), generation)
+
+    def lookup(self, table_class: Type, query_id):
+        """
+        :return: A snapshot of the cached row, or None on a miss. For callers that cannot pass a loader to get(),
+        such as async code, followed by generation(), the load and store() on a miss.
+        """
+        key = (table_class, query_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def generation(self, table_class: Type, query_id) -> tuple:
+        """
+        :return: The generation of a key, to read before loading the row passed to store().
+        """
+        with self._lock:
+            return self._generations.get((table_class,), 0), self._generations.get((table_class, query_id), 0)
+
+    def store(self, table_class: Type, query_id, row, generation: Optional[tuple] = None):
+        """
+        Cache a row read from the database.
+        :param generation: The generation() of the key before the row was read. The row is not cached if the key was
+        invalidated since. None caches it unconditionally.
+        :return: A snapshot of the row, or None if row is None. Missing rows are not cached, they may be created later.
+        """
+        if row is None:
+            return None
+        row_type = snapshot_type(table_class)
+        snapshot = row_type._make(getattr(row, name) for name in row_type._fields)
+        key = (table_class, query_id)
+        with self._lock:
+            current = self._generations.get((table_class,), 0), self._generations.get(key, 0)
+            if generation is not None and generation != current:
+                return snapshot
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return snapshot
+
+    def invalidate(self, table_class: Type, query_id=None):
+        """
+        Drop a row from the cache, or every row of table_class if query_id is None.
+        """
+        with self._lock:
+            if query_id is not None:
+                key = (table_class, query_id)
+                self._entries.pop(key, None)
+            else:
+                key = (table_class,)
+                for cached in [cached for cached in self._entries if cached[0] is table_class]:
+                    del self._entries[cached]
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def watch(self, table_class: Type):
+        """
+        Invalidate the cached rows of table_class when an update or delete made through the ORM is committed, or
+        rolled back. Invalidating at flush would let another session cache the row it still reads before the commit.
+        Bulk updates made with Core statements are not seen and must call invalidate() themselves.
+        """
+        def _record(mapper, connection, target):
+            session = inspect(target).session
+            if session is not None:
+                session.info.setdefault(self._info_key, set()).add((table_class, target.id))
+
+        event.listen(table_class, 'after_update', _record)
+        event.listen(table_class, 'after_delete', _record)
+        if not self._watching:
+            self._watching = True
+            # A rollback may follow a load in the same session that cached the values of its own pending flush.
+            event.listen(Session, 'after_commit', self._invalidate_recorded)
+            event.listen(Session, 'after_rollback', self._invalidate_recorded)
+
+    @property
+    def _info_key(self) -> tuple:
+        return 'read_through_cache', id(self)
+
+    def _invalidate_recorded(self, session):
+        for table_class, query_id in session.info.pop(self._info_key, ()):
+            self.invalidate(table_class, query_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+settings_cache = ReadThroughCache()
+""" Cache shared by the study configuration tables and the sources."""
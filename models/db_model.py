@@ -1,9 +1,13 @@
 from typing import Type, Optional, TypeVar
-from sqlalchemy import Integer, String, Boolean, TIMESTAMP, ForeignKey
+from sqlalchemy import BigInteger, Integer, String, Boolean, TIMESTAMP, ForeignKey, Index, LargeBinary, select
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import relationship, mapped_column, Mapped, declarative_base
+from sqlalchemy.orm import (relationship, mapped_column, Mapped, declarative_base, deferred, joinedload,
+                            selectinload)
 from datetime import datetime
 
+from models.cache import settings_cache
+from models.partitioning import partition_by_month
+
 Base = declarative_base()
 
 
@@ -18,12 +22,29 @@ class DatabaseBaseClass(Base):
 ModelType = TypeVar('ModelType', bound=DatabaseBaseClass)
 
 
-def get_by_id(session, table_class: Type[ModelType], query_id, jointures=None) -> Optional[ModelType]:
+def loading_options(table_class: Type[ModelType], loading, relationships=None) -> list:
+    """
+    Build the loader options applying the same loading strategy to several relationships.
+    :param table_class: The class owning the relationships
+    :param loading: A loader option function such as joinedload, selectinload or raiseload. None keeps lazy loading.
+    :param relationships: Names of the relationships. Defaults to table_class.eager_relationships
+    :return: The list of loader options, to pass to Query.options()
+    """
+    if loading is None:
+        return []
+    if relationships is None:
+        relationships = getattr(table_class, 'eager_relationships', ())
+    return [loading(getattr(table_class, name)) for name in relationships]
+
+
+def get_by_id(session, table_class: Type[ModelType], query_id, jointures=None, options=None) -> Optional[ModelType]:
     """
     :param session: The active SQLAlchemy session object
     :param table_class: The class representing the database table to query
     :param query_id: The id of the row to be retrieved
-    :param jointures: Optional list of tables to join with the main table
+    :param jointures: Optional list of tables to join with the main table. Joins only filter the row, use options to
+    populate relationships.
+    :param options: Optional list of loader options (joinedload, selectinload, raiseload...)
     :return: The queried row as an instance of the table_class, or None if an error occurred
     """
     assert query_id > 0, 'id must be greater than 0'
@@ -34,6 +55,9 @@ def get_by_id(session, table_class: Type[ModelType], query_id, jointures=None) -
             for j in jointures:
                 query_object = query_object.join(j)
 
+        if options:
+            query_object = query_object.options(*options)
+
     except SQLAlchemyError as e:
         error = str(e)
         print(error)
@@ -55,7 +79,10 @@ class StudyUiSettings(DatabaseBaseClass):
     comment_enabled_reactions: Mapped[bool] = mapped_column(Boolean)
 
     @staticmethod
-    def get_by_id(session, ui_settings_id):
+    def get_by_id(session, ui_settings_id, use_cache=False):
+        if use_cache:
+            return settings_cache.get(StudyUiSettings, ui_settings_id,
+                                      lambda: get_by_id(session, StudyUiSettings, ui_settings_id))
         return get_by_id(session, StudyUiSettings, ui_settings_id)
 
 
@@ -71,7 +98,10 @@ class StudyBasicSettings(DatabaseBaseClass):
     require_identification: Mapped[bool] = mapped_column(Boolean)
 
     @staticmethod
-    def get_by_id(session, basic_settings_id):
+    def get_by_id(session, basic_settings_id, use_cache=False):
+        if use_cache:
+            return settings_cache.get(StudyBasicSettings, basic_settings_id,
+                                      lambda: get_by_id(session, StudyBasicSettings, basic_settings_id))
         return get_by_id(session, StudyBasicSettings, basic_settings_id)
 
 
@@ -86,7 +116,10 @@ class StudyAdvancedSettings(DatabaseBaseClass):
     gen_random_default_avatars: Mapped[int] = mapped_column(Integer)
 
     @staticmethod
-    def get_by_id(session, advanced_settings_id):
+    def get_by_id(session, advanced_settings_id, use_cache=False):
+        if use_cache:
+            return settings_cache.get(StudyAdvancedSettings, advanced_settings_id,
+                                      lambda: get_by_id(session, StudyAdvancedSettings, advanced_settings_id))
         return get_by_id(session, StudyAdvancedSettings, advanced_settings_id)
 
 
@@ -102,7 +135,10 @@ class StudyPagesSettings(DatabaseBaseClass):
     debrief: Mapped[str] = mapped_column(String)
 
     @staticmethod
-    def get_by_id(session, pages_settings_id):
+    def get_by_id(session, pages_settings_id, use_cache=False):
+        if use_cache:
+            return settings_cache.get(StudyPagesSettings, pages_settings_id,
+                                      lambda: get_by_id(session, StudyPagesSettings, pages_settings_id))
         return get_by_id(session, StudyPagesSettings, pages_settings_id)
 
 
@@ -120,17 +156,18 @@ class AdminUsers(DatabaseBaseClass):
 class Studies(DatabaseBaseClass):
     __tablename__ = 'studies'
 
-    fk_ui_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_ui_settings.id'))
-    fk_basic_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_basic_settings.id'))
-    fk_advanced_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_advanced_settings.id'))
-    fk_pages_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_pages_settings.id'), nullable=True)
-    fk_opened_by: Mapped[int] = mapped_column(Integer, ForeignKey('admin_users.id'))
-    fk_closed_by: Mapped[int] = mapped_column(Integer, ForeignKey('admin_users.id'))
+    fk_ui_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_ui_settings.id'), index=True)
+    fk_basic_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_basic_settings.id'), index=True)
+    fk_advanced_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_advanced_settings.id'), index=True)
+    fk_pages_settings: Mapped[int] = mapped_column(Integer, ForeignKey('study_pages_settings.id'), index=True,
+                                                   nullable=True)
+    fk_opened_by: Mapped[int] = mapped_column(Integer, ForeignKey('admin_users.id'), index=True)
+    fk_closed_by: Mapped[int] = mapped_column(Integer, ForeignKey('admin_users.id'), index=True)
     opened_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=True, default=None)
     closed_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=True, default=None)
     result_last_download_time: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=True, default=None)
-    fk_result_last_download_by: Mapped[int] = mapped_column(Integer, ForeignKey('admin_users.id'), nullable=True,
-                                                            default=None)
+    fk_result_last_download_by: Mapped[int] = mapped_column(Integer, ForeignKey('admin_users.id'), index=True,
+                                                            nullable=True, default=None)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now, nullable=False)
 
     basic_settings = relationship('StudyBasicSettings')
@@ -141,10 +178,34 @@ class Studies(DatabaseBaseClass):
     closed_by = relationship('AdminUsers', foreign_keys=[fk_closed_by])
     result_last_download_by = relationship('AdminUsers', foreign_keys=[fk_result_last_download_by])
 
+    eager_relationships = ('basic_settings', 'advanced_settings', 'pages_settings', 'ui_settings', 'opened_by',
+                           'closed_by', 'result_last_download_by')
+    """ Relationships loaded along with a study by get_by_id."""
+
     @staticmethod
-    def get_by_id(session, study_id):
-        return get_by_id(session, Studies, study_id, {StudyBasicSettings, StudyAdvancedSettings, StudyPagesSettings,
-                                                      StudyAdvancedSettings, AdminUsers})
+    def get_by_id(session, study_id, loading=joinedload):
+        """Retrieve a study and its settings and admin users.
+
+        :param session: The database session.
+        :param study_id: The id of the study.
+        :param loading: Loading strategy for the relationships. The default joinedload fetches everything in a single
+        query, raiseload makes any access to a relationship raise instead of querying.
+        :return: The study, or None.
+        """
+        return get_by_id(session, Studies, study_id, options=loading_options(Studies, loading))
+
+
+class Blobs(DatabaseBaseClass):
+    """
+    Binary content (avatars, styles) stored once per distinct content, keyed by its sha256. data is deferred: it is
+    only read when accessed, read it through models/blobs.py to get a memoryview.
+    """
+    __tablename__ = 'blobs'
+
+    hash: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    data: Mapped[bytes] = deferred(mapped_column(LargeBinary, nullable=False))
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now, nullable=False)
 
 
 class Sources(DatabaseBaseClass):
@@ -152,14 +213,20 @@ class Sources(DatabaseBaseClass):
 
     ms_id: Mapped[str] = mapped_column(String)
     name: Mapped[str] = mapped_column(String)
-    style: Mapped[bytes] = mapped_column(String)
+    fk_style_blob: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('blobs.id'), nullable=True)
     max_posts: Mapped[int] = mapped_column(Integer)
     true_post_percentage: Mapped[int] = mapped_column(Integer)
-    avatar: Mapped[bytes] = mapped_column(String)
+    fk_avatar_blob: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('blobs.id'), nullable=True)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now, nullable=False)
 
+    style_blob = relationship('Blobs', foreign_keys=[fk_style_blob])
+    avatar_blob = relationship('Blobs', foreign_keys=[fk_avatar_blob])
+
     @staticmethod
-    def get_by_id(session, source_id):
+    def get_by_id(session, source_id, use_cache=False):
+        if use_cache:
+            return settings_cache.get(Sources, source_id,
+                                      lambda: get_by_id(session, Sources, source_id))
         return get_by_id(session, Sources, source_id)
 
 
@@ -167,9 +234,9 @@ class Participants(DatabaseBaseClass):
     __tablename__ = 'participants'
 
     ms_id: Mapped[int] = mapped_column(Integer)
-    fk_linked_study: Mapped[int] = mapped_column(Integer, ForeignKey('studies.id'))
-    session_id: Mapped[str] = mapped_column(String)
-    avatar: Mapped[bytes] = mapped_column(String)
+    fk_linked_study: Mapped[int] = mapped_column(Integer, ForeignKey('studies.id'), index=True)
+    session_id: Mapped[str] = mapped_column(String, unique=True, index=True)
+    fk_avatar_blob: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('blobs.id'), nullable=True)
     username: Mapped[str] = mapped_column(String)
     nb_follower: Mapped[int] = mapped_column(Integer)
     credibility_score: Mapped[int] = mapped_column(Integer)
@@ -178,6 +245,7 @@ class Participants(DatabaseBaseClass):
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now, nullable=False)
 
     linked_study = relationship('Studies')
+    avatar_blob = relationship('Blobs')
 
     @staticmethod
     def get_by_id(session, participant_id):
@@ -228,6 +296,10 @@ class Posts(DatabaseBaseClass):
     :type source: source.Sources
     """
     __tablename__ = 'posts'
+    __table_args__ = (
+        # Keyset pagination of a study's feed, also serves the lookups by study alone.
+        Index('ix_posts_study_id', 'fk_linked_study', 'id'),
+    )
 
     # @todo Add a default amount of like/dislike/share/flags
     ms_id: Mapped[str] = mapped_column(String)
@@ -247,28 +319,32 @@ class Posts(DatabaseBaseClass):
     changes_to_credibility_on_dislike: Mapped[int] = mapped_column(Integer, default=0)
     changes_to_credibility_on_share: Mapped[int] = mapped_column(Integer, default=0)
     changes_to_credibility_on_flag: Mapped[int] = mapped_column(Integer, default=0)
-    fk_source_id: Mapped[int] = mapped_column(Integer, ForeignKey('sources.id'))
+    fk_source_id: Mapped[int] = mapped_column(Integer, ForeignKey('sources.id'), index=True)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now, nullable=False)
 
     linked_study = relationship('Studies')
     source = relationship('Sources')
 
+    eager_relationships = ('linked_study', 'source')
+    """ Relationships loaded along with posts by get_by_id and get_all_by_study_id."""
+
     @staticmethod
-    def get_by_id(session, post_id):
-        return get_by_id(session, Posts, post_id, {Studies, Sources})
+    def get_by_id(session, post_id, loading=joinedload):
+        return get_by_id(session, Posts, post_id, options=loading_options(Posts, loading))
 
     @staticmethod
-    def get_all_by_study_id(session, study_id):
+    def get_all_by_study_id(session, study_id, loading=selectinload):
         """Retrieve all posts matching a study ID.
 
         :param session: The database session.
         :param study_id: The id of the study.
+        :param loading: Loading strategy for linked_study and source. The default selectinload issues one extra query
+        per relationship whatever the number of posts.
         :return: A list of posts.
         """
         try:
             posts_interactions = (session.query(Posts)
-                                  .join(Studies)
-                                  .join(Sources)
+                                  .options(*loading_options(Posts, loading))
                                   .filter(Posts.fk_linked_study == study_id).all())
         except SQLAlchemyError as e:
             error = str(e.__dict__['orig'])
@@ -276,9 +352,51 @@ class Posts(DatabaseBaseClass):
             return None
         return posts_interactions
 
+    feed_columns = ('id', 'headline', 'content', 'number_of_likes', 'number_of_dislike', 'number_of_shared',
+                    'number_of_flagged', 'fk_source_id')
+    """ Columns of a post displayed in a participant's feed."""
+
+    @staticmethod
+    def get_feed_page(session, study_id, participant_id, after_id=0, limit=20):
+        """Retrieve the next posts of a study that a participant has not interacted with yet.
+
+        Pages are keyed on the post id rather than an offset, so each page costs the same whatever its position.
+
+        :param session: The database session.
+        :param study_id: The id of the study.
+        :param participant_id: The id of the participant.
+        :param after_id: The id of the last post of the previous page, 0 for the first page.
+        :param limit: Maximum number of posts in the page.
+        :return: The rows of Posts.feed_columns plus source_name, and the after_id of the next page (None after the
+        last page). An empty page and None if an error occurred, so callers can always unpack the result.
+        """
+        already_seen = (select(PostsInteractions.id)
+                        .where(PostsInteractions.fk_post_id == Posts.id,
+                               PostsInteractions.fk_participant_id == participant_id))
+        try:
+            rows = session.execute(
+                select(*(getattr(Posts, name) for name in Posts.feed_columns), Sources.name.label('source_name'))
+                .outerjoin(Sources, Posts.fk_source_id == Sources.id)
+                .where(Posts.fk_linked_study == study_id, Posts.id > after_id, ~already_seen.exists())
+                .order_by(Posts.id)
+                .limit(limit)).all()
+        except SQLAlchemyError as e:
+            error = str(getattr(e, 'orig', e))
+            print(error)
+            return [], None
+        return rows, (rows[-1].id if len(rows) == limit else None)
+
 
 class PostsInteractions(DatabaseBaseClass):
     __tablename__ = 'posts_interactions'
+    __table_args__ = (
+        # Also serves the lookups by participant alone.
+        Index('ix_posts_interactions_participant_order', 'fk_participant_id', 'order'),
+        # Also serves the lookups by post alone, and the "already seen" anti-join of the feed.
+        Index('ix_posts_interactions_post_participant', 'fk_post_id', 'fk_participant_id'),
+        # Range scans of the rollup refresh. BRIN stays small and cheap to maintain on an append-only table.
+        Index('ix_posts_interactions_created_at', 'created_at', postgresql_using='brin'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     order: Mapped[int] = mapped_column(Integer)
@@ -287,7 +405,8 @@ class PostsInteractions(DatabaseBaseClass):
     reaction_type: Mapped[str] = mapped_column(String)
     flagged: Mapped[bool] = mapped_column(Boolean)
     shared: Mapped[bool] = mapped_column(Boolean)
-    fk_comment_id: Mapped[int] = mapped_column(Integer, ForeignKey('comments.id'), nullable=True, default=None)
+    fk_comment_id: Mapped[int] = mapped_column(Integer, ForeignKey('comments.id'), index=True, nullable=True,
+                                               default=None)
     first_time_to_interact_ms: Mapped[int] = mapped_column(Integer, default=-1)
     last_interaction_time_ms: Mapped[int] = mapped_column(Integer, default=-1)
     user_follower_before: Mapped[int] = mapped_column(Integer)
@@ -300,23 +419,26 @@ class PostsInteractions(DatabaseBaseClass):
     post = relationship('Posts')
     comment = relationship('Comments')
 
+    eager_relationships = ('participant', 'post')
+    """ Relationships loaded along with interactions by get_all_by_post_id."""
+
     @staticmethod
     def get_by_id(session, interaction_id):
         return get_by_id(session, PostsInteractions, interaction_id)
 
-    # @TODO refactor this with to get all matching foreign keys for a function.
+    # To load the interactions of many posts at once, use models.loader.load_many or a BatchLoader.
     @staticmethod
-    def get_all_by_post_id(session, post_id):
+    def get_all_by_post_id(session, post_id, loading=selectinload):
         """Retrieve all posts interactions matching a post ID.
 
         :param session: The database session.
         :param post_id: The id of the post.
+        :param loading: Loading strategy for participant and post.
         :return: A list of posts interactions.
         """
         try:
             posts_interactions = (session.query(PostsInteractions)
-                                  .join(Participants)
-                                  .join(Posts)
+                                  .options(*loading_options(PostsInteractions, loading))
                                   .filter(PostsInteractions.fk_post_id == post_id).all())
         except SQLAlchemyError as e:
             error = str(e.__dict__['orig'])
@@ -328,8 +450,8 @@ class PostsInteractions(DatabaseBaseClass):
 class Comments(DatabaseBaseClass):
     __tablename__ = 'comments'
 
-    fk_source_id: Mapped[int] = mapped_column(Integer, ForeignKey('sources.id'))
-    fk_post_id: Mapped[int] = mapped_column(Integer, ForeignKey('posts.id'))
+    fk_source_id: Mapped[int] = mapped_column(Integer, ForeignKey('sources.id'), index=True)
+    fk_post_id: Mapped[int] = mapped_column(Integer, ForeignKey('posts.id'), index=True)
     content: Mapped[str] = mapped_column(String)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now, nullable=False)
 
@@ -344,8 +466,8 @@ class Comments(DatabaseBaseClass):
 class CommentsInteractions(DatabaseBaseClass):
     __tablename__ = 'comments_interactions'
 
-    fk_comment_id: Mapped[int] = mapped_column(Integer, ForeignKey('comments.id'))
-    fk_participant_id: Mapped[int] = mapped_column(Integer, ForeignKey('participants.id'))
+    fk_comment_id: Mapped[int] = mapped_column(Integer, ForeignKey('comments.id'), index=True)
+    fk_participant_id: Mapped[int] = mapped_column(Integer, ForeignKey('participants.id'), index=True)
     reaction_type: Mapped[str] = mapped_column(String)
     first_time_to_interact_ms: Mapped[int] = mapped_column(Integer)
     last_interaction_time_ms: Mapped[int] = mapped_column(Integer)
@@ -357,3 +479,65 @@ class CommentsInteractions(DatabaseBaseClass):
     @staticmethod
     def get_by_id(session, interaction_id):
         return get_by_id(session, CommentsInteractions, interaction_id)
+
+
+class RollupWatermarks(Base):
+    """
+    Last created_at folded into the rollup tables, see queries/rollups.py.
+    """
+    __tablename__ = 'rollup_watermarks'
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    high_water: Mapped[datetime] = mapped_column(TIMESTAMP)
+    refreshed_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now)
+
+
+class StudyReactionRollups(Base):
+    """
+    Posts interactions of a study aggregated by reaction type and truthfulness of the post.
+    """
+    __tablename__ = 'study_reaction_rollups'
+
+    fk_study_id: Mapped[int] = mapped_column(Integer, ForeignKey('studies.id'), primary_key=True)
+    reaction_type: Mapped[str] = mapped_column(String, primary_key=True)
+    is_true_fact: Mapped[bool] = mapped_column(Boolean, primary_key=True)
+    interactions: Mapped[int] = mapped_column(Integer, default=0)
+    shared: Mapped[int] = mapped_column(Integer, default=0)
+    flagged: Mapped[int] = mapped_column(Integer, default=0)
+    timed_interactions: Mapped[int] = mapped_column(Integer, default=0)
+    total_time_to_interact_ms: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class StudySourceRollups(Base):
+    """
+    Posts interactions of a study aggregated by source of the post.
+    """
+    __tablename__ = 'study_source_rollups'
+
+    fk_study_id: Mapped[int] = mapped_column(Integer, ForeignKey('studies.id'), primary_key=True)
+    fk_source_id: Mapped[int] = mapped_column(Integer, ForeignKey('sources.id'), primary_key=True)
+    interactions: Mapped[int] = mapped_column(Integer, default=0)
+    likes: Mapped[int] = mapped_column(Integer, default=0)
+    dislikes: Mapped[int] = mapped_column(Integer, default=0)
+    shared: Mapped[int] = mapped_column(Integer, default=0)
+    flagged: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class SeedingCheckpoints(Base):
+    """
+    Posts of a study already inserted by generators/seeding.py, written in the same transaction as the posts.
+    """
+    __tablename__ = 'seeding_checkpoints'
+
+    fk_study_id: Mapped[int] = mapped_column(Integer, ForeignKey('studies.id'), primary_key=True)
+    item: Mapped[int] = mapped_column(Integer, primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.now, nullable=False)
+
+
+# Rows that are read on every participant page but never change once a study is opened.
+for _cached_class in (StudyUiSettings, StudyBasicSettings, StudyAdvancedSettings, StudyPagesSettings, Sources):
+    settings_cache.watch(_cached_class)
+
+# Append-only tables, partitioned by month on PostgreSQL so old months can be archived.
+for _partitioned_class in (PostsInteractions, CommentsInteractions):
+    partition_by_month(_partitioned_class.__table__)
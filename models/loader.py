@@ -0,0 +1,315 @@
+"""
+Batched loading of the rows matching many keys, to replace the loops calling get_by_id or get_all_by_* per key.
+
+load_many() reads the rows of every key with one `WHERE column IN (...)` query per chunk_size keys and groups them by
+key. BatchLoader does the same for keys requested one by one: the keys requested before the next dispatch are loaded
+together, and the rows of each key are memoized for the lifetime of the loader, so create one per request or unit of
+work. Loaders hands out one BatchLoader per (class, column) for a session.
+
+    loaders = Loaders(session)
+    interactions = loaders.get(PostsInteractions, 'fk_post_id').load_many(post_ids)
+    comments = loaders.get(Comments, 'fk_post_id').load_many(post_ids)
+
+AsyncBatchLoader is the DataLoader-like counterpart for AsyncSession: the keys awaited by the coroutines running in
+the same event loop iteration are loaded with a single query.
+"""
+import asyncio
+from typing import TYPE_CHECKING, Dict, Hashable, Iterable, List, Optional, Type, Union
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import raiseload
+
+from models.db_model import ModelType
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+CHUNK_SIZE = 1000
+""" Keys per IN list. Keeps the statements well below the parameter limits of the drivers (32767 for SQLite)."""
+
+
+def _column(table_class: Type[ModelType], fk_column):
+    return getattr(table_class, fk_column) if isinstance(fk_column, str) else fk_column
+
+
+def _unique_keys(keys: Iterable[Hashable]) -> list:
+    return list(dict.fromkeys(key for key in keys if key is not None))
+
+
+def _statements(table_class: Type[ModelType], column, keys: list, chunk_size: int, options) -> Iterable:
+    for start in range(0, len(keys), chunk_size):
+        yield (select(table_class)
+               .where(column.in_(keys[start:start + chunk_size]))
+               .order_by(table_class.id)
+               .options(*options))
+
+
+def _group(rows, column, keys: list) -> Dict[Hashable, List[ModelType]]:
+    groups = {key: [] for key in keys}
+    for row in rows:
+        groups[getattr(row, column.key)].append(row)
+    return groups
+
+
+def load_many(session, table_class: Type[ModelType], fk_column: Union[str, object], keys: Iterable[Hashable],
+              chunk_size=CHUNK_SIZE, options=None) -> Optional[Dict[Hashable, List[ModelType]]]:
+    """
+    Load the rows of table_class whose fk_column matches any of keys.
+    :param session: The active SQLAlchemy session object
+    :param table_class: The class representing the database table to query
+    :param fk_column: The column matched against keys, as a name or a class attribute. 'id' loads rows by id.
+    :param keys: The values to match. Duplicates and None are ignored.
+    :param chunk_size: Keys per query.
+    :param options: Optional list of loader options (joinedload, selectinload, raiseload...)
+    :return: The rows of each key ordered by id, an empty list for the keys without rows. None if an error occurred.
+    """
+    column = _column(table_class, fk_column)
+    keys = _unique_keys(keys)
+    rows = []
+    try:
+        for statement in _statements(table_class, column, keys, chunk_size, options or ()):
+            rows += session.execute(statement).unique().scalars()
+    except SQLAlchemyError as e:
+        error = str(e)
+        print(error)
+        return None
+    return _group(rows, column, keys)
+
+
+class BatchLoader:
+    """
+    Memoizing loader of the rows of table_class by fk_column, for one session.
+    """
+
+    def __init__(self, session, table_class: Type[ModelType], fk_column: Union[str, object], chunk_size=CHUNK_SIZE,
+                 options=None):
+        """
+        :param session: The active SQLAlchemy session object
+        :param table_class: The class representing the database table to query
+        :param fk_column: The column matched against the keys, as a name or a class attribute.
+        :param chunk_size: Keys per query.
+        :param options: Optional list of loader options applied to every query.
+        """
+        self.session = session
+        self.table_class = table_class
+        self.column = _column(table_class, fk_column)
+        self.chunk_size = chunk_size
+        self.options = options
+        self._results: Dict[Hashable, List[ModelType]] = {}
+        self._pending: Dict[Hashable, None] = {}
+        """ Keys requested and not loaded yet, in request order."""
+        self.queries = 0
+        """ Number of dispatches that issued queries."""
+
+    def request(self, key: Hashable):
+        """
+        Add a key to the next dispatch, without querying.
+        """
+        if key is not None and key not in self._results:
+            self._pending[key] = None
+
+    def dispatch(self):
+        """
+        Load the rows of every pending key. The keys of a failed dispatch stay pending.
+        """
+        if not self._pending:
+            return
+        groups = load_many(self.session, self.table_class, self.column, self._pending, self.chunk_size, self.options)
+        self.queries += 1
+        if groups is not None:
+            self._results.update(groups)
+            self._pending.clear()
+
+    def load(self, key: Hashable) -> List[ModelType]:
+        """
+        :return: The rows of key, loaded along with every other pending key if it is not memoized yet. An empty list
+        if an error occurred.
+        """
+        if key is None:
+            return []
+        self.request(key)
+        self.dispatch()
+        return self._results.get(key, [])
+
+    def load_one(self, key: Hashable) -> Optional[ModelType]:
+        """
+        :return: The first row of key, typically with fk_column 'id'. None if there is none.
+        """
+        rows = self.load(key)
+        return rows[0] if rows else None
+
+    def load_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, List[ModelType]]:
+        """
+        :return: The rows of each key, the keys not memoized yet being loaded together.
+        """
+        keys = _unique_keys(keys)
+        for key in keys:
+            self.request(key)
+        self.dispatch()
+        return {key: self._results.get(key, []) for key in keys}
+
+    def prime(self, key: Hashable, rows: List[ModelType]):
+        """
+        Memoize rows already loaded by other means.
+        """
+        self._results[key] = rows
+        self._pending.pop(key, None)
+
+    def clear(self):
+        """
+        Forget the memoized rows, for instance after modifying the table.
+        """
+        self._results.clear()
+
+
+class Loaders:
+    """
+    One BatchLoader per (class, column) for a session, to share the memoized rows within a request.
+    """
+
+    def __init__(self, session, chunk_size=CHUNK_SIZE):
+        self.session = session
+        self.chunk_size = chunk_size
+        self._loaders: Dict[tuple, BatchLoader] = {}
+
+    def get(self, table_class: Type[ModelType], fk_column: Union[str, object]) -> BatchLoader:
+        column = _column(table_class, fk_column)
+        key = (table_class, column.key)
+        if key not in self._loaders:
+            self._loaders[key] = BatchLoader(self.session, table_class, column, self.chunk_size)
+        return self._loaders[key]
+
+    def clear(self):
+        for loader in self._loaders.values():
+            loader.clear()
+
+
+async def load_many_async(session: 'AsyncSession', table_class: Type[ModelType], fk_column: Union[str, object],
+                          keys: Iterable[Hashable], chunk_size=CHUNK_SIZE, options=None
+                          ) -> Optional[Dict[Hashable, List[ModelType]]]:
+    """
+    Async counterpart of load_many. Relationships are not loaded unless options says so, touching them raises.
+    """
+    column = _column(table_class, fk_column)
+    keys = _unique_keys(keys)
+    options = list(options or ()) + [raiseload('*')]
+    rows = []
+    try:
+        for statement in _statements(table_class, column, keys, chunk_size, options):
+            rows += (await session.execute(statement)).unique().scalars()
+    except SQLAlchemyError as e:
+        error = str(e)
+        print(error)
+        return None
+    return _group(rows, column, keys)
+
+
+class AsyncBatchLoader:
+    """
+    DataLoader-like loader for AsyncSession: load() waits for the end of the current event loop iteration, then the
+    keys of every coroutine waiting are loaded with one query per chunk.
+    """
+
+    def __init__(self, session: 'AsyncSession', table_class: Type[ModelType], fk_column: Union[str, object],
+                 chunk_size=CHUNK_SIZE, options=None, lock: Optional[asyncio.Lock] = None):
+        """
+        :param session: The active AsyncSession
+        :param table_class: The class representing the database table to query
+        :param fk_column: The column matched against the keys, as a name or a class attribute.
+        :param chunk_size: Keys per query.
+        :param options: Optional list of loader options applied to every query.
+        :param lock: Lock shared by the loaders of the same session, which cannot run two queries at once.
+        """
+        self.session = session
+        self.table_class = table_class
+        self.column = _column(table_class, fk_column)
+        self.chunk_size = chunk_size
+        self.options = options
+        self.lock = lock or asyncio.Lock()
+        self._results: Dict[Hashable, List[ModelType]] = {}
+        self._waiting: Dict[Hashable, asyncio.Future] = {}
+        self._scheduled = False
+        self._tasks = set()
+        """ Running dispatches. The event loop only keeps weak references to tasks, a dispatch would be garbage
+        collected before the end without these."""
+        self.queries = 0
+        """ Number of dispatches that issued queries."""
+
+    async def _dispatch(self):
+        self._scheduled = False
+        waiting, self._waiting = self._waiting, {}
+        try:
+            async with self.lock:
+                groups = await load_many_async(self.session, self.table_class, self.column, waiting,
+                                               self.chunk_size, self.options)
+        except Exception as e:
+            for future in waiting.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.queries += 1
+        if groups is not None:
+            self._results.update(groups)
+        for key, future in waiting.items():
+            if not future.done():
+                future.set_result(groups.get(key, []) if groups is not None else [])
+
+    def _schedule(self):
+        task = asyncio.ensure_future(self._dispatch())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def load(self, key: Hashable) -> List[ModelType]:
+        """
+        :return: The rows of key. An empty list if an error occurred.
+        """
+        if key is None:
+            return []
+        if key in self._results:
+            return self._results[key]
+        if key not in self._waiting:
+            loop = asyncio.get_running_loop()
+            self._waiting[key] = loop.create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(self._schedule)
+        # Shielded so a cancelled caller does not cancel the future the other callers wait for.
+        return await asyncio.shield(self._waiting[key])
+
+    async def load_one(self, key: Hashable) -> Optional[ModelType]:
+        rows = await self.load(key)
+        return rows[0] if rows else None
+
+    async def load_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, List[ModelType]]:
+        keys = _unique_keys(keys)
+        return dict(zip(keys, await asyncio.gather(*(self.load(key) for key in keys))))
+
+    def prime(self, key: Hashable, rows: List[ModelType]):
+        self._results[key] = rows
+
+    def clear(self):
+        self._results.clear()
+
+
+class AsyncLoaders:
+    """
+    One AsyncBatchLoader per (class, column) for an AsyncSession, sharing the lock of the session.
+    """
+
+    def __init__(self, session: 'AsyncSession', chunk_size=CHUNK_SIZE):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.lock = asyncio.Lock()
+        self._loaders: Dict[tuple, AsyncBatchLoader] = {}
+
+    def get(self, table_class: Type[ModelType], fk_column: Union[str, object]) -> AsyncBatchLoader:
+        column = _column(table_class, fk_column)
+        key = (table_class, column.key)
+        if key not in self._loaders:
+            self._loaders[key] = AsyncBatchLoader(self.session, table_class, column, self.chunk_size, lock=self.lock)
+        return self._loaders[key]
+
+    def clear(self):
+        for loader in self._loaders.values():
+            loader.clear()
@@ -0,0 +1,291 @@
+"""
+Monthly range partitioning of the append-only interaction tables on PostgreSQL.
+
+A partitioned table is created by Base.metadata.create_all with its primary key extended to the partition column, a
+default partition catching rows outside the created months, and the partitions of the current and next months. Run
+`ensure` regularly (e.g. from a monthly cron) to keep partitions created ahead of time, and `archive` to detach the
+months older than every open study, dump them to gzip compressed CSV files and drop them.
+
+    python -m models.partitioning ensure --months-ahead 3
+    python -m models.partitioning archive --directory archives/
+    python -m models.partitioning restore posts_interactions 2024-01 archives/posts_interactions_y2024m01.csv.gz
+
+Queries filtered on a created_at range are pruned to the matching partitions. Other backends create plain tables.
+"""
+import argparse
+import gzip
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import PrimaryKeyConstraint, Table, event, func, select, text
+from sqlalchemy.ext.compiler import compiles
+
+PARTITION_KEY = 'partition_key'
+""" Table.info key holding the name of the column a table is partitioned on."""
+
+MONTHS_AHEAD = 2
+""" Months created in advance along with the tables."""
+
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _partitioned_primary_key(constraint, compiler, **kw):
+    """
+    PostgreSQL requires the partition column in every unique constraint of a partitioned table. The column is only
+    added in the DDL, so the ORM keeps identifying rows by id.
+    """
+    key = constraint.table.info.get(PARTITION_KEY)
+    if key is None or key in constraint.columns:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    ddl = ""
+    if constraint.name is not None:
+        ddl += "CONSTRAINT {} ".format(compiler.preparer.format_constraint(constraint))
+    columns = [column.name for column in constraint.columns] + [key]
+    return ddl + "PRIMARY KEY ({})".format(", ".join(compiler.preparer.quote(name) for name in columns))
+
+
+def _month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name: str, month: datetime) -> str:
+    return "{}_y{:04d}m{:02d}".format(table_name, month.year, month.month)
+
+
+def default_partition_name(table_name: str) -> str:
+    return table_name + "_default"
+
+
+def _quote(connection, name: str) -> str:
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def create_month_partition(connection, table_name: str, month: datetime, column='created_at') -> bool:
+    """
+    Create the partition of a month, moving its rows out of the default partition if any ended up there.
+    :param connection: A connection inside a transaction.
+    :param table_name: The partitioned table.
+    :param month: Any moment of the month.
+    :param column: The partition column.
+    :return: False if the partition already existed.
+    """
+    month = _month_start(month)
+    name = partition_name(table_name, month)
+    if connection.scalar(text("SELECT to_regclass(:name)"), {'name': name}) is not None:
+        return False
+    table, partition, column = _quote(connection, table_name), _quote(connection, name), _quote(connection, column)
+    bounds = {'start': month, 'end': _add_months(month, 1)}
+    # Filled as a standalone table then attached, since a partition overlapping rows of the default one can't be
+    # created directly. Attaching also creates the indexes of the parent.
+    connection.execute(text("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                            .format(partition, table)))
+    connection.execute(text("WITH moved AS (DELETE FROM {} WHERE {} >= :start AND {} < :end RETURNING *) "
+                            "INSERT INTO {} SELECT * FROM moved"
+                            .format(_quote(connection, default_partition_name(table_name)), column, column,
+                                    partition)), bounds)
+    connection.execute(text("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')"
+                            .format(table, partition, bounds['start'], bounds['end'])))
+    return True
+
+
+def ensure_partitions(connection, table_name: str, months_ahead=MONTHS_AHEAD, start=None, column='created_at') -> list:
+    """
+    Create the missing partitions from the month of start to months_ahead months later.
+    :param connection: A connection inside a transaction.
+    :param table_name: The partitioned table.
+    :param months_ahead: Number of months created after the month of start.
+    :param start: First month to create, defaults to the current month.
+    :param column: The partition column.
+    :return: Names of the created partitions.
+    """
+    first = _month_start(start or datetime.now())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = _add_months(first, offset)
+        if create_month_partition(connection, table_name, month, column):
+            created.append(partition_name(table_name, month))
+    return created
+
+
+def _after_create(table: Table, connection, **kw):
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.execute(text("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT".format(
+        _quote(connection, default_partition_name(table.name)), _quote(connection, table.name))))
+    ensure_partitions(connection, table.name, column=table.info[PARTITION_KEY])
+
+
+def partition_by_month(table: Table, column='created_at'):
+    """
+    Declare a table range partitioned by month on PostgreSQL.
+    :param table: The table, before it is created.
+    :param column: The non nullable timestamp column to partition on.
+    """
+    table.info[PARTITION_KEY] = column
+    table.dialect_options['postgresql']['partition_by'] = "RANGE ({})".format(column)
+    event.listen(table, 'after_create', _after_create)
+
+
+def partitioned_tables(metadata) -> list:
+    return [table for table in metadata.sorted_tables if PARTITION_KEY in table.info]
+
+
+def month_partitions(connection, table_name: str) -> dict:
+    """
+    :return: The attached month partitions of a table, by first day of the month.
+    """
+    pattern = re.compile(r"^{}_y(\d{{4}})m(\d{{2}})$".format(re.escape(table_name)))
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"), {'table': table_name}).scalars()
+    partitions = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def retention_cutoff(session) -> datetime:
+    """
+    :return: The first month that may still receive interactions: the month the oldest open study was opened, or the
+    current month if every study is closed.
+    """
+    from models.db_model import Studies
+
+    oldest_open = session.scalar(select(func.min(Studies.opened_at)).where(Studies.closed_at.is_(None)))
+    return _month_start(oldest_open or datetime.now())
+
+
+def _dump_partition(engine, name: str, path: str):
+    """
+    Write a table to a gzip compressed CSV file and fsync it. The file is written aside then renamed, so path only
+    ever holds a complete dump.
+    """
+    temporary = path + ".partial"
+    raw_connection = engine.raw_connection()
+    try:
+        with open(temporary, 'wb') as file:
+            with raw_connection.cursor() as cursor, gzip.open(file, 'wt', newline='') as output:
+                cursor.copy_expert('COPY "{}" TO STDOUT WITH (FORMAT csv, HEADER)'.format(name), output)
+            file.flush()
+            os.fsync(file.fileno())
+        raw_connection.commit()
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    finally:
+        raw_connection.close()
+    os.replace(temporary, path)
+    directory = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def archive_partitions(engine, table_name: str, before: datetime, directory: str, keep=False) -> list:
+    """
+    Dump the month partitions ending before a date, each one to a gzip compressed CSV file, then detach them.
+    A partition is only detached and dropped once its file is written and synced to disk, so a failed dump leaves it
+    attached. The months archived must no longer receive rows, see retention_cutoff().
+    :param engine: A PostgreSQL engine using psycopg2.
+    :param table_name: The partitioned table.
+    :param before: Partitions of months starting before this month are archived.
+    :param directory: Where the files are written, as <partition name>.csv.gz.
+    :param keep: Keep the detached tables instead of dropping them once dumped.
+    :return: The paths of the written files.
+    """
+    before = _month_start(before)
+    os.makedirs(directory, exist_ok=True)
+    with engine.connect() as connection:
+        partitions = month_partitions(connection, table_name)
+
+    paths = []
+    for month, name in sorted(partitions.items()):
+        if month >= before:
+            continue
+        path = os.path.join(directory, name + ".csv.gz")
+        _dump_partition(engine, name, path)
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE {} DETACH PARTITION {}".format(
+                _quote(connection, table_name), _quote(connection, name))))
+            if not keep:
+                connection.execute(text("DROP TABLE {}".format(_quote(connection, name))))
+        paths.append(path)
+    return paths
+
+
+def restore_partition(engine, table_name: str, month: datetime, path: str, column='created_at'):
+    """
+    Load an archived month back into its partition.
+    :param engine: A PostgreSQL engine using psycopg2.
+    :param table_name: The partitioned table.
+    :param month: Any moment of the archived month.
+    :param path: The file written by archive_partitions.
+    :param column: The partition column.
+    """
+    with engine.begin() as connection:
+        create_month_partition(connection, table_name, month, column)
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor, gzip.open(path, 'rt', newline='') as archive:
+            cursor.copy_expert('COPY "{}" FROM STDIN WITH (FORMAT csv, HEADER)'.format(
+                partition_name(table_name, month)), archive)
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
+
+def main():
+    from sqlalchemy.orm import Session
+
+    from db import get_engine
+    from models.db_model import Base
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    ensure = commands.add_parser('ensure', help="Create the partitions of the coming months.")
+    ensure.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD)
+    archive = commands.add_parser('archive', help="Archive the months older than every open study.")
+    archive.add_argument('--directory', required=True)
+    archive.add_argument('--before', type=lambda value: datetime.strptime(value, '%Y-%m'),
+                         help="YYYY-MM, defaults to the month the oldest open study was opened.")
+    archive.add_argument('--keep', action='store_true', help="Keep the detached tables.")
+    restore = commands.add_parser('restore', help="Load an archived month back.")
+    restore.add_argument('table')
+    restore.add_argument('month', type=lambda value: datetime.strptime(value, '%Y-%m'), help="YYYY-MM")
+    restore.add_argument('path')
+    arguments = parser.parse_args()
+
+    engine = get_engine()
+    if engine.dialect.name != 'postgresql':
+        parser.error("partitioning needs PostgreSQL")
+    if arguments.command == 'ensure':
+        with engine.begin() as connection:
+            for table in partitioned_tables(Base.metadata):
+                print(table.name, ensure_partitions(connection, table.name, arguments.months_ahead,
+                                                    column=table.info[PARTITION_KEY]))
+    elif arguments.command == 'archive':
+        if arguments.before is None:
+            with Session(engine) as session:
+                arguments.before = retention_cutoff(session)
+        for table in partitioned_tables(Base.metadata):
+            for path in archive_partitions(engine, table.name, arguments.before, arguments.directory,
+                                           arguments.keep):
+                print(path)
+    else:
+        table = Base.metadata.tables[arguments.table]
+        restore_partition(engine, table.name, arguments.month, arguments.path, table.info[PARTITION_KEY])
+
+
+if __name__ == '__main__':
+    main()
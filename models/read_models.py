@@ -0,0 +1,149 @@
+"""
+Read models: immutable rows built from column projections, for the bulk reads that do not modify what they load.
+
+The ORM helpers (Posts.get_all_by_study_id, PostsInteractions.get_all_by_post_id...) return tracked instances: each
+one gets an identity map entry, instrumented attributes and lazy relationships, which costs more than the query on
+large results. The functions here select the columns declared by a read model with a Core select() and build a
+NamedTuple per row, without going through the identity map. The rows cannot be modified nor lazy load anything, ids
+are there to load the related rows explicitly.
+
+    posts = posts_by_study_id(session, study_id)
+    for interaction in iter_rows(session, PostInteractionRow, PostsInteractions.fk_post_id == post_id):
+        ...
+"""
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Type
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+
+from models.db_model import Comments, DatabaseBaseClass, Posts, PostsInteractions
+
+
+class PostRow(NamedTuple):
+    id: int
+    ms_id: str
+    fk_linked_study: int
+    headline: str
+    content: str
+    is_true_fact: bool
+    number_of_likes: int
+    number_of_dislike: int
+    number_of_shared: int
+    number_of_flagged: int
+    changes_to_follower_on_like: int
+    changes_to_follower_on_dislike: int
+    changes_to_follower_on_share: int
+    changes_to_follower_on_flag: int
+    changes_to_credibility_on_like: int
+    changes_to_credibility_on_dislike: int
+    changes_to_credibility_on_share: int
+    changes_to_credibility_on_flag: int
+    fk_source_id: int
+    created_at: datetime
+
+
+class PostInteractionRow(NamedTuple):
+    id: int
+    order: int
+    fk_participant_id: int
+    fk_post_id: int
+    reaction_type: str
+    flagged: bool
+    shared: bool
+    fk_comment_id: Optional[int]
+    first_time_to_interact_ms: int
+    last_interaction_time_ms: int
+    user_follower_before: int
+    user_follower_after: int
+    user_credibility_before: int
+    user_credibility_after: int
+    created_at: datetime
+
+
+class CommentRow(NamedTuple):
+    id: int
+    fk_source_id: int
+    fk_post_id: int
+    content: str
+    created_at: datetime
+
+
+READ_MODELS: Dict[type, Type[DatabaseBaseClass]] = {
+    PostRow: Posts,
+    PostInteractionRow: PostsInteractions,
+    CommentRow: Comments,
+}
+""" Model class read by each read model. The fields of a read model are the columns it selects, in order."""
+
+
+def select_rows(read_model: type, *criteria) -> Select:
+    """
+    :param read_model: A read model of READ_MODELS.
+    :param criteria: WHERE clauses, on the model class columns.
+    :return: The select of the read model columns, ordered by id.
+    """
+    table_class = READ_MODELS[read_model]
+    return (select(*(getattr(table_class, name) for name in read_model._fields))
+            .where(*criteria)
+            .order_by(table_class.id))
+
+
+def fetch_rows(session, read_model: type, *criteria) -> Optional[list]:
+    """
+    :param session: The active SQLAlchemy session object
+    :param read_model: A read model of READ_MODELS.
+    :param criteria: WHERE clauses, on the model class columns.
+    :return: The matching rows as read_model instances, ordered by id, or None if an error occurred.
+    """
+    try:
+        return list(map(read_model._make, session.execute(select_rows(read_model, *criteria))))
+    except SQLAlchemyError as e:
+        error = str(e.__dict__['orig'])
+        print(error)
+        return None
+
+
+def iter_rows(session, read_model: type, *criteria, chunk_size=10000) -> Iterator:
+    """
+    Stream the matching rows, chunk_size at a time, so memory stays flat whatever the number of rows. The session
+    connection is busy until the iterator is exhausted or closed.
+    :param session: The active SQLAlchemy session object
+    :param read_model: A read model of READ_MODELS.
+    :param criteria: WHERE clauses, on the model class columns.
+    :param chunk_size: Rows fetched per round trip.
+    :return: An iterator over read_model instances, ordered by id.
+    """
+    result = session.execute(select_rows(read_model, *criteria).execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        yield from map(read_model._make, rows)
+
+
+def posts_by_study_id(session, study_id) -> Optional[List[PostRow]]:
+    """
+    Read model counterpart of Posts.get_all_by_study_id. Sources and studies are not loaded, see fk_source_id.
+    :param session: The database session.
+    :param study_id: The id of the study.
+    :return: A list of PostRow, or None if an error occurred.
+    """
+    return fetch_rows(session, PostRow, Posts.fk_linked_study == study_id)
+
+
+def posts_interactions_by_post_id(session, post_id) -> Optional[List[PostInteractionRow]]:
+    """
+    Read model counterpart of PostsInteractions.get_all_by_post_id. Participants and posts are not loaded.
+    :param session: The database session.
+    :param post_id: The id of the post.
+    :return: A list of PostInteractionRow, or None if an error occurred.
+    """
+    return fetch_rows(session, PostInteractionRow, PostsInteractions.fk_post_id == post_id)
+
+
+def comments_by_post_id(session, post_id) -> Optional[List[CommentRow]]:
+    """
+    :param session: The database session.
+    :param post_id: The id of the post.
+    :return: A list of CommentRow, or None if an error occurred.
+    """
+    return fetch_rows(session, CommentRow, Comments.fk_post_id == post_id)
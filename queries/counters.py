@@ -0,0 +1,160 @@
+import threading
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, case, func, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from models.db_model import Posts, PostsInteractions
+
+COUNTER_COLUMNS = ('number_of_likes', 'number_of_dislike', 'number_of_shared', 'number_of_flagged')
+""" Columns of Posts maintained from posts_interactions."""
+
+REACTION_COUNTERS = {'like': 'number_of_likes', 'dislike': 'number_of_dislike'}
+""" Counter incremented by each reaction_type. Other reaction types are not counted."""
+
+
+def interaction_deltas(interaction: dict) -> dict:
+    """
+    :param interaction: A posts_interactions row, as a dict.
+    :return: The counter increments the interaction causes on its post.
+    """
+    deltas = {}
+    counter = REACTION_COUNTERS.get(interaction.get('reaction_type'))
+    if counter is not None:
+        deltas[counter] = 1
+    if interaction.get('shared'):
+        deltas['number_of_shared'] = 1
+    if interaction.get('flagged'):
+        deltas['number_of_flagged'] = 1
+    return deltas
+
+
+class ReactionCounters:
+    """
+    Coalesce the counter increments of many interactions in memory, then apply them with one
+    UPDATE posts SET n = n + k per touched post. A post liked a thousand times between two flushes costs a single
+    update, which keeps popular posts from becoming a contention point. NULL counters, left by the inserts not setting
+    them, count as 0.
+    """
+
+    _UPDATE = (update(Posts.__table__)
+               .where(Posts.__table__.c.id == bindparam('post_id'))
+               .values({column: func.coalesce(Posts.__table__.c[column], 0) + bindparam('delta_' + column)
+                        for column in COUNTER_COLUMNS}))
+
+    def __init__(self):
+        self._pending = defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+        self._lock = threading.Lock()
+
+    def add(self, interaction: dict):
+        """
+        Count an interaction. Nothing is written until flush().
+        :param interaction: A posts_interactions row, as a dict with at least fk_post_id.
+        """
+        deltas = interaction_deltas(interaction)
+        if not deltas:
+            return
+        with self._lock:
+            counters = self._pending[interaction['fk_post_id']]
+            for column, delta in deltas.items():
+                counters[column] += delta
+
+    def add_many(self, interactions: Iterable[dict]):
+        for interaction in interactions:
+            self.add(interaction)
+
+    def __len__(self):
+        """
+        :return: Number of posts with pending increments.
+        """
+        return len(self._pending)
+
+    def flush(self, connection: Connection) -> int:
+        """
+        Apply the pending increments within the transaction of connection. The caller commits. If the update fails,
+        the increments are kept for the next flush.
+        :param connection: A connection with an open transaction.
+        :return: The number of updated posts.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+        if not pending:
+            return 0
+        try:
+            # Always lock the rows in the same order, so concurrent flushes cannot deadlock.
+            connection.execute(self._UPDATE, [
+                {'post_id': post_id, **{'delta_' + column: delta for column, delta in counters.items()}}
+                for post_id, counters in sorted(pending.items())
+            ])
+        except Exception:
+            self._restore(pending)
+            raise
+        return len(pending)
+
+    def _restore(self, pending: dict):
+        """
+        Add increments taken by a failed flush back to the pending ones.
+        """
+        with self._lock:
+            for post_id, deltas in pending.items():
+                counters = self._pending[post_id]
+                for column, delta in deltas.items():
+                    counters[column] += delta
+
+
+def count_reactions(connection: Connection, study_id: Optional[int] = None):
+    """
+    Aggregate the counters of every post from posts_interactions.
+    :param connection: The connection to read from.
+    :param study_id: Restrict to the posts of a study.
+    :return: The select of (post id, *COUNTER_COLUMNS), posts without interactions count 0.
+    """
+    interactions = PostsInteractions.__table__.c
+    counted = [
+        func.coalesce(func.sum(case((interactions.reaction_type == reaction_type, 1), else_=0)), 0).label(column)
+        for reaction_type, column in REACTION_COUNTERS.items()
+    ] + [
+        func.coalesce(func.sum(case((interactions.shared.is_(True), 1), else_=0)), 0).label('number_of_shared'),
+        func.coalesce(func.sum(case((interactions.flagged.is_(True), 1), else_=0)), 0).label('number_of_flagged'),
+    ]
+    query = (select(Posts.id, *counted)
+             .select_from(Posts)
+             .outerjoin(PostsInteractions.__table__, interactions.fk_post_id == Posts.id)
+             .group_by(Posts.id)
+             .order_by(Posts.id))
+    if study_id is not None:
+        query = query.where(Posts.fk_linked_study == study_id)
+    return connection.execute(query)
+
+
+def reconcile(engine: Engine, study_id: Optional[int] = None, fix=True) -> dict:
+    """
+    Rebuild the counters of Posts from posts_interactions and report the drift.
+    :param engine: The engine to use.
+    :param study_id: Restrict to the posts of a study.
+    :param fix: Overwrite the drifted counters. With False, only report.
+    :return: post id -> {column: (stored, expected)} of every post whose counters drifted.
+    """
+    drift = {}
+    with engine.begin() as connection:
+        expected = {row[0]: dict(zip(COUNTER_COLUMNS, row[1:])) for row in count_reactions(connection, study_id)}
+        stored = select(Posts.id, *(getattr(Posts, column) for column in COUNTER_COLUMNS))
+        if study_id is not None:
+            stored = stored.where(Posts.fk_linked_study == study_id)
+        for row in connection.execute(stored):
+            counts = expected.get(row[0], dict.fromkeys(COUNTER_COLUMNS, 0))
+            differences = {column: (value, counts[column]) for column, value in zip(COUNTER_COLUMNS, row[1:])
+                           if value != counts[column]}
+            if differences:
+                drift[row[0]] = differences
+
+        if fix and drift:
+            table = Posts.__table__
+            connection.execute(
+                update(table)
+                .where(table.c.id == bindparam('post_id'))
+                .values({column: bindparam('value_' + column) for column in COUNTER_COLUMNS}),
+                [{'post_id': post_id, **{'value_' + column: expected[post_id][column] for column in COUNTER_COLUMNS}}
+                 for post_id in sorted(drift)])
+    return drift
@@ -1,99 +1,228 @@
-import psycopg2
-from psycopg2 import OperationalError
-
-
-def create_connection(db_name, db_user, db_password, db_host, db_port):
+import re
+import weakref
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+from sqlalchemy.exc import OperationalError as PoolOperationalError
+
+from db import get_engine
+
+SQL_SOURCES = Path(__file__).resolve().parent.parent / 'sql_sources'
+
+_PLACEHOLDER = re.compile(r"'\{(\w+)\}'|\{(\w+)\}")
+
+
+class QueryTemplate(NamedTuple):
+    """
+    An insertion query of sql_sources, converted from str.format placeholders to bound parameters.
+    """
+    name: str
+    """ Name of the query, also used as the name of the server-side prepared statement."""
+    sql: str
+    """ The query with psycopg2 named parameters: VALUES (%(name)s, ...)."""
+    params: tuple
+    """ Parameter names, in the order they appear in the query."""
+
+    @property
+    def prepare_sql(self) -> str:
+        """ PREPARE statement of the query, parameters become $1, $2..."""
+        sql = self.sql
+        for position, param in enumerate(self.params, start=1):
+            sql = sql.replace("%({})s".format(param), "${}".format(position))
+        return "PREPARE {} AS {}".format(self.name, sql)
+
+    @property
+    def execute_sql(self) -> str:
+        """ EXECUTE statement of the prepared query."""
+        return "EXECUTE {} ({})".format(self.name, ", ".join("%({})s".format(param) for param in self.params))
+
+    @property
+    def batch_sql(self) -> str:
+        """ The query with a single VALUES %s placeholder, for execute_values."""
+        head, _ = re.split(r"\bVALUES\b", self.sql, maxsplit=1, flags=re.IGNORECASE)
+        return head.rstrip() + " VALUES %s"
+
+    @property
+    def batch_template(self) -> str:
+        """ Row template of execute_values, for rows given as dicts."""
+        return "(" + ", ".join("%({})s".format(param) for param in self.params) + ")"
+
+
+def _load_template(name: str, file_name: str) -> QueryTemplate:
+    with open(SQL_SOURCES / file_name, 'r') as file:
+        sql = " ".join(line.strip() for line in file.read().splitlines()).strip().rstrip(';')
+    params = []
+    for match in _PLACEHOLDER.finditer(sql):
+        param = match.group(1) or match.group(2)
+        if param not in params:
+            params.append(param)
+    sql = _PLACEHOLDER.sub(lambda match: "%({})s".format(match.group(1) or match.group(2)), sql)
+    return QueryTemplate(name, sql, tuple(params))
+
+
+QUERIES = {
+    'insert_study_basic_settings': _load_template('insert_study_basic_settings', 'insertion-queries.sql'),
+    'insert_post': _load_template('insert_post', 'post-insertion-query.sql'),
+}
+""" Insertion queries, loaded once at import."""
+
+_prepared = weakref.WeakKeyDictionary()
+""" Names of the statements already prepared, for connections without an info dictionary."""
+
+
+def _prepared_statements(connection) -> set:
+    """
+    :return: The names of the statements prepared on this connection. Pooled connections keep them in their info
+    dictionary, which lives as long as the underlying database connection.
+    """
+    info = getattr(connection, 'info', None)
+    if isinstance(info, dict):
+        return info.setdefault('prepared_statements', set())
+    return _prepared.setdefault(connection, set())
+
+
+def create_connection():
+    """
+    Borrow a raw DBAPI connection from the shared engine pool. Calling close() on it gives it back to the pool.
+    """
     connection = None
     try:
-        connection = psycopg2.connect(
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            host=db_host,
-            port=db_port,
-        )
+        connection = get_engine().raw_connection()
         print("Connection to PostgreSQL DB successful")
-    except OperationalError as e:
+    except PoolOperationalError as e:
         print(f"The error '{e}' occurred")
     return connection
 
 
-def execute_query(connection, query):
-    connection.autocommit = True
+def execute_query(connection, query, params=None):
+    # psycopg2 is only needed once a connection is in use.
+    from psycopg2 import OperationalError
+
     cursor = connection.cursor()
     try:
-        cursor.execute(query)
+        cursor.execute(query, params)
+        # Commit instead of switching to autocommit, which would leak to the next user of the pooled connection.
+        connection.commit()
         print("Query executed successfully")
     except OperationalError as e:
+        connection.rollback()
+        print(f"The error '{e}' occurred")
+
+
+def execute_prepared(connection, query_name, params: dict):
+    """
+    Run a registered query through a server-side prepared statement, preparing it on first use on this connection.
+    :param connection: A psycopg2 connection, from create_connection().
+    :param query_name: The key of the query in QUERIES.
+    :param params: Values of the query parameters.
+    """
+    from psycopg2 import Error
+
+    query = QUERIES[query_name]
+    prepared = _prepared_statements(connection)
+    cursor = connection.cursor()
+    try:
+        if query.name not in prepared:
+            cursor.execute(query.prepare_sql)
+            prepared.add(query.name)
+        cursor.execute(query.execute_sql, params)
+        connection.commit()
+    except Error as e:
+        connection.rollback()
+        print(f"The error '{e}' occurred")
+
+
+def execute_batch(connection, query_name, rows: Iterable[dict], page_size=500):
+    """
+    Insert many rows with a registered query, page_size rows per INSERT statement.
+    :param connection: A psycopg2 connection, from create_connection().
+    :param query_name: The key of the query in QUERIES.
+    :param rows: Values of the query parameters, one dict per row.
+    :param page_size: Number of rows sent in each statement.
+    """
+    from psycopg2 import Error
+    from psycopg2.extras import execute_values
+
+    query = QUERIES[query_name]
+    cursor = connection.cursor()
+    try:
+        execute_values(cursor, query.batch_sql, rows, template=query.batch_template, page_size=page_size)
+        connection.commit()
+    except Error as e:
+        connection.rollback()
         print(f"The error '{e}' occurred")
 
 
 def create_database(db_connection):
-    with open('../sql_sources/create-database.sql', 'r') as file:
+    with open(SQL_SOURCES / 'create-database.sql', 'r') as file:
         sql_command = file.read()  # .replace('\n', '')
     execute_query(db_connection, sql_command)
 
 
-def create_settings_basic(connection, name, description, prompt, length, require_reactions, require_comments, require_identification):
-    table_name = "study_basic_settings"
-    sql_instruction = ""
-    with open('../sql_sources/insertion-queries.sql', 'r') as file:
-        sql_instruction = file.read().replace('\n', '')
-    print(sql_instruction)
-    sql_instruction = sql_instruction.format(name=name,
-                                             description=description,
-                                             prompt=prompt,
-                                             length=length,
-                                             require_reactions=require_reactions,
-                                             require_comments=require_comments,
-                                             require_identification=require_identification)
-    print(sql_instruction)
-    execute_query(connection, sql_instruction)
+def create_settings_basic(connection, name, description, prompt, length, require_reactions, require_comments,
+                          require_identification):
+    execute_prepared(connection, 'insert_study_basic_settings', {
+        'name': name,
+        'description': description,
+        'prompt': prompt,
+        'length': length,
+        'require_reactions': require_reactions,
+        'require_comments': require_comments,
+        'require_identification': require_identification,
+    })
+
+
+def create_settings_basic_batch(connection, settings: Iterable[dict], page_size=500):
+    """
+    :param settings: One dict per row, with the parameters of create_settings_basic as keys.
+    """
+    execute_batch(connection, 'insert_study_basic_settings', settings, page_size)
 
 
 def create_post(connection, ms_id, fk_linked_study, headline, content, is_true_fact, changes_to_follower_on_like,
                 changes_to_follower_on_dislike, changes_to_follower_on_share, changes_to_follower_on_flag,
                 changes_to_credibility_on_like, changes_to_credibility_on_dislike, changes_to_credibility_on_share,
                 changes_to_credibility_on_flag, number_of_reactions, source_id, created_at):
-    table_name = "posts"
-    sql_instruction = ""
-    with open('../sql_sources/insertion-queries.sql', 'r') as file:
-        sql_instruction = file.read().replace('\n', '')
-
-    sql_instruction = sql_instruction.format(ms_id=ms_id,
-                                             fk_linked_study=fk_linked_study,
-                                             headline=headline,
-                                             content=content,
-                                             is_true_fact=is_true_fact,
-                                             changes_to_follower_on_like=changes_to_follower_on_like,
-                                             changes_to_follower_on_dislike=changes_to_follower_on_dislike,
-                                             changes_to_follower_on_share=changes_to_follower_on_share,
-                                             changes_to_follower_on_flag=changes_to_follower_on_flag,
-                                             changes_to_credibility_on_like=changes_to_credibility_on_like,
-                                             changes_to_credibility_on_dislike=changes_to_credibility_on_dislike,
-                                             changes_to_credibility_on_share=changes_to_credibility_on_share,
-                                             changes_to_credibility_on_flag=changes_to_credibility_on_flag,
-                                             number_of_reactions=number_of_reactions,
-                                             source_id=source_id,
-                                             created_at=created_at)
-
-    execute_query(connection, sql_instruction)
-
-
-db_connection = create_connection(
-    "database_2", "postgres", "password", "127.0.0.1", "5432"
-)
-
-# create_settings_basic(connection=db_connection,
-#                       name="one",
-#                       description="description",
-#                       prompt="prompt",
-#                       length="10",
-#                       require_reactions="0",
-#                       require_comments="0",
-#                       require_identification="0")
-
-# create_post(db_connection, 'ms123', 'null', 'Headline', 'Content', True,
-#             5, 3, 2, 1,
-#             10, 5, 3,
-#             2, 15, 'null', '2024-04-11 12:00:00')
+    execute_prepared(connection, 'insert_post', {
+        'ms_id': ms_id,
+        'fk_linked_study': fk_linked_study,
+        'headline': headline,
+        'content': content,
+        'is_true_fact': is_true_fact,
+        'changes_to_follower_on_like': changes_to_follower_on_like,
+        'changes_to_follower_on_dislike': changes_to_follower_on_dislike,
+        'changes_to_follower_on_share': changes_to_follower_on_share,
+        'changes_to_follower_on_flag': changes_to_follower_on_flag,
+        'changes_to_credibility_on_like': changes_to_credibility_on_like,
+        'changes_to_credibility_on_dislike': changes_to_credibility_on_dislike,
+        'changes_to_credibility_on_share': changes_to_credibility_on_share,
+        'changes_to_credibility_on_flag': changes_to_credibility_on_flag,
+        'number_of_reactions': number_of_reactions,
+        'source_id': source_id,
+        'created_at': created_at,
+    })
+
+
+def create_posts(connection, posts: Iterable[dict], page_size=500):
+    """
+    :param posts: One dict per row, with the parameters of create_post as keys.
+    """
+    execute_batch(connection, 'insert_post', posts, page_size)
+
+
+if __name__ == '__main__':
+    db_connection = create_connection()
+
+    # create_settings_basic(connection=db_connection,
+    #                       name="one",
+    #                       description="description",
+    #                       prompt="prompt",
+    #                       length=10,
+    #                       require_reactions=False,
+    #                       require_comments=False,
+    #                       require_identification=False)
+
+    # create_post(db_connection, 'ms123', None, 'Headline', 'Content', True,
+    #             5, 3, 2, 1,
+    #             10, 5, 3,
+    #             2, 15, None, '2024-04-11 12:00:00')
@@ -0,0 +1,154 @@
+import csv
+import json
+from datetime import datetime
+from os import PathLike
+from typing import IO, Optional, Union
+
+from sqlalchemy import select, update, Integer, Boolean, TIMESTAMP
+
+from models.db_model import Participants, Posts, PostsInteractions, Studies
+
+EXPORT_COLUMNS = [
+    Participants.id.label('participant_id'),
+    Participants.ms_id.label('participant_ms_id'),
+    Participants.username.label('participant_username'),
+    Participants.session_id.label('participant_session_id'),
+    Participants.nb_follower.label('participant_nb_follower'),
+    Participants.credibility_score.label('participant_credibility_score'),
+    Participants.game_start_time.label('participant_game_start_time'),
+    Participants.game_finish_time.label('participant_game_finish_time'),
+    Posts.id.label('post_id'),
+    Posts.ms_id.label('post_ms_id'),
+    Posts.headline.label('post_headline'),
+    Posts.is_true_fact.label('post_is_true_fact'),
+    Posts.fk_source_id.label('post_source_id'),
+    PostsInteractions.id.label('interaction_id'),
+    PostsInteractions.order.label('interaction_order'),
+    PostsInteractions.reaction_type.label('interaction_reaction_type'),
+    PostsInteractions.flagged.label('interaction_flagged'),
+    PostsInteractions.shared.label('interaction_shared'),
+    PostsInteractions.fk_comment_id.label('interaction_comment_id'),
+    PostsInteractions.first_time_to_interact_ms.label('interaction_first_time_to_interact_ms'),
+    PostsInteractions.last_interaction_time_ms.label('interaction_last_interaction_time_ms'),
+    PostsInteractions.user_follower_before.label('interaction_user_follower_before'),
+    PostsInteractions.user_follower_after.label('interaction_user_follower_after'),
+    PostsInteractions.user_credibility_before.label('interaction_user_credibility_before'),
+    PostsInteractions.user_credibility_after.label('interaction_user_credibility_after'),
+    PostsInteractions.created_at.label('interaction_created_at'),
+]
+""" Columns of an exported study, one row per post interaction. Avatars are left out on purpose."""
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+
+def study_results_query(study_id):
+    """
+    :param study_id: The id of the study.
+    :return: The select of every post interaction of the study, with its participant and post.
+    """
+    return (select(*EXPORT_COLUMNS)
+            .select_from(PostsInteractions)
+            .join(Participants, PostsInteractions.fk_participant_id == Participants.id)
+            .join(Posts, PostsInteractions.fk_post_id == Posts.id)
+            .where(Posts.fk_linked_study == study_id)
+            .order_by(Participants.id, PostsInteractions.order))
+
+
+class _CsvWriter:
+    def __init__(self, stream: IO[str], names):
+        self._writer = csv.writer(stream)
+        self._writer.writerow(names)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class _JsonLinesWriter:
+    def __init__(self, stream: IO[str], names):
+        self._stream = stream
+        self._names = names
+
+    def write(self, rows):
+        self._stream.writelines(json.dumps(dict(zip(self._names, row)), default=str) + "\n" for row in rows)
+
+    def close(self):
+        pass
+
+
+class _ParquetWriter:
+    def __init__(self, stream: IO[bytes], names):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("The parquet export needs pyarrow, install it with 'pip install pyarrow'.") from e
+        self._pyarrow = pyarrow
+        arrow_types = []
+        for column in EXPORT_COLUMNS:
+            if isinstance(column.type, Boolean):
+                arrow_types.append(pyarrow.bool_())
+            elif isinstance(column.type, Integer):
+                arrow_types.append(pyarrow.int64())
+            elif isinstance(column.type, TIMESTAMP):
+                arrow_types.append(pyarrow.timestamp('us'))
+            else:
+                arrow_types.append(pyarrow.string())
+        self._schema = pyarrow.schema(list(zip(names, arrow_types)))
+        self._writer = pyarrow.parquet.ParquetWriter(stream, self._schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self._writer.write_table(self._pyarrow.Table.from_arrays(
+            [self._pyarrow.array(values, type=field.type) for values, field in zip(columns, self._schema)],
+            schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+_WRITERS = {'csv': _CsvWriter, 'jsonl': _JsonLinesWriter, 'parquet': _ParquetWriter}
+
+
+def stream_study_results(session, study_id, output: Union[str, PathLike, IO], output_format='csv',
+                         downloaded_by: Optional[int] = None, chunk_size=1000) -> int:
+    """
+    Export every post interaction of a study, joined with its participant and post, in constant memory.
+
+    Rows are read through a server-side cursor chunk_size at a time and written as they arrive. Once done, the
+    download audit columns of the study are updated and committed.
+    :param session: The database session.
+    :param study_id: The id of the study.
+    :param output: Path of the file to write, or an open stream (text for csv and jsonl, binary for parquet).
+    :param output_format: One of 'csv', 'jsonl' or 'parquet'.
+    :param downloaded_by: The id of the admin user downloading the results.
+    :param chunk_size: Number of rows fetched from the database at once.
+    :return: The number of exported rows.
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError("output_format must be one of {}, not '{}'".format(", ".join(EXPORT_FORMATS), output_format))
+
+    stream = output
+    if isinstance(output, (str, PathLike)):
+        stream = open(output, 'wb') if output_format == 'parquet' else open(output, 'w', newline='', encoding='utf-8')
+
+    exported = 0
+    try:
+        names = [column.key for column in EXPORT_COLUMNS]
+        writer = _WRITERS[output_format](stream, names)
+        result = session.execute(study_results_query(study_id).execution_options(yield_per=chunk_size))
+        for rows in result.partitions():
+            writer.write(rows)
+            exported += len(rows)
+        writer.close()
+    finally:
+        if stream is not output:
+            stream.close()
+
+    session.execute(update(Studies)
+                    .where(Studies.id == study_id)
+                    .values(result_last_download_time=datetime.now(), fk_result_last_download_by=downloaded_by))
+    session.commit()
+    return exported
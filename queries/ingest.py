@@ -0,0 +1,173 @@
+import time
+from typing import Callable, Iterable, Optional, Type, Union
+
+from sqlalchemy import insert, Table
+from sqlalchemy.engine import Connection, Engine
+
+from models.db_model import DatabaseBaseClass
+
+
+def _column_default(column):
+    """
+    Compute the client-side default of a column, the same way the ORM would when flushing an object.
+    :param column: The Column to get the default of.
+    :return: The default value, or None if the column has no client-side default.
+    """
+    default = column.default
+    if default is None:
+        return None
+    if default.is_scalar:
+        return default.arg
+    if default.is_callable:
+        return default.arg(None)
+    return None
+
+
+def row_from_item(table: Table, item) -> dict:
+    """
+    Convert a mapped object (or a dict) to a plain row for a Core insert. Missing values are filled with the
+    column defaults so every row of a batch shares the same keys.
+    :param table: The table the row will be inserted into.
+    :param item: An instance of a mapped class, or a dict of column name -> value.
+    :return: A dict of column name -> value.
+    """
+    if isinstance(item, dict):
+        values = dict(item)
+    else:
+        values = {column.key: getattr(item, column.key) for column in table.columns
+                  if getattr(item, column.key, None) is not None}
+
+    for column in table.columns:
+        if values.get(column.key) is None and not column.primary_key:
+            default = _column_default(column)
+            if default is not None:
+                values[column.key] = default
+    return values
+
+
+class IngestReport:
+    """
+    Throughput numbers of an ingestion.
+    """
+    rows: int
+    """ Number of rows inserted and committed."""
+    batches: int
+    """ Number of committed batches."""
+    seconds: float
+    """ Time spent inserting and committing."""
+
+    def __init__(self):
+        self.rows = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return "{rows} rows in {batches} batches, {seconds:.3f}s ({rate:.0f} rows/s)".format(
+            rows=self.rows, batches=self.batches, seconds=self.seconds, rate=self.rows_per_second)
+
+
+class BatchIngestor:
+    """
+    Accumulate rows and insert them by batches, one transaction per batch. Only the current batch is held in memory,
+    and a crash only loses the batch that was not committed yet.
+
+    Batches are sent as a single Core executemany. With psycopg2, SQLAlchemy renders it as multi-row
+    INSERT ... VALUES pages, the same way psycopg2.extras.execute_values would.
+    """
+
+    def __init__(self, engine: Engine, table: Union[Table, Type[DatabaseBaseClass]], batch_size=500, verbose=False,
+                 on_flush: Optional[Callable[[Connection, list], None]] = None):
+        """
+        :param engine: The engine used to insert the rows.
+        :param table: The mapped class or table to insert into.
+        :param batch_size: Number of rows per batch.
+        :param verbose: Print the throughput after each batch.
+        :param on_flush: Called with the connection and the rows of each batch, after the insert and within the same
+        transaction, to maintain data derived from the rows.
+        """
+        assert batch_size > 0, 'batch_size must be greater than 0'
+        self.engine = engine
+        self.table = getattr(table, '__table__', table)
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.on_flush = on_flush
+        self.report = IngestReport()
+        self._pending = []
+
+    def add(self, item) -> bool:
+        """
+        Add a row to the current batch.
+        :param item: An instance of the mapped class, or a dict of column name -> value.
+        :return: True when the batch is full and flush() should be called.
+        """
+        self._pending.append(row_from_item(self.table, item))
+        return len(self._pending) >= self.batch_size
+
+    def flush(self):
+        """
+        Insert and commit the current batch.
+        """
+        if not self._pending:
+            return
+        rows = self._pending
+
+        # executemany needs every parameter set to share the same keys.
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        start = time.perf_counter()
+        with self.engine.begin() as connection:
+            for group in groups.values():
+                connection.execute(insert(self.table), group)
+            if self.on_flush is not None:
+                self.on_flush(connection, rows)
+        # Only forget the rows once committed, so a failed flush can be retried.
+        self._pending = []
+        self.report.seconds += time.perf_counter() - start
+        self.report.rows += len(rows)
+        self.report.batches += 1
+        if self.verbose:
+            print("\033[92m{}:\033[0m {}".format(self.table.name, self.report))
+
+    def discard(self) -> list:
+        """
+        Forget the current batch without inserting it.
+        :return: The rows of the batch.
+        """
+        rows, self._pending = self._pending, []
+        return rows
+
+    def __len__(self):
+        """
+        :return: Number of rows waiting for the next flush.
+        """
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+
+def ingest(engine: Engine, table: Union[Table, Type[DatabaseBaseClass]], items: Iterable, batch_size=500,
+           verbose=False) -> IngestReport:
+    """
+    Stream rows into a table, committing every batch_size rows.
+    :param engine: The engine used to insert the rows.
+    :param table: The mapped class or table to insert into.
+    :param items: Iterable (or generator) of mapped objects or dicts.
+    :param batch_size: Number of rows per batch.
+    :param verbose: Print the throughput after each batch.
+    :return: The IngestReport of the ingestion.
+    """
+    with BatchIngestor(engine, table, batch_size, verbose) as ingestor:
+        for item in items:
+            if ingestor.add(item):
+                ingestor.flush()
+    return ingestor.report
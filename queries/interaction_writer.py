@@ -0,0 +1,290 @@
+import atexit
+import queue
+import threading
+import time
+from typing import Callable, Optional, Sequence, Type, Union
+
+from sqlalchemy import Table
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DisconnectionError, OperationalError, SQLAlchemyError, TimeoutError as PoolTimeout
+
+from models.db_model import DatabaseBaseClass
+from queries.counters import ReactionCounters
+from queries.ingest import BatchIngestor
+
+_STOP = object()
+
+TRANSIENT_ERRORS = (OperationalError, DisconnectionError, PoolTimeout)
+""" Errors a batch can succeed after, such as a lost connection or a lock timeout. Other errors (integrity errors,
+unknown columns...) fail the same way at every attempt, their batch is dead-lettered at once."""
+
+
+class InteractionWriterError(RuntimeError):
+    """ Raised by write(), flush() and close() once the background thread of a writer has died."""
+
+
+def _apply_counters(connection, rows):
+    counters = ReactionCounters()
+    counters.add_many(rows)
+    counters.flush(connection)
+
+
+class WriterStats:
+    """
+    Observability of an InteractionWriter.
+    """
+
+    def __init__(self):
+        self.rows_written = 0
+        self.flush_count = 0
+        self.failed_flush_count = 0
+        self.dead_letter_count = 0
+        """ Rows given up on, see InteractionWriter.dead_letter."""
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.blocked_seconds = 0.0
+        """ Time writers spent waiting for room in the buffer, i.e. backpressure applied to the callers."""
+
+    @property
+    def mean_flush_seconds(self) -> float:
+        return self.total_flush_seconds / self.flush_count if self.flush_count else 0.0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.rows_written / self.flush_count if self.flush_count else 0.0
+
+    def as_dict(self) -> dict:
+        values = dict(self.__dict__)
+        values.update(mean_flush_seconds=self.mean_flush_seconds, mean_batch_size=self.mean_batch_size)
+        return values
+
+
+class InteractionWriter:
+    """
+    Buffered writer for PostsInteractions and CommentsInteractions rows.
+
+    Rows are accumulated in a bounded buffer and written by a background thread, as one multi-row INSERT per batch,
+    whenever flush_size rows are waiting or flush_interval seconds passed since the first waiting row. When the
+    database is slower than the writers the buffer fills up and write() blocks, slowing the callers down instead of
+    growing memory. Batches failing with a transient error are retried max_retries times, the others are handed to
+    dead_letter and the writer keeps going. The remaining rows are flushed by close(), which also runs at interpreter
+    exit. If the background thread dies, write(), flush() and close() raise InteractionWriterError instead of
+    blocking.
+
+        with InteractionWriter(get_engine(), PostsInteractions) as writer:
+            writer.write({'fk_participant_id': 1, 'fk_post_id': 3, 'reaction_type': 'like', ...})
+    """
+
+    def __init__(self, engine: Engine, table: Union[Table, Type[DatabaseBaseClass]], flush_size=500,
+                 flush_interval=1.0, max_buffered=10000, columns: Optional[Sequence[str]] = None, max_retries=5,
+                 maintain_counters=False, dead_letter: Optional[Callable[[list, Exception], None]] = None):
+        """
+        :param engine: The engine used to insert the rows.
+        :param table: PostsInteractions, CommentsInteractions, or any other mapped class or table.
+        :param flush_size: Number of rows that triggers a flush.
+        :param flush_interval: Maximum number of seconds a row waits before being flushed.
+        :param max_buffered: Maximum number of rows held in memory before write() blocks.
+        :param columns: Column names of the tuples given to write(). Defaults to every column but the primary key, in
+        table order.
+        :param max_retries: Number of retries of a batch failing with one of TRANSIENT_ERRORS.
+        :param maintain_counters: Apply the reaction counters of each batch to Posts in the same transaction. Only for
+        PostsInteractions.
+        :param dead_letter: Called with the rows and the error of each batch given up on. By default they are kept in
+        self.dead_letters.
+        """
+        assert flush_size > 0, 'flush_size must be greater than 0'
+        assert max_buffered >= flush_size, 'max_buffered must be at least flush_size'
+        self._ingestor = BatchIngestor(engine, table, batch_size=flush_size,
+                                       on_flush=_apply_counters if maintain_counters else None)
+        self.table = self._ingestor.table
+        self.columns = tuple(columns) if columns is not None else tuple(
+            column.key for column in self.table.columns if not column.primary_key)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dead_letter = dead_letter if dead_letter is not None else self._keep_dead_letter
+        self.dead_letters = []
+        """ (rows, error) of the batches given up on, when no dead_letter callable is given."""
+        self.error: Optional[BaseException] = None
+        """ The error that stopped the background thread, if any."""
+        self.stats = WriterStats()
+        self._queue = queue.Queue(maxsize=max_buffered)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='InteractionWriter-' + self.table.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _raise_if_failed(self):
+        if self.error is not None:
+            message = "The writer of {} stopped: {!r}".format(self.table.name, self.error)
+            raise InteractionWriterError(message) from self.error
+
+    def _put(self, item, timeout: Optional[float] = None):
+        """
+        Queue an item, waiting for room in the buffer as long as the background thread is alive.
+        """
+        self._raise_if_failed()
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        start = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                wait = 0.1 if deadline is None else min(0.1, max(0.0, deadline - time.monotonic()))
+                try:
+                    self._queue.put(item, timeout=wait)
+                    return
+                except queue.Full:
+                    self._raise_if_failed()
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise
+        finally:
+            self.stats.blocked_seconds += time.perf_counter() - start
+
+    def write(self, interaction: Union[tuple, dict], timeout: Optional[float] = None):
+        """
+        Queue an interaction. Blocks while the buffer is full.
+        :param interaction: A dict of column name -> value, or a tuple of values in the order of self.columns.
+        :param timeout: Maximum number of seconds to wait for room in the buffer, raises queue.Full after that.
+        :raise InteractionWriterError: If the background thread died.
+        """
+        if self._closed:
+            raise RuntimeError("InteractionWriter is closed.")
+        row = interaction if isinstance(interaction, dict) else dict(zip(self.columns, interaction))
+        self._put(row, timeout)
+
+    def write_many(self, interactions, timeout: Optional[float] = None):
+        for interaction in interactions:
+            self.write(interaction, timeout)
+
+    def flush(self):
+        """
+        Write every interaction queued so far, and wait until they are committed or dead-lettered.
+        :raise InteractionWriterError: If the background thread died.
+        """
+        if self._closed:
+            return
+        done = threading.Event()
+        self._put(done)
+        while not done.wait(0.1):
+            self._raise_if_failed()
+        # The event is also set when the thread dies with it still queued.
+        self._raise_if_failed()
+
+    def close(self):
+        """
+        Flush the remaining interactions and stop the background thread. Further writes raise RuntimeError.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        try:
+            self._put(_STOP)
+        finally:
+            self._thread.join()
+
+    @property
+    def buffered(self) -> int:
+        """
+        :return: Number of interactions not written yet.
+        """
+        return self._queue.qsize() + len(self._ingestor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _keep_dead_letter(self, rows: list, error: Exception):
+        self.dead_letters.append((rows, error))
+
+    def _give_up(self, rows: list, error: Exception):
+        self.stats.dead_letter_count += len(rows)
+        print(f"{len(rows)} interactions could not be written to {self.table.name}: {error}")
+        try:
+            self.dead_letter(rows, error)
+        except Exception as e:
+            print(f"The dead letter handler of {self.table.name} failed: {e}")
+
+    def _run(self):
+        try:
+            self._loop()
+        except BaseException as e:
+            rows = self._ingestor.discard()
+            waiting = []
+            # Dead-letter the interactions still queued along with the buffered ones before setting self.error, so
+            # the callers seeing the error also see the dead letters.
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    waiting.append(item)
+                elif item is not _STOP:
+                    rows.append(item)
+            if rows:
+                self._give_up(rows, e)
+            self.error = e
+            # Wake up the flush() calls waiting, they raise since self.error is set.
+            for event in waiting:
+                event.set()
+
+    def _loop(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                deadline = None
+                continue
+
+            if item is _STOP:
+                self._flush()
+                return
+            if isinstance(item, threading.Event):
+                self._flush()
+                deadline = None
+                item.set()
+                continue
+
+            if self._ingestor.add(item):
+                self._flush()
+                deadline = None
+            elif deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self):
+        attempt = 0
+        while len(self._ingestor):
+            batch_size = len(self._ingestor)
+            start = time.perf_counter()
+            try:
+                self._ingestor.flush()
+            except SQLAlchemyError as e:
+                self.stats.failed_flush_count += 1
+                attempt += 1
+                if not isinstance(e, TRANSIENT_ERRORS) or attempt > self.max_retries:
+                    self._give_up(self._ingestor.discard(), e)
+                    return
+                print(f"The error '{e}' occurred while writing {batch_size} interactions, attempt {attempt}")
+                time.sleep(min(0.1 * 2 ** attempt, 30.0))
+                continue
+
+            elapsed = time.perf_counter() - start
+            self.stats.rows_written += batch_size
+            self.stats.flush_count += 1
+            self.stats.last_flush_seconds = elapsed
+            self.stats.max_flush_seconds = max(self.stats.max_flush_seconds, elapsed)
+            self.stats.total_flush_seconds += elapsed
+            self.stats.last_batch_size = batch_size
+            self.stats.max_batch_size = max(self.stats.max_batch_size, batch_size)
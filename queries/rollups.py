@@ -0,0 +1,215 @@
+"""
+Per-study aggregates of the posts interactions, kept in small summary tables so dashboards never scan
+posts_interactions.
+
+refresh() folds the interactions created since the last refresh into the rollups, in one short transaction. Run it
+periodically (python -m queries.rollups refresh). Interactions are assumed append-only and committed within `lag`
+seconds of their created_at: rows older than that arriving late, or updated afterwards, are only picked up by
+rebuild(). The InteractionWriter of queries/interaction_writer.py stamps created_at when a row enters its batch and
+commits it up to flush_interval seconds later, plus its retry backoff (about 6 seconds with the default max_retries),
+so the lag must exceed both when interactions go through it.
+
+NULL reaction types and truthfulness, allowed by the schema, are counted as 'none' and false, the rollup primary key
+cannot hold NULL.
+
+    python -m queries.rollups refresh --lag 30
+    python -m queries.rollups rebuild --study 3
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import case, delete, false, func, literal_column, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+
+from models.db_model import (Posts, PostsInteractions, RollupWatermarks, Sources, StudyReactionRollups,
+                             StudySourceRollups)
+
+WATERMARK = 'posts_interactions'
+""" Name of the watermark of the posts interactions rollups."""
+
+UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+""" INSERT ... ON CONFLICT constructs of the supported dialects."""
+
+
+def _count(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _reaction_deltas(where) -> select:
+    timed = PostsInteractions.first_time_to_interact_ms >= 0
+    # Literals rather than bound parameters, so the GROUP BY expressions are identical to the selected ones.
+    reaction_type = func.coalesce(PostsInteractions.reaction_type, literal_column("'none'")).label('reaction_type')
+    is_true_fact = func.coalesce(Posts.is_true_fact, false()).label('is_true_fact')
+    return (select(Posts.fk_linked_study.label('fk_study_id'), reaction_type, is_true_fact,
+                   func.count().label('interactions'),
+                   _count(PostsInteractions.shared).label('shared'),
+                   _count(PostsInteractions.flagged).label('flagged'),
+                   _count(timed).label('timed_interactions'),
+                   func.coalesce(func.sum(case((timed, PostsInteractions.first_time_to_interact_ms), else_=0)), 0)
+                   .label('total_time_to_interact_ms'))
+            .join(Posts, PostsInteractions.fk_post_id == Posts.id)
+            .where(*where)
+            .group_by(Posts.fk_linked_study, reaction_type, is_true_fact))
+
+
+def _source_deltas(where) -> select:
+    return (select(Posts.fk_linked_study.label('fk_study_id'), Posts.fk_source_id,
+                   func.count().label('interactions'),
+                   _count(PostsInteractions.reaction_type == 'like').label('likes'),
+                   _count(PostsInteractions.reaction_type == 'dislike').label('dislikes'),
+                   _count(PostsInteractions.shared).label('shared'),
+                   _count(PostsInteractions.flagged).label('flagged'))
+            .join(Posts, PostsInteractions.fk_post_id == Posts.id)
+            .where(Posts.fk_source_id.is_not(None), *where)
+            .group_by(Posts.fk_linked_study, Posts.fk_source_id))
+
+
+def _add(connection: Connection, rollup, rows: list):
+    """
+    Add the counts of rows to the matching rollup rows, creating the missing ones.
+    """
+    if not rows:
+        return
+    table = rollup.__table__
+    counters = [column.name for column in table.columns if not column.primary_key]
+    statement = UPSERTS[connection.dialect.name](table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={name: table.c[name] + statement.excluded[name] for name in counters})
+    connection.execute(statement, [row._asdict() for row in rows])
+
+
+def _watermark(connection: Connection) -> Optional[datetime]:
+    """
+    :return: The high water mark, locking its row until the end of the transaction so refreshes never overlap.
+    """
+    connection.execute(UPSERTS[connection.dialect.name](RollupWatermarks.__table__)
+                       .values(name=WATERMARK, high_water=datetime.min, refreshed_at=datetime.now())
+                       .on_conflict_do_nothing())
+    return connection.scalar(select(RollupWatermarks.high_water).where(RollupWatermarks.name == WATERMARK)
+                             .with_for_update())
+
+
+def refresh(engine: Engine, lag=30.0) -> int:
+    """
+    Fold the interactions created since the previous refresh into the rollups.
+    :param engine: The engine to refresh with.
+    :param lag: Seconds given to in-flight transactions: interactions created less than lag seconds ago are left to
+    the next refresh. Must exceed the delay between the created_at and the commit of the interactions, see above.
+    :return: The number of folded interactions.
+    """
+    upper = datetime.now() - timedelta(seconds=lag)
+    with engine.begin() as connection:
+        lower = _watermark(connection)
+        if lower >= upper:
+            return 0
+        window = (PostsInteractions.created_at > lower, PostsInteractions.created_at <= upper)
+        reactions = connection.execute(_reaction_deltas(window)).all()
+        _add(connection, StudyReactionRollups, reactions)
+        _add(connection, StudySourceRollups, connection.execute(_source_deltas(window)).all())
+        connection.execute(update(RollupWatermarks).where(RollupWatermarks.name == WATERMARK)
+                           .values(high_water=upper, refreshed_at=datetime.now()))
+    return sum(row.interactions for row in reactions)
+
+
+def rebuild(engine: Engine, study_id=None):
+    """
+    Recompute the rollups of a study, or of every study, from scratch up to the current high water mark.
+    :param engine: The engine to rebuild with.
+    :param study_id: The study to rebuild, None for all of them.
+    """
+    with engine.begin() as connection:
+        upper = _watermark(connection)
+        window = [PostsInteractions.created_at <= upper]
+        for rollup in (StudyReactionRollups, StudySourceRollups):
+            statement = delete(rollup)
+            if study_id is not None:
+                statement = statement.where(rollup.fk_study_id == study_id)
+            connection.execute(statement)
+        if study_id is not None:
+            window.append(Posts.fk_linked_study == study_id)
+        _add(connection, StudyReactionRollups, connection.execute(_reaction_deltas(window)).all())
+        _add(connection, StudySourceRollups, connection.execute(_source_deltas(window)).all())
+
+
+def reaction_distribution(session, study_id) -> dict:
+    """
+    :return: Number of interactions by reaction_type.
+    """
+    return dict(session.execute(
+        select(StudyReactionRollups.reaction_type, func.sum(StudyReactionRollups.interactions))
+        .where(StudyReactionRollups.fk_study_id == study_id)
+        .group_by(StudyReactionRollups.reaction_type)).all())
+
+
+def fact_rates(session, study_id) -> dict:
+    """
+    :return: For true (True) and fake (False) posts, the number of interactions and the share and flag rates.
+    """
+    rows = session.execute(
+        select(StudyReactionRollups.is_true_fact, func.sum(StudyReactionRollups.interactions),
+               func.sum(StudyReactionRollups.shared), func.sum(StudyReactionRollups.flagged))
+        .where(StudyReactionRollups.fk_study_id == study_id)
+        .group_by(StudyReactionRollups.is_true_fact)).all()
+    return {is_true_fact: {'interactions': interactions, 'share_rate': shared / interactions,
+                           'flag_rate': flagged / interactions}
+            for is_true_fact, interactions, shared, flagged in rows}
+
+
+def mean_time_to_interact_ms(session, study_id) -> Optional[float]:
+    """
+    :return: Mean first_time_to_interact_ms of the interactions that recorded it, None if none did.
+    """
+    timed, total = session.execute(
+        select(func.sum(StudyReactionRollups.timed_interactions),
+               func.sum(StudyReactionRollups.total_time_to_interact_ms))
+        .where(StudyReactionRollups.fk_study_id == study_id)).one()
+    return total / timed if timed else None
+
+
+def source_engagement(session, study_id) -> list:
+    """
+    :return: The rollup of every source of the study with its name, most interacted first.
+    """
+    return session.execute(
+        select(StudySourceRollups.fk_source_id, Sources.name, StudySourceRollups.interactions,
+               StudySourceRollups.likes, StudySourceRollups.dislikes, StudySourceRollups.shared,
+               StudySourceRollups.flagged)
+        .join(Sources, StudySourceRollups.fk_source_id == Sources.id)
+        .where(StudySourceRollups.fk_study_id == study_id)
+        .order_by(StudySourceRollups.interactions.desc())).all()
+
+
+def study_summary(session, study_id) -> dict:
+    """
+    :return: Every aggregate of a study, for a dashboard.
+    """
+    return {
+        'reactions': reaction_distribution(session, study_id),
+        'fact_rates': fact_rates(session, study_id),
+        'mean_time_to_interact_ms': mean_time_to_interact_ms(session, study_id),
+        'sources': [row._asdict() for row in source_engagement(session, study_id)],
+    }
+
+
+def main():
+    from db import get_engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    refresh_parser = commands.add_parser('refresh', help="Fold the new interactions into the rollups.")
+    refresh_parser.add_argument('--lag', type=float, default=30.0)
+    rebuild_parser = commands.add_parser('rebuild', help="Recompute the rollups from scratch.")
+    rebuild_parser.add_argument('--study', type=int, help="Only this study.")
+    arguments = parser.parse_args()
+
+    if arguments.command == 'refresh':
+        print("{} interactions folded".format(refresh(get_engine(), arguments.lag)))
+    else:
+        rebuild(get_engine(), arguments.study)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import case, func, select, Integer
+
+from models.db_model import Posts, PostsInteractions
+
+REACTION_CODES = {'like': 1, 'dislike': 2}
+""" reaction_type -> code used in the arrays. Other reaction types are 0 and move no score."""
+
+SCORE_CHANGES = ('changes_to_{}_on_like', 'changes_to_{}_on_dislike', 'changes_to_{}_on_share',
+                 'changes_to_{}_on_flag')
+""" Columns of Posts holding the score changes of each action, to be formatted with 'follower' or 'credibility'."""
+
+
+def _zero(column):
+    # NULL counts as 0: the arrays are int64 and the rows inserted by the SQL templates leave these columns NULL.
+    return func.coalesce(column, 0)
+
+
+class StudyArrays(NamedTuple):
+    """
+    A study loaded as NumPy arrays. Interactions are sorted by participant, then by order.
+    """
+    post_ids: np.ndarray
+    """ Sorted ids of the posts."""
+    follower_changes: np.ndarray
+    """ (posts, 4) follower changes on like, dislike, share and flag."""
+    credibility_changes: np.ndarray
+    """ (posts, 4) credibility changes on like, dislike, share and flag."""
+    interaction_ids: np.ndarray
+    participant_ids: np.ndarray
+    post_indexes: np.ndarray
+    """ Position of the post of each interaction in post_ids."""
+    reactions: np.ndarray
+    """ REACTION_CODES of each interaction."""
+    shared: np.ndarray
+    flagged: np.ndarray
+    follower_before: np.ndarray
+    follower_after: np.ndarray
+    credibility_before: np.ndarray
+    credibility_after: np.ndarray
+
+
+class ReplayResult(NamedTuple):
+    """
+    Expected follower and credibility values of every interaction, in the order of StudyArrays.
+    """
+    interaction_ids: np.ndarray
+    participant_ids: np.ndarray
+    expected_follower_before: np.ndarray
+    expected_follower_after: np.ndarray
+    expected_credibility_before: np.ndarray
+    expected_credibility_after: np.ndarray
+    mismatch: np.ndarray
+    """ True where a stored before/after value disagrees with the replay."""
+
+    @property
+    def mismatched_interaction_ids(self) -> np.ndarray:
+        return self.interaction_ids[self.mismatch]
+
+    def final_scores(self) -> dict:
+        """
+        :return: participant id -> (followers, credibility) after the last interaction of the participant.
+        """
+        if not len(self.participant_ids):
+            return {}
+        last = np.flatnonzero(np.r_[self.participant_ids[1:] != self.participant_ids[:-1], True])
+        return {int(participant): (int(followers), int(credibility)) for participant, followers, credibility in
+                zip(self.participant_ids[last], self.expected_follower_after[last],
+                    self.expected_credibility_after[last])}
+
+
+def load_study(session, study_id) -> StudyArrays:
+    """
+    Load the posts and post interactions of a study into arrays, with two queries.
+    :param session: The database session.
+    :param study_id: The id of the study.
+    """
+    post_columns = [_zero(getattr(Posts, column.format(score))) for score in ('follower', 'credibility')
+                    for column in SCORE_CHANGES]
+    posts = np.array(session.execute(select(Posts.id, *post_columns)
+                                     .where(Posts.fk_linked_study == study_id)
+                                     .order_by(Posts.id)).all(), dtype=np.int64).reshape(-1, 9)
+
+    reaction = case(*((PostsInteractions.reaction_type == name, code) for name, code in REACTION_CODES.items()),
+                    else_=0)
+    interactions = np.array(session.execute(
+        select(PostsInteractions.id, PostsInteractions.fk_participant_id, PostsInteractions.fk_post_id, reaction,
+               _zero(PostsInteractions.shared.cast(Integer)), _zero(PostsInteractions.flagged.cast(Integer)),
+               _zero(PostsInteractions.user_follower_before), _zero(PostsInteractions.user_follower_after),
+               _zero(PostsInteractions.user_credibility_before), _zero(PostsInteractions.user_credibility_after))
+        .join(Posts, PostsInteractions.fk_post_id == Posts.id)
+        .where(Posts.fk_linked_study == study_id)
+        .order_by(PostsInteractions.fk_participant_id, PostsInteractions.order, PostsInteractions.id)).all(),
+        dtype=np.int64).reshape(-1, 10)
+
+    post_ids = posts[:, 0]
+    return StudyArrays(
+        post_ids=post_ids,
+        follower_changes=posts[:, 1:5],
+        credibility_changes=posts[:, 5:9],
+        interaction_ids=interactions[:, 0],
+        participant_ids=interactions[:, 1],
+        post_indexes=np.searchsorted(post_ids, interactions[:, 2]),
+        reactions=interactions[:, 3],
+        shared=interactions[:, 4].astype(bool),
+        flagged=interactions[:, 5].astype(bool),
+        follower_before=interactions[:, 6],
+        follower_after=interactions[:, 7],
+        credibility_before=interactions[:, 8],
+        credibility_after=interactions[:, 9],
+    )
+
+
+def _deltas(changes: np.ndarray, arrays: StudyArrays) -> np.ndarray:
+    per_interaction = changes[arrays.post_indexes]
+    return (np.where(arrays.reactions == REACTION_CODES['like'], per_interaction[:, 0], 0)
+            + np.where(arrays.reactions == REACTION_CODES['dislike'], per_interaction[:, 1], 0)
+            + np.where(arrays.shared, per_interaction[:, 2], 0)
+            + np.where(arrays.flagged, per_interaction[:, 3], 0))
+
+
+def _trajectory(deltas: np.ndarray, stored_before: np.ndarray, group_starts: np.ndarray, groups: np.ndarray):
+    """
+    Cumulative sum of the deltas restarted for each participant, from the stored value before their first interaction.
+    :return: The expected values before and after each interaction.
+    """
+    running = np.cumsum(deltas)
+    # Value of the running sum just before the first interaction of each participant.
+    offsets = running[group_starts] - deltas[group_starts]
+    after = stored_before[group_starts][groups] + running - offsets[groups]
+    return after - deltas, after
+
+
+def replay(arrays: StudyArrays) -> ReplayResult:
+    """
+    Recompute the follower and credibility trajectory of every participant in one vectorized pass.
+
+    Each participant starts from the stored "before" value of their first interaction. Every following value is
+    derived from the score changes of the posts, so a wrong stored value is flagged on its own row and does not hide
+    the next ones.
+    """
+    count = len(arrays.interaction_ids)
+    if count:
+        group_starts = np.flatnonzero(np.r_[True, arrays.participant_ids[1:] != arrays.participant_ids[:-1]])
+    else:
+        group_starts = np.empty(0, dtype=np.int64)
+    groups = np.repeat(np.arange(len(group_starts)), np.diff(np.r_[group_starts, count]))
+
+    follower_before, follower_after = _trajectory(_deltas(arrays.follower_changes, arrays),
+                                                  arrays.follower_before, group_starts, groups)
+    credibility_before, credibility_after = _trajectory(_deltas(arrays.credibility_changes, arrays),
+                                                        arrays.credibility_before, group_starts, groups)
+    mismatch = ((follower_before != arrays.follower_before) | (follower_after != arrays.follower_after)
+                | (credibility_before != arrays.credibility_before) | (credibility_after != arrays.credibility_after))
+    return ReplayResult(arrays.interaction_ids, arrays.participant_ids, follower_before, follower_after,
+                        credibility_before, credibility_after, mismatch)
+
+
+def replay_study(session, study_id) -> ReplayResult:
+    """
+    Load a study and replay the scores of its participants.
+    :param session: The database session.
+    :param study_id: The id of the study.
+    """
+    return replay(load_study(session, study_id))
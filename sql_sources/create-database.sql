@@ -75,14 +75,23 @@ CREATE TABLE "studies" (
       REFERENCES admin_users(id)
 );
 
+-- Avatars and styles, stored once per distinct content, see models/blobs.py.
+CREATE TABLE "blobs" (
+  "id" SERIAL PRIMARY KEY,
+  "hash" varchar(64) NOT NULL,
+  "size" integer NOT NULL,
+  "data" bytea NOT NULL,
+  "created_at" timestamp NOT NULL
+);
+
 CREATE TABLE "sources" (
   "id" SERIAL PRIMARY KEY,
   "ms_id" varchar,
   "name" varchar,
-  "style" bytea,
+  "fk_style_blob" integer REFERENCES blobs(id),
   "max_posts" integer,
   "true_post_percentage" integer,
-  "avatar" bytea,
+  "fk_avatar_blob" integer REFERENCES blobs(id),
   "created_at" timestamp
 );
 
@@ -91,7 +100,7 @@ CREATE TABLE "participants" (
   "ms_id" integer,
   "fk_linked_study" integer,
   "session_id" varchar,
-  "avatar" bytea,
+  "fk_avatar_blob" integer REFERENCES blobs(id),
   "username" varchar,
   "nb_follower" integer,
   "credibility_score" integer,
@@ -126,8 +135,9 @@ CREATE TABLE "posts" (
       REFERENCES sources(id)
 );
 
+-- Interactions are partitioned by month of creation, see models/partitioning.py.
 CREATE TABLE "posts_interactions" (
-  "id" SERIAL PRIMARY KEY,
+  "id" SERIAL,
   "order" integer,
   "fk_participant_id" integer,
   "fk_post_id" integer,
@@ -140,12 +150,13 @@ CREATE TABLE "posts_interactions" (
   "user_follower_after" integer,
   "user_credibility_before" integer,
   "user_credibility_after" integer,
-  "created_at" timestamp,
+  "created_at" timestamp NOT NULL,
+  PRIMARY KEY ("id", "created_at"),
   CONSTRAINT fk_participant_id FOREIGN KEY(id)
       REFERENCES participants(id),
   CONSTRAINT fk_post_id FOREIGN KEY(id)
       REFERENCES posts(id)
-);
+) PARTITION BY RANGE ("created_at");
 
 CREATE TABLE "comments" (
   "id" SERIAL PRIMARY KEY,
@@ -160,15 +171,102 @@ CREATE TABLE "comments" (
 );
 
 CREATE TABLE "comments_interactions" (
-  "id" SERIAL PRIMARY KEY,
+  "id" SERIAL,
   "fk_comment_id" integer,
   "fk_participant_id" integer,
   "reaction_type" varchar,
   "first_time_to_interact_ms" integer,
   "last_interaction_time_ms" integer,
-  "created_at" timestamp,
+  "created_at" timestamp NOT NULL,
+  PRIMARY KEY ("id", "created_at"),
   CONSTRAINT fk_comment_id FOREIGN KEY(id)
       REFERENCES comments(id),
   CONSTRAINT fk_participant_id FOREIGN KEY(id)
       REFERENCES participants(id)
+) PARTITION BY RANGE ("created_at");
+
+-- Rows outside the created months land in the default partitions. Later months are created ahead of time with
+-- `python -m models.partitioning ensure`.
+CREATE TABLE "posts_interactions_default" PARTITION OF "posts_interactions" DEFAULT;
+CREATE TABLE "comments_interactions_default" PARTITION OF "comments_interactions" DEFAULT;
+
+DO $$
+DECLARE
+  month date;
+  parent text;
+BEGIN
+  FOREACH parent IN ARRAY ARRAY['posts_interactions', 'comments_interactions'] LOOP
+    FOR offset_months IN 0..2 LOOP
+      month := date_trunc('month', now()) + make_interval(months => offset_months);
+      EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                     parent || to_char(month, '"_y"YYYY"m"MM'), parent, month, month + interval '1 month');
+    END LOOP;
+  END LOOP;
+END $$;
+
+
+-- Secondary indexes, mirrored from the models. Foreign keys are not indexed automatically by PostgreSQL.
+CREATE INDEX "ix_studies_fk_ui_settings" ON "studies" ("fk_ui_settings");
+CREATE INDEX "ix_studies_fk_basic_settings" ON "studies" ("fk_basic_settings");
+CREATE INDEX "ix_studies_fk_advanced_settings" ON "studies" ("fk_advanced_settings");
+CREATE INDEX "ix_studies_fk_pages_settings" ON "studies" ("fk_pages_settings");
+CREATE INDEX "ix_studies_fk_opened_by" ON "studies" ("fk_opened_by");
+CREATE INDEX "ix_studies_fk_closed_by" ON "studies" ("fk_closed_by");
+CREATE INDEX "ix_studies_fk_result_last_download_by" ON "studies" ("result_last_download_by");
+
+CREATE UNIQUE INDEX "ix_blobs_hash" ON "blobs" ("hash");
+
+CREATE INDEX "ix_participants_fk_linked_study" ON "participants" ("fk_linked_study");
+CREATE UNIQUE INDEX "ix_participants_session_id" ON "participants" ("session_id");
+
+CREATE INDEX "ix_posts_study_id" ON "posts" ("fk_linked_study", "id");
+CREATE INDEX "ix_posts_fk_source_id" ON "posts" ("fk_source_id");
+
+CREATE INDEX "ix_posts_interactions_participant_order" ON "posts_interactions" ("fk_participant_id", "order");
+CREATE INDEX "ix_posts_interactions_post_participant" ON "posts_interactions" ("fk_post_id", "fk_participant_id");
+CREATE INDEX "ix_posts_interactions_created_at" ON "posts_interactions" USING brin ("created_at");
+
+CREATE INDEX "ix_comments_fk_source_id" ON "comments" ("fk_source_id");
+CREATE INDEX "ix_comments_fk_post_id" ON "comments" ("fk_post_id");
+
+CREATE INDEX "ix_comments_interactions_fk_comment_id" ON "comments_interactions" ("fk_comment_id");
+CREATE INDEX "ix_comments_interactions_fk_participant_id" ON "comments_interactions" ("fk_participant_id");
+
+
+-- Per-study aggregates of the posts interactions, refreshed by queries/rollups.py.
+CREATE TABLE "rollup_watermarks" (
+  "name" varchar PRIMARY KEY,
+  "high_water" timestamp,
+  "refreshed_at" timestamp
+);
+
+CREATE TABLE "study_reaction_rollups" (
+  "fk_study_id" integer REFERENCES studies(id),
+  "reaction_type" varchar,
+  "is_true_fact" bool,
+  "interactions" integer,
+  "shared" integer,
+  "flagged" integer,
+  "timed_interactions" integer,
+  "total_time_to_interact_ms" bigint,
+  PRIMARY KEY ("fk_study_id", "reaction_type", "is_true_fact")
+);
+
+CREATE TABLE "study_source_rollups" (
+  "fk_study_id" integer REFERENCES studies(id),
+  "fk_source_id" integer REFERENCES sources(id),
+  "interactions" integer,
+  "likes" integer,
+  "dislikes" integer,
+  "shared" integer,
+  "flagged" integer,
+  PRIMARY KEY ("fk_study_id", "fk_source_id")
+);
+
+-- Posts already inserted by generators/seeding.py, to resume an interrupted seeding.
+CREATE TABLE "seeding_checkpoints" (
+  "fk_study_id" integer REFERENCES studies(id),
+  "item" integer,
+  "created_at" timestamp NOT NULL,
+  PRIMARY KEY ("fk_study_id", "item")
 );
@@ -0,0 +1,39 @@
+-- Moves the avatars and styles of an existing database to the blobs table (PostgreSQL 11 or later, for sha256()).
+-- Each distinct content is stored once, keyed like models/blobs.py by the hexadecimal sha256 of its bytes, then the
+-- sources and participants point to it and the old columns are dropped. Runs in a single transaction.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS "blobs" (
+  "id" SERIAL PRIMARY KEY,
+  "hash" varchar(64) NOT NULL,
+  "size" integer NOT NULL,
+  "data" bytea NOT NULL,
+  "created_at" timestamp NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "ix_blobs_hash" ON "blobs" ("hash");
+
+ALTER TABLE "sources"
+  ADD COLUMN IF NOT EXISTS "fk_style_blob" integer REFERENCES blobs(id),
+  ADD COLUMN IF NOT EXISTS "fk_avatar_blob" integer REFERENCES blobs(id);
+ALTER TABLE "participants"
+  ADD COLUMN IF NOT EXISTS "fk_avatar_blob" integer REFERENCES blobs(id);
+
+INSERT INTO "blobs" ("hash", "size", "data", "created_at")
+SELECT encode(sha256(content), 'hex'), length(content), content, now()
+FROM (SELECT "style" AS content FROM "sources"
+      UNION SELECT "avatar" FROM "sources"
+      UNION SELECT "avatar" FROM "participants") AS contents
+WHERE content IS NOT NULL
+ON CONFLICT ("hash") DO NOTHING;
+
+UPDATE "sources" SET "fk_style_blob" = blobs.id
+FROM "blobs" WHERE blobs.hash = encode(sha256(sources.style), 'hex');
+UPDATE "sources" SET "fk_avatar_blob" = blobs.id
+FROM "blobs" WHERE blobs.hash = encode(sha256(sources.avatar), 'hex');
+UPDATE "participants" SET "fk_avatar_blob" = blobs.id
+FROM "blobs" WHERE blobs.hash = encode(sha256(participants.avatar), 'hex');
+
+ALTER TABLE "sources" DROP COLUMN "style", DROP COLUMN "avatar";
+ALTER TABLE "participants" DROP COLUMN "avatar";
+
+COMMIT;
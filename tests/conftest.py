@@ -0,0 +1,80 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+from sqlalchemy import MetaData, create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.db_model import Base  # noqa: E402
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """
+    A SQLite database file with every table created.
+    """
+    engine = create_engine("sqlite:///{}".format(tmp_path / 'test.db'))
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def nullable_engine(tmp_path):
+    """
+    Create a SQLite database like engine, except that the given columns allow NULL, as the schema of
+    sql_sources/create-database.sql does: nullable_engine(Posts.is_true_fact, ...). The tables are created from a copy
+    of the metadata, the models are left untouched.
+    """
+    engines = []
+
+    def create(*columns):
+        metadata = MetaData()
+        for table in Base.metadata.sorted_tables:
+            table.to_metadata(metadata)
+        for column in columns:
+            column = column.expression
+            metadata.tables[column.table.name].c[column.key].nullable = True
+        engine = create_engine("sqlite:///{}".format(tmp_path / 'nullable.db'))
+        metadata.create_all(engine)
+        engines.append(engine)
+        return engine
+
+    yield create
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def fake_openai():
+    """
+    The dev/fake-openai.py module, whose serve() starts a local chat completions endpoint.
+    """
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dev', 'fake-openai.py')
+    spec = importlib.util.spec_from_file_location('fake_openai', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def fake_server(fake_openai):
+    """
+    Start fake servers with fake_server(**serve options), each returning an OpenAI client without retries on it, or an
+    AsyncOpenAI one with fake_server(is_async=True, ...).
+    """
+    openai = pytest.importorskip('openai')
+    servers = []
+
+    def start(is_async=False, **options):
+        server = fake_openai.serve(**options)
+        servers.append(server)
+        client_class = openai.AsyncOpenAI if is_async else openai.OpenAI
+        return client_class(base_url="http://127.0.0.1:{}/v1".format(server.server_port), api_key='fake',
+                            max_retries=0)
+
+    yield start
+    for server in servers:
+        server.shutdown()
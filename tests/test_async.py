@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Session
+
+import db
+from generators.workload import generate_workload
+from models.async_db_model import get_all_interactions_by_post_id, get_all_posts_by_study_id
+from models.db_model import Posts, PostsInteractions
+
+
+@pytest.fixture
+def async_engine(engine, monkeypatch):
+    """
+    The shared async engine of db.py, on the database of the engine fixture filled by generate_workload.
+    """
+    generate_workload(engine, sources=3, posts_per_study=4, comments_per_post=1, participants_per_study=3,
+                      interactions=12, seed=1)
+    # Restored after the test, so the other tests keep building the async engine from DATABASE_URL.
+    monkeypatch.setattr(db, '_async_engine', None)
+    return db.configure_async(engine.url.set(drivername='sqlite+aiosqlite').render_as_string(hide_password=False))
+
+
+def _run(async_engine, coroutine):
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(run())
+
+
+def _headline(engine, post_id) -> str:
+    with Session(engine) as session:
+        return session.scalar(select(Posts.headline).where(Posts.id == post_id))
+
+
+def test_raiseload_raises_on_lazy_access(engine, async_engine):
+    with Session(engine) as session:
+        post_id = session.scalar(select(PostsInteractions.fk_post_id).group_by(PostsInteractions.fk_post_id)
+                                 .order_by(func.count().desc()).limit(1))
+
+    async def load():
+        async with db.async_session_scope() as session:
+            return (await get_all_posts_by_study_id(session, 1),
+                    await get_all_interactions_by_post_id(session, post_id))
+
+    posts, interactions = _run(async_engine, load())
+    assert posts and interactions
+    # The eager relationships are loaded, the other ones raise instead of querying.
+    assert all(post.source.name and post.linked_study.id == 1 for post in posts)
+    assert all(interaction.post.id == post_id and interaction.participant.id for interaction in interactions)
+    with pytest.raises(InvalidRequestError, match="lazy='raise'"):
+        interactions[0].comment
+
+
+def test_async_session_scope_commits_on_success(engine, async_engine):
+    async def rename():
+        async with db.async_session_scope() as session:
+            await session.execute(update(Posts).where(Posts.id == 1).values(headline='committed'))
+
+    _run(async_engine, rename())
+    assert _headline(engine, 1) == 'committed'
+
+
+def test_async_session_scope_rolls_back_on_error(engine, async_engine):
+    before = _headline(engine, 1)
+
+    async def rename():
+        async with db.async_session_scope() as session:
+            await session.execute(update(Posts).where(Posts.id == 1).values(headline='rolled back'))
+            raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        _run(async_engine, rename())
+    assert _headline(engine, 1) == before
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from generators.OpenAI.batch_generator import (JSON_OBJECT_FORMAT, RESPONSE_FORMAT, generate_post_batch,
+                                               parse_batch, response_format)
+from generators.OpenAI.post_generator import PostDetails
+
+openai = pytest.importorskip('openai')
+
+
+def _details(count: int, min_char=50, max_char=100) -> list:
+    return [PostDetails(50, True, specific_theme="Travel", min_char=min_char, max_char=max_char)
+            for _ in range(count)]
+
+
+def _post(index: int, details: PostDetails, content="x" * 60) -> dict:
+    return {'index': index, 'theme': details.theme, 'is_true': details.is_info_true, 'headline': "Headline",
+            'content': content}
+
+
+def test_parse_batch_keeps_only_valid_posts():
+    details = _details(5)
+    reply = json.dumps({'posts': [
+        _post(0, details[0]),
+        _post(1, details[1], content="too short"),
+        {**_post(2, details[2]), 'is_true': not details[2].is_info_true},
+        _post(0, details[0]),
+        _post(7, details[0]),
+        {'index': 4},
+    ]})
+    assert list(parse_batch(reply, details)) == [0]
+    assert parse_batch("not json", details) == {}
+    assert parse_batch(json.dumps({'posts': {}}), details) == {}
+
+
+def test_response_format_depends_on_the_model():
+    assert response_format("gpt-3.5-turbo") == JSON_OBJECT_FORMAT
+    assert response_format("gpt-4o-mini") is RESPONSE_FORMAT
+    assert response_format("gpt-4o-2024-05-13") == JSON_OBJECT_FORMAT
+    assert response_format("gpt-3.5-turbo", structured=False) is None
+
+
+def test_invalid_posts_are_requested_again(fake_server):
+    client = fake_server(invalid_rate=0.4, seed=3)
+    details = _details(8)
+    generation = generate_post_batch(details, client, max_attempts=10)
+    assert len(generation.posts) == 8 and not generation.failed
+    assert all(len(post.content) >= 50 * 0.8 for post in generation.posts)
+
+
+def test_posts_still_invalid_after_every_attempt_are_reported(fake_server):
+    client = fake_server(invalid_rate=1.0)
+    generation = generate_post_batch(_details(3), client, max_attempts=2)
+    assert not generation.posts and len(generation.failed) == 3
+
+
+def test_default_model_is_not_sent_a_json_schema(fake_server):
+    client = fake_server()
+    assert len(generate_post_batch(_details(2), client).posts) == 2
+    with pytest.raises(openai.BadRequestError):
+        generate_post_batch(_details(2), client, structured=True)
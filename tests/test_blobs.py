@@ -0,0 +1,22 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models.blobs import BlobStore, blob_hash
+from models.db_model import Blobs
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_put_many_stores_buffers_once(engine, tmp_path, cached):
+    store = BlobStore(str(tmp_path / 'blobs') if cached else None)
+    contents = [b'avatar', bytearray(b'style'), memoryview(b'--avatar--')[2:-2], b'']
+    with Session(engine) as session:
+        ids = store.put_many(session, contents)
+        session.commit()
+
+        assert ids[0] == ids[2]
+        assert len(set(ids)) == 3
+        assert session.scalar(select(func.count()).select_from(Blobs)) == 3
+        assert session.scalar(select(Blobs.hash).where(Blobs.id == ids[1])) == blob_hash(b'style')
+        assert {blob_id: bytes(data) for blob_id, data in store.get_many(session, ids).items()} == {
+            ids[0]: b'avatar', ids[1]: b'style', ids[3]: b''}
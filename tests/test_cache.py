@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import UnmappedInstanceError
+
+from generators.workload import generate_workload
+from models.cache import ReadThroughCache, settings_cache
+from models.db_model import Sources
+
+
+@pytest.fixture
+def seeded(engine):
+    generate_workload(engine, sources=2, posts_per_study=2, comments_per_post=1, participants_per_study=2,
+                      interactions=2, seed=1)
+    settings_cache.clear()
+    yield engine
+    settings_cache.clear()
+
+
+def test_row_loaded_during_an_invalidation_is_not_cached(seeded):
+    cache = ReadThroughCache()
+    with Session(seeded) as session:
+        def load():
+            row = session.get(Sources, 1)
+            # A concurrent commit invalidates the key after the row was read.
+            cache.invalidate(Sources, 1)
+            return row
+
+        assert cache.get(Sources, 1, load).id == 1
+        assert cache.lookup(Sources, 1) is None
+        assert cache.get(Sources, 1, lambda: session.get(Sources, 1)).id == 1
+        assert cache.lookup(Sources, 1) is not None
+
+
+def test_class_invalidation_during_a_load_is_not_cached(seeded):
+    cache = ReadThroughCache()
+    with Session(seeded) as session:
+        generation = cache.generation(Sources, 1)
+        row = session.get(Sources, 1)
+        cache.invalidate(Sources)
+        cache.store(Sources, 1, row, generation)
+        assert cache.lookup(Sources, 1) is None
+
+
+def test_updates_invalidate_at_commit(seeded):
+    with Session(seeded) as session:
+        name = Sources.get_by_id(session, 1, use_cache=True).name
+
+    with Session(seeded) as writer:
+        writer.get(Sources, 1).name = 'renamed'
+        writer.flush()
+        # Until the commit, other sessions still read the old row: it stays cached.
+        assert settings_cache.lookup(Sources, 1).name == name
+        writer.commit()
+    assert settings_cache.lookup(Sources, 1) is None
+
+    with Session(seeded) as session:
+        assert Sources.get_by_id(session, 1, use_cache=True).name == 'renamed'
+
+
+def test_rolled_back_updates_invalidate(seeded):
+    with Session(seeded) as writer:
+        writer.get(Sources, 1).name = 'uncommitted'
+        writer.flush()
+        # Read in the session of the pending update, the cached row holds its uncommitted values.
+        assert Sources.get_by_id(writer, 1, use_cache=True).name == 'uncommitted'
+        writer.rollback()
+    assert settings_cache.lookup(Sources, 1) is None
+
+
+def test_snapshots_are_read_only(seeded):
+    with Session(seeded) as session:
+        snapshot = Sources.get_by_id(session, 1, use_cache=True)
+        assert snapshot == Sources.get_by_id(session, 1, use_cache=True)
+        assert snapshot.name == session.get(Sources, 1).name
+        with pytest.raises(AttributeError):
+            snapshot.name = 'changed'
+        with pytest.raises(UnmappedInstanceError):
+            session.merge(snapshot)
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from generators.OpenAI.client import ModelLimits, RateLimitedClient, TokenBucket
+
+openai = pytest.importorskip('openai')
+
+MESSAGES = [{'role': 'user', 'content': "Write a headline."}]
+MODEL = 'gpt-4o-mini'
+
+
+@pytest.fixture
+def server(fake_openai):
+    servers = []
+
+    def start(**options):
+        server = fake_openai.serve(**options)
+        servers.append(server)
+        return server, openai.OpenAI(base_url="http://127.0.0.1:{}/v1".format(server.server_port), api_key='fake',
+                                     max_retries=0)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_bucket_reservations_wait_for_the_debt():
+    bucket = TokenBucket(per_minute=60, burst_seconds=2)
+    assert bucket.reserve(2) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    bucket.give_back(1)
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+
+
+def test_injected_errors_are_retried(server):
+    _, openai_client = server(error_rate=0.4, seed=2)
+    client = RateLimitedClient(openai_client, base_delay=0.01, max_delay=0.05, max_retries=20)
+    replies = [client.chat.completions.create(model=MODEL, messages=MESSAGES) for _ in range(20)]
+
+    assert all(reply.choices[0].message.content.startswith("Fake reply") for reply in replies)
+    stats = client.stats()[MODEL]
+    assert stats['requests'] == 20 and stats['retries'] > 0 and stats['rate_limited'] > 0
+    assert stats['attempts'] == stats['requests'] + stats['retries']
+    # The 429 lowered the request rate, each success raises it back a little.
+    assert stats['rate_factor'] < 1.0
+
+
+def test_errors_are_raised_once_the_retries_are_spent(server):
+    _, openai_client = server(error_rate=1.0)
+    client = RateLimitedClient(openai_client, base_delay=0.01, max_delay=0.01, max_retries=2)
+    with pytest.raises(openai.APIStatusError):
+        client.chat.completions.create(model=MODEL, messages=MESSAGES)
+    assert client.stats()[MODEL]['attempts'] == 3
+
+
+def test_requests_stay_within_the_rate_limit(server):
+    # The client aims at half of a 120 requests per minute quota: one per second after a burst of 5. The server
+    # answers 429 above 60 requests per minute.
+    fake, openai_client = server(rpm=60)
+    client = RateLimitedClient(openai_client, limits={MODEL: ModelLimits(120, 10 ** 6)}, headroom=0.5)
+    start = time.monotonic()
+    for _ in range(8):
+        client.chat.completions.create(model=MODEL, messages=MESSAGES)
+
+    accepted = list(fake.RequestHandlerClass.accepted)
+    assert len(accepted) == 8
+    assert client.stats()[MODEL]['rate_limited'] == 0
+    assert time.monotonic() - start >= 2.8
+    # Beyond the burst, no more than one request per second.
+    for first, later in zip(accepted[4:], accepted[5:]):
+        assert later - first >= 0.9
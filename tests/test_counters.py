@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import OperationalError
+
+from models.db_model import Posts
+from queries.counters import COUNTER_COLUMNS, ReactionCounters
+
+
+def _post(post_id: int) -> dict:
+    changes = {column.key: 0 for column in Posts.__table__.columns if column.key.startswith('changes_')}
+    return {**changes, 'id': post_id, 'ms_id': str(post_id), 'fk_linked_study': 1, 'headline': 'h', 'content': 'c',
+            'is_true_fact': True, 'fk_source_id': 1, 'created_at': datetime(2024, 1, 1)}
+
+
+def _counters(engine, post_id: int) -> tuple:
+    with engine.connect() as connection:
+        return tuple(connection.execute(select(*(Posts.__table__.c[column] for column in COUNTER_COLUMNS))
+                                        .where(Posts.id == post_id)).one())
+
+
+def test_null_counters_are_incremented_from_zero(nullable_engine):
+    # Posts inserted through the SQL templates leave the counters NULL.
+    engine = nullable_engine(*(getattr(Posts, column) for column in COUNTER_COLUMNS))
+    with engine.begin() as connection:
+        connection.execute(insert(Posts).values({column: None for column in COUNTER_COLUMNS}), [_post(1)])
+
+    counters = ReactionCounters()
+    counters.add_many([{'fk_post_id': 1, 'reaction_type': 'like', 'shared': True},
+                       {'fk_post_id': 1, 'reaction_type': 'dislike', 'flagged': True}])
+    with engine.begin() as connection:
+        assert counters.flush(connection) == 1
+    assert _counters(engine, 1) == (1, 1, 1, 1)
+
+
+def test_failed_flush_keeps_the_increments(engine, tmp_path):
+    with engine.begin() as connection:
+        connection.execute(insert(Posts), [_post(1)])
+    counters = ReactionCounters()
+    counters.add({'fk_post_id': 1, 'reaction_type': 'like'})
+
+    empty = create_engine("sqlite:///{}".format(tmp_path / 'empty.db'))
+    with pytest.raises(OperationalError), empty.begin() as connection:
+        counters.flush(connection)
+    counters.add({'fk_post_id': 1, 'reaction_type': 'like'})
+    assert len(counters) == 1
+
+    with engine.begin() as connection:
+        counters.flush(connection)
+    assert _counters(engine, 1) == (2, 0, 0, 0)
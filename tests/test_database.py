@@ -0,0 +1,86 @@
+import pytest
+
+from queries import database
+from queries.database import QUERIES, QueryTemplate, _load_template, _prepared_statements, execute_prepared
+
+
+@pytest.fixture
+def template(tmp_path, monkeypatch):
+    (tmp_path / 'query.sql').write_text("INSERT INTO items\n (name, size, label)\n"
+                                        " VALUES ('{name}', {size}, '{name}');\n")
+    monkeypatch.setattr(database, 'SQL_SOURCES', tmp_path)
+    return _load_template('insert_item', 'query.sql')
+
+
+def test_placeholders_become_bound_parameters(template):
+    assert template == QueryTemplate('insert_item', "INSERT INTO items (name, size, label) "
+                                                    "VALUES (%(name)s, %(size)s, %(name)s)", ('name', 'size'))
+
+
+def test_prepare_and_execute_statements(template):
+    assert template.prepare_sql == ("PREPARE insert_item AS INSERT INTO items (name, size, label) "
+                                    "VALUES ($1, $2, $1)")
+    assert template.execute_sql == "EXECUTE insert_item (%(name)s, %(size)s)"
+
+
+def test_batch_statement(template):
+    assert template.batch_sql == "INSERT INTO items (name, size, label) VALUES %s"
+    assert template.batch_template == "(%(name)s, %(size)s)"
+
+
+def test_registered_queries():
+    assert set(QUERIES) == {'insert_study_basic_settings', 'insert_post'}
+    for name, query in QUERIES.items():
+        assert query.name == name
+        assert '{' not in query.sql and "'%(" not in query.sql
+    assert QUERIES['insert_study_basic_settings'].params == (
+        'name', 'description', 'prompt', 'length', 'require_reactions', 'require_comments', 'require_identification')
+    # The parameter is named after the placeholder, not the column.
+    assert 'source_id' in QUERIES['insert_post'].params and 'fk_source_id' not in QUERIES['insert_post'].params
+
+
+class _Connection:
+    """
+    Records the statements executed, without a database.
+    """
+
+    def __init__(self, with_info=True):
+        if with_info:
+            self.info = {}
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def execute(self, sql, params=None):
+                connection.executed.append((sql, params))
+
+        return Cursor()
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.mark.parametrize('with_info', [True, False])
+def test_statements_are_prepared_once_per_connection(with_info):
+    query = QUERIES['insert_study_basic_settings']
+    params = dict.fromkeys(query.params, 1)
+    first, second = _Connection(with_info), _Connection(with_info)
+    execute_prepared(first, 'insert_study_basic_settings', params)
+    execute_prepared(first, 'insert_study_basic_settings', params)
+    execute_prepared(second, 'insert_study_basic_settings', params)
+
+    assert first.executed == [(query.prepare_sql, None), (query.execute_sql, params), (query.execute_sql, params)]
+    assert second.executed == [(query.prepare_sql, None), (query.execute_sql, params)]
+    assert first.commits == 2
+    assert _prepared_statements(first) == {'insert_study_basic_settings'}
+
+
+def test_unknown_query_name():
+    with pytest.raises(KeyError):
+        execute_prepared(_Connection(), 'insert_unknown', {})
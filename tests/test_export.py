@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from generators.workload import generate_workload
+from models.db_model import Posts, PostsInteractions, Studies
+from queries.export import EXPORT_COLUMNS, stream_study_results
+
+NAMES = [column.key for column in EXPORT_COLUMNS]
+
+
+@pytest.fixture
+def seeded(engine):
+    generate_workload(engine, studies=2, sources=2, posts_per_study=4, comments_per_post=1, participants_per_study=5,
+                      interactions=60, seed=3)
+    return engine
+
+
+def _interaction_ids(engine, study_id) -> list:
+    with Session(engine) as session:
+        return session.scalars(select(PostsInteractions.id).join(Posts, PostsInteractions.fk_post_id == Posts.id)
+                               .where(Posts.fk_linked_study == study_id)).all()
+
+
+def test_csv_export(seeded, tmp_path):
+    path = tmp_path / 'study.csv'
+    with Session(seeded) as session:
+        exported = stream_study_results(session, 1, str(path), output_format='csv', downloaded_by=1, chunk_size=7)
+
+    with open(path, newline='', encoding='utf-8') as output:
+        rows = list(csv.reader(output))
+    assert rows[0] == NAMES
+    expected = _interaction_ids(seeded, 1)
+    assert exported == len(rows) - 1 == len(expected) > 0
+    interaction_ids = [int(row[NAMES.index('interaction_id')]) for row in rows[1:]]
+    assert sorted(interaction_ids) == sorted(expected)
+    # Sorted by participant, then by interaction order.
+    keys = [(int(row[NAMES.index('participant_id')]), int(row[NAMES.index('interaction_order')])) for row in rows[1:]]
+    assert keys == sorted(keys)
+
+    with Session(seeded) as session:
+        study = session.get(Studies, 1)
+        assert study.result_last_download_time is not None and study.fk_result_last_download_by == 1
+        # The other study is left untouched.
+        assert session.get(Studies, 2).result_last_download_time is None
+
+
+def test_jsonl_export(seeded):
+    output = io.StringIO()
+    with Session(seeded) as session:
+        exported = stream_study_results(session, 2, output, output_format='jsonl')
+
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert exported == len(rows) == len(_interaction_ids(seeded, 2)) > 0
+    assert all(list(row) == NAMES for row in rows)
+    with Session(seeded) as session:
+        for row in rows:
+            interaction = session.get(PostsInteractions, row['interaction_id'])
+            assert interaction.fk_post_id == row['post_id']
+            assert interaction.fk_participant_id == row['participant_id']
+            assert session.get(Posts, row['post_id']).headline == row['post_headline']
+
+    with Session(seeded) as session:
+        study = session.get(Studies, 2)
+        assert study.result_last_download_time is not None and study.fk_result_last_download_by is None
+
+
+def test_unknown_format_is_rejected(seeded):
+    with Session(seeded) as session, pytest.raises(ValueError):
+        stream_study_results(session, 1, io.StringIO(), output_format='xml')
@@ -0,0 +1,24 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from generators.workload import generate_workload
+from models.db_model import Posts
+
+
+def test_pages_cover_every_post_once(engine):
+    generate_workload(engine, sources=2, posts_per_study=7, comments_per_post=1, participants_per_study=2,
+                      interactions=0, seed=1)
+    ids, after_id = [], 0
+    with Session(engine) as session:
+        while after_id is not None:
+            rows, after_id = Posts.get_feed_page(session, 1, 1, after_id, limit=3)
+            ids += [row.id for row in rows]
+    assert ids == list(range(1, 8))
+
+
+def test_error_returns_an_empty_page(engine, capsys):
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE posts_interactions"))
+    with Session(engine) as session:
+        assert Posts.get_feed_page(session, 1, 1) == ([], None)
+    assert 'posts_interactions' in capsys.readouterr().out
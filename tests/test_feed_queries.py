@@ -0,0 +1,61 @@
+import asyncio
+import importlib.util
+import os
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+
+from generators.workload import generate_workload
+from instrumentation import query_budget
+from models.db_model import Posts, PostsInteractions
+from models.loader import AsyncLoaders
+
+POSTS = 50
+
+
+@pytest.fixture(scope='module')
+def feed_queries():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dev', 'feed-queries.py')
+    spec = importlib.util.spec_from_file_location('feed_queries', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def seeded(engine):
+    generate_workload(engine, sources=5, posts_per_study=POSTS, comments_per_post=2, participants_per_study=10,
+                      interactions=200, seed=1)
+    return engine
+
+
+def _count(engine, render) -> tuple:
+    with Session(engine) as session:
+        posts = session.execute(select(Posts).where(Posts.fk_linked_study == 1).order_by(Posts.id)).scalars().all()
+        with query_budget(10000, engine) as counter:
+            rendered = render(session, posts)
+    return counter['count'], rendered
+
+
+def test_batched_feed_page_takes_three_queries(seeded, feed_queries):
+    per_post = _count(seeded, feed_queries.render_per_post)
+    batched = _count(seeded, feed_queries.render_batched)
+    # Interactions, comments and source of each post, against one query of each for the page.
+    assert per_post == (3 * POSTS, batched[1])
+    assert batched[0] == 3
+
+
+def test_async_loads_of_concurrent_coroutines_share_a_query(seeded):
+    async def load():
+        engine = create_async_engine(seeded.url.set(drivername='sqlite+aiosqlite'))
+        try:
+            async with AsyncSession(engine) as session:
+                loader = AsyncLoaders(session).get(PostsInteractions, 'fk_post_id')
+                rows = await asyncio.gather(*(loader.load(post_id) for post_id in range(1, POSTS + 1)))
+                return loader.queries, sum(map(len, rows))
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(load()) == (1, 200)
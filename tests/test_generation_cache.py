@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+from generators.OpenAI.cache import CacheMissError, CachedChatClient, GenerationCache, HeadlineDeduplicator
+
+MODEL = 'gpt-4o-mini'
+
+
+def _messages(prompt: str) -> list:
+    return [{'role': 'user', 'content': prompt}]
+
+
+def _keys(path) -> list:
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT prompt_hash, occurrence FROM completions ORDER BY last_used").fetchall()
+
+
+def test_second_run_replays_the_first(tmp_path, fake_server):
+    cache = GenerationCache(str(tmp_path / 'cache.sqlite'))
+    client = CachedChatClient(fake_server(), cache)
+    first = [client.chat.completions.create(model=MODEL, messages=_messages("Same prompt")).choices[0].message.content
+             for _ in range(3)]
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    cache.reset_run()
+    replay = [client.chat.completions.create(model=MODEL, messages=_messages("Same prompt")).choices[0].message.content
+              for _ in range(3)]
+    assert replay == first
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_replay_only_raises_on_a_miss(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = GenerationCache(path)
+    cache.put(cache.next_key(MODEL, _messages("Cached")), MODEL, "Cached reply")
+    cache.close()
+
+    client = CachedChatClient(None, GenerationCache(path, replay_only=True))
+    assert client.chat.completions.create(model=MODEL, messages=_messages("Cached")).choices[0].message.content == \
+        "Cached reply"
+    with pytest.raises(CacheMissError):
+        client.chat.completions.create(model=MODEL, messages=_messages("Cached"))
+    with pytest.raises(CacheMissError):
+        client.chat.completions.create(model=MODEL, messages=_messages("Never sent"))
+
+
+def test_replacing_an_entry_does_not_count_towards_the_size(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = GenerationCache(path, max_entries=10)
+    keys = [cache.next_key(MODEL, _messages("Prompt {}".format(i))) for i in range(10)]
+    for key in keys:
+        cache.put(key, MODEL, "Reply")
+    for _ in range(20):
+        cache.put(keys[0], MODEL, "Replaced reply")
+    assert len(_keys(path)) == 10
+    assert cache.get(keys[0]) == "Replaced reply"
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = GenerationCache(path, max_entries=10)
+    keys = [cache.next_key(MODEL, _messages("Prompt {}".format(i))) for i in range(11)]
+    for key in keys[:10]:
+        cache.put(key, MODEL, "Reply")
+    # Reading the first entry makes the second one the least recently used.
+    assert cache.get(keys[0]) == "Reply"
+    cache.put(keys[10], MODEL, "Reply")
+
+    # A tenth of the cache is evicted at once, on top of the entry over the limit.
+    remaining = set(_keys(path))
+    assert len(remaining) == 9
+    assert keys[0] in remaining and keys[10] in remaining
+    assert keys[1] not in remaining and keys[2] not in remaining
+
+
+def test_headline_deduplicator():
+    headlines = HeadlineDeduplicator(threshold=0.8)
+    assert headlines.add("Scientists discover a new species of frog in Peru")
+    # Same headline once normalized: case, accents, punctuation and spacing.
+    assert headlines.is_duplicate("SCIENTISTS discover a new species of frog in Perú!")
+    assert not headlines.add("  Scientists,  discover a new species of frog in Peru ")
+    # Nearly the same.
+    assert headlines.is_duplicate("Scientists discover a new species of frogs in Peru")
+    assert headlines.add("City council votes to extend the bike lane network")
+    assert not headlines.is_duplicate("Local bakery wins a national bread award")
@@ -0,0 +1,111 @@
+"""
+Importing the library modules must stay cheap and free of side effects.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, with network connections refused so an
+import opening one fails. Importing a package of LAZY_PACKAGES always fails the test. The import times are checked
+relative to the import of sqlalchemy.orm measured in the same run (best of REPEAT imports each), so the budgets hold
+on slower or loaded machines: the cumulative time of the module, and the self time of the modules of this repository
+that the import runs, which catches work added at import time. IMPORT_BUDGET_SCALE multiplies the budgets, 0 skips
+the timing checks.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+BUDGETS = {
+    'db': (1.5, 0.03),
+    'models.db_model': (2.2, 0.4),
+    'models.cache': (1.6, 0.03),
+    'models.blobs': (2.2, 0.4),
+    'models.read_models': (2.3, 0.4),
+    'models.loader': (2.3, 0.4),
+    'generators.OpenAI.cache': (0.15, 0.03),
+    'generators.OpenAI.post_generator': (2.3, 0.4),
+    'generators.OpenAI.batch_generator': (2.3, 0.4),
+    'generators.OpenAI.client': (0.3, 0.03),
+    'generators.workload': (2.3, 0.4),
+    'generators.seeding': (2.3, 0.4),
+    'queries.ingest': (2.3, 0.4),
+    'instrumentation': (1.6, 0.03),
+}
+""" Cumulative import time of each module, and self time of the repository modules it imports, in imports of
+BASELINE."""
+
+BASELINE = 'sqlalchemy.orm'
+""" Module whose import time is the unit of BUDGETS. Most modules import it, its import scales with the machine."""
+
+LAZY_PACKAGES = ('openai', 'httpx', 'psycopg2', 'dotenv', 'numpy', 'pyarrow', 'sqlalchemy.ext.asyncio')
+""" Packages no module of BUDGETS may import, they are imported by the functions needing them."""
+
+OWN_PACKAGES = ('db', 'models', 'generators', 'queries', 'instrumentation')
+""" Top level packages of this repository."""
+
+REPEAT = 3
+""" Imports of each module, the fastest one is kept."""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_NO_NETWORK = (
+    "import socket\n"
+    "def _refuse(*args, **kwargs):\n"
+    "    raise RuntimeError('network access during import')\n"
+    "socket.socket.connect = _refuse\n"
+    "socket.create_connection = _refuse\n"
+)
+
+
+def measure(module: str) -> tuple:
+    """
+    Import a module in a new interpreter.
+    :return: The cumulative import time of the module and the self time of the repository modules in milliseconds,
+    and the LAZY_PACKAGES it imported.
+    """
+    code = _NO_NETWORK + "import sys, {}\nprint(' '.join(sorted(sys.modules)))".format(module)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            cwd=ROOT, env={**os.environ, 'PYTHONPATH': ROOT})
+    assert result.returncode == 0, result.stderr.strip().splitlines()[-1]
+
+    cumulative = own = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        if name == module:
+            cumulative = int(fields[1])
+        if name.split('.')[0] in OWN_PACKAGES:
+            own += int(fields[0].split(':')[-1])
+    loaded = set(result.stdout.split())
+    return cumulative / 1000, own / 1000, [package for package in LAZY_PACKAGES if package in loaded]
+
+
+@pytest.fixture(scope='module')
+def baseline() -> float:
+    """
+    :return: The import time of BASELINE in milliseconds, best of REPEAT.
+    """
+    return min(measure(BASELINE)[0] for _ in range(REPEAT))
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_heavy_packages_are_imported_lazily(module):
+    eager = measure(module)[2]
+    assert eager == [], "{} imports {}".format(module, ", ".join(eager))
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_import_time(module, baseline):
+    scale = float(os.environ.get('IMPORT_BUDGET_SCALE', 1.0))
+    if not scale:
+        pytest.skip("IMPORT_BUDGET_SCALE is 0")
+    total_budget, own_budget = (budget * scale * baseline for budget in BUDGETS[module])
+    runs = [measure(module) for _ in range(REPEAT)]
+    total = min(run[0] for run in runs)
+    own = min(run[1] for run in runs)
+    assert total <= total_budget, "{} takes {:.1f} ms to import, budget {:.0f} ms ({} takes {:.0f} ms)".format(
+        module, total, total_budget, BASELINE, baseline)
+    assert own <= own_budget, "{} spends {:.1f} ms in this repository's modules, budget {:.0f} ms".format(
+        module, own, own_budget)
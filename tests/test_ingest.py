@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import func, insert, select
+
+from models.db_model import AdminUsers, Blobs
+from queries.ingest import BatchIngestor, ingest
+
+
+def _count(engine, table) -> int:
+    with engine.connect() as connection:
+        return connection.scalar(select(func.count()).select_from(table))
+
+
+def test_batches_are_flushed_when_full(engine):
+    report = ingest(engine, AdminUsers, ({'access_right': i % 3} for i in range(25)), batch_size=10)
+
+    assert (report.rows, report.batches) == (25, 3)
+    with engine.connect() as connection:
+        rows = connection.execute(select(AdminUsers.access_right, AdminUsers.created_at)).all()
+    assert [access_right for access_right, _ in rows] == [i % 3 for i in range(25)]
+    # The client-side default is filled in.
+    assert all(created_at is not None for _, created_at in rows)
+
+
+def test_add_reports_a_full_batch(engine):
+    ingestor = BatchIngestor(engine, AdminUsers, batch_size=2)
+    assert not ingestor.add(AdminUsers(access_right=1))
+    assert ingestor.add({'access_right': 2})
+    assert len(ingestor) == 2
+    ingestor.flush()
+    assert len(ingestor) == 0 and _count(engine, AdminUsers) == 2
+
+
+def test_on_flush_shares_the_transaction_of_the_batch(engine):
+    batches = []
+
+    def on_flush(connection, rows):
+        batches.append(len(rows))
+        connection.execute(insert(Blobs), {'hash': str(len(batches)), 'size': len(rows), 'data': b''})
+        if len(batches) == 2:
+            raise RuntimeError("derived data failed")
+
+    ingestor = BatchIngestor(engine, AdminUsers, batch_size=2, on_flush=on_flush)
+    for access_right in range(2):
+        ingestor.add({'access_right': access_right})
+    ingestor.flush()
+    for access_right in range(3):
+        ingestor.add({'access_right': access_right})
+    with pytest.raises(RuntimeError):
+        ingestor.flush()
+
+    assert batches == [2, 3]
+    # The failed batch and its derived row are rolled back together, the rows are kept for a retry.
+    assert _count(engine, AdminUsers) == 2 and _count(engine, Blobs) == 1
+    assert len(ingestor) == 3 and ingestor.report.batches == 1
+
+
+def test_discard_forgets_the_batch(engine):
+    with BatchIngestor(engine, AdminUsers, batch_size=10) as ingestor:
+        ingestor.add({'access_right': 1})
+        discarded = ingestor.discard()
+        assert [row['access_right'] for row in discarded] == [1]
+        assert len(ingestor) == 0
+        ingestor.add({'access_right': 2})
+    # Leaving the block only flushes what was added after the discard.
+    with engine.connect() as connection:
+        assert connection.scalars(select(AdminUsers.access_right)).all() == [2]
+    assert ingestor.report.rows == 1
@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.orm import Session
+
+from instrumentation import QueryProfiler, StatementStats, normalize_sql
+from models.db_model import Base, Posts
+
+
+@pytest.mark.parametrize('statement, expected', [
+    ("SELECT * FROM posts WHERE id IN (?, ?, ?)", "SELECT * FROM posts WHERE id IN (?)"),
+    ("SELECT * FROM posts WHERE id IN (1, 2, 3) AND ms_id = 'a''b'",
+     "SELECT * FROM posts WHERE id IN (?) AND ms_id = ?"),
+    ("SELECT * FROM posts WHERE id IN (%(id_1)s, %(id_2)s)", "SELECT * FROM posts WHERE id IN (?)"),
+    ("SELECT * FROM posts WHERE id IN ($1, $2, $3)", "SELECT * FROM posts WHERE id IN (?)"),
+    ("SELECT *\n  FROM posts\n WHERE id = $1 AND ms_id = :ms_id",
+     "SELECT * FROM posts WHERE id = ? AND ms_id = :ms_id"),
+    ("INSERT INTO blobs (hash, size) VALUES (?, ?), (?, ?), (?, ?)", "INSERT INTO blobs (hash, size) VALUES (?)"),
+    ("INSERT INTO blobs (hash, size) VALUES ('a', 1), ('b', 2)", "INSERT INTO blobs (hash, size) VALUES (?)"),
+])
+def test_normalize_sql(statement, expected):
+    assert normalize_sql(statement) == expected
+
+
+def test_histogram_percentiles():
+    stats = StatementStats()
+    for duration_ms in [0.5] * 90 + [30.0] * 9 + [3000.0]:
+        stats.add(duration_ms)
+    assert (stats.count, stats.max_ms) == (100, 3000.0)
+    assert stats.mean_ms == pytest.approx((45 + 270 + 3000) / 100)
+    assert stats.percentile_ms(50) == 1
+    assert stats.percentile_ms(90) == 1
+    assert stats.percentile_ms(95) == 50
+    assert stats.percentile_ms(99) == 50
+    assert stats.percentile_ms(100) == 5000
+    stats.add(6000.0)
+    assert stats.percentile_ms(100) == float('inf')
+
+
+@pytest.fixture
+def profiler(engine):
+    profiler = QueryProfiler(slow_threshold_ms=0.0)
+    profiler.attach(engine)
+    yield profiler
+    profiler.detach()
+
+
+def test_slow_queries_are_explained(engine, profiler):
+    with Session(engine) as session:
+        session.execute(select(Posts).where(Posts.fk_linked_study == 3)).all()
+        session.execute(text("INSERT INTO admin_users (access_right, created_at) VALUES (1, '2024-01-01')"))
+
+    select_query, insert_query = [query for query in profiler.slow_queries]
+    assert select_query.statement.lstrip().startswith("SELECT") and select_query.parameters == (3,)
+    assert select_query.plan.startswith(("SCAN", "SEARCH")) and "posts" in select_query.plan
+    assert insert_query.plan is None
+    # The EXPLAIN statements are not recorded.
+    assert len(profiler.statements) == 2
+    assert not any("EXPLAIN" in statement for statement in profiler.statements)
+    assert sum(stats.count for stats in profiler.statements.values()) == 2
+
+
+def test_detach_removes_the_listeners(engine, tmp_path):
+    other = create_engine("sqlite:///{}".format(tmp_path / 'other.db'))
+    Base.metadata.create_all(other)
+    profiler = QueryProfiler()
+    profiler.attach(engine)
+    profiler.attach(other)
+    with Session(engine) as session:
+        session.execute(select(Posts)).all()
+        session.execute(select(Posts)).all()
+        assert session.info['query_count'] == 2
+
+    profiler.detach(other)
+    assert not event.contains(other, 'before_cursor_execute', profiler._before_cursor_execute)
+    assert event.contains(Session, 'do_orm_execute', profiler._count_session_query)
+
+    profiler.detach()
+    assert not event.contains(engine, 'after_cursor_execute', profiler._after_cursor_execute)
+    assert not event.contains(Session, 'do_orm_execute', profiler._count_session_query)
+    with Session(engine) as session:
+        session.execute(select(Posts)).all()
+        assert 'query_count' not in session.info
+    assert sum(stats.count for stats in profiler.statements.values()) == 2
+    other.dispose()
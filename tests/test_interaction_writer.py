@@ -0,0 +1,72 @@
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from models.db_model import PostsInteractions
+from queries.interaction_writer import InteractionWriter, InteractionWriterError
+
+
+def _interaction(order: int) -> dict:
+    return {'order': order, 'fk_participant_id': 1, 'fk_post_id': 1, 'reaction_type': 'like', 'flagged': False,
+            'shared': False, 'user_follower_before': 0, 'user_follower_after': 0, 'user_credibility_before': 0,
+            'user_credibility_after': 0, 'created_at': datetime(2024, 1, 1)}
+
+
+def _count(engine) -> int:
+    with engine.connect() as connection:
+        return connection.scalar(select(func.count()).select_from(PostsInteractions))
+
+
+def test_permanent_error_is_dead_lettered_and_writer_keeps_going(engine):
+    with InteractionWriter(engine, PostsInteractions, flush_size=2, flush_interval=0.05) as writer:
+        writer.write({**_interaction(1), 'reaction_type': None})
+        writer.write(_interaction(2))
+        writer.flush()
+        writer.write(_interaction(3))
+        writer.flush()
+    assert writer.error is None
+    assert writer.stats.dead_letter_count == 2
+    assert len(writer.dead_letters) == 1 and len(writer.dead_letters[0][0]) == 2
+    assert _count(engine) == 1
+
+
+def test_fatal_error_raises_instead_of_blocking(engine):
+    writer = InteractionWriter(engine, PostsInteractions, flush_size=10, flush_interval=0.05, max_buffered=10)
+
+    def crash():
+        raise ValueError("boom")
+
+    writer._ingestor.flush = crash
+    writer.write(_interaction(1))
+    with pytest.raises(InteractionWriterError):
+        writer.flush()
+    with pytest.raises(InteractionWriterError):
+        for order in range(100):
+            writer.write(_interaction(order), timeout=5)
+    assert isinstance(writer.error, ValueError)
+    assert writer.stats.dead_letter_count == 1
+    with pytest.raises(InteractionWriterError):
+        writer.close()
+
+
+def test_fatal_error_dead_letters_the_queued_rows(engine):
+    writer = InteractionWriter(engine, PostsInteractions, flush_size=2, flush_interval=10, max_buffered=10)
+    queued = threading.Event()
+
+    def crash():
+        # Fails once rows are waiting in the queue behind the batch being flushed.
+        queued.wait(5)
+        raise ValueError("boom")
+
+    writer._ingestor.flush = crash
+    for order in range(1, 6):
+        writer.write(_interaction(order))
+    queued.set()
+    with pytest.raises(InteractionWriterError):
+        writer.flush()
+    assert writer.stats.dead_letter_count == 5
+    assert sorted(row['order'] for rows, _ in writer.dead_letters for row in rows) == [1, 2, 3, 4, 5]
+    with pytest.raises(InteractionWriterError):
+        writer.close()
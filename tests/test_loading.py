@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from generators.workload import generate_workload
+from instrumentation import query_budget
+from models.db_model import Base, Posts, PostsInteractions, Studies
+
+
+def _seed(tmp_path, children: int):
+    """
+    :return: An engine on a database whose study has `children` posts, sources and interactions per post.
+    """
+    engine = create_engine("sqlite:///{}".format(tmp_path / 'children-{}.db'.format(children)))
+    Base.metadata.create_all(engine)
+    generate_workload(engine, sources=children, posts_per_study=children, comments_per_post=1,
+                      participants_per_study=children, interactions=children * children, seed=children)
+    return engine
+
+
+def _study(session):
+    study = Studies.get_by_id(session, 1)
+    return [study.basic_settings.name, study.ui_settings.id, study.advanced_settings.id, study.pages_settings.id,
+            study.opened_by.id, study.closed_by.id, study.result_last_download_by]
+
+
+def _posts(session, loading):
+    return [(post.source.name, post.linked_study.id) for post in Posts.get_all_by_study_id(session, 1, loading)]
+
+
+def _post(session, loading):
+    post = Posts.get_by_id(session, 1, loading)
+    return post.source.name, post.linked_study.id
+
+
+def _interactions(session, loading):
+    post_id = session.scalar(select(PostsInteractions.fk_post_id).group_by(PostsInteractions.fk_post_id)
+                             .order_by(func.count().desc()).limit(1))
+    return [(interaction.participant.username, interaction.post.headline)
+            for interaction in PostsInteractions.get_all_by_post_id(session, post_id, loading)]
+
+
+CASES = {
+    'studies.get_by_id': _study,
+    'posts.get_all_by_study_id.selectinload': lambda session: _posts(session, selectinload),
+    'posts.get_all_by_study_id.joinedload': lambda session: _posts(session, joinedload),
+    'posts.get_by_id': lambda session: _post(session, joinedload),
+    'posts_interactions.get_all_by_post_id': lambda session: _interactions(session, selectinload),
+}
+
+
+def _queries(engine, case) -> tuple:
+    """
+    :return: The number of statements issued by the case, relationships included, and the number of rows it read.
+    """
+    with Session(engine) as session, query_budget(1000, engine) as counter:
+        rows = CASES[case](session)
+    return counter['count'], len(rows)
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_query_count_does_not_grow_with_the_rows(tmp_path, case):
+    one, many = _seed(tmp_path, 1), _seed(tmp_path, 12)
+    queries_one, rows_one = _queries(one, case)
+    queries_many, rows_many = _queries(many, case)
+    assert queries_one == queries_many
+    if case not in ('studies.get_by_id', 'posts.get_by_id'):
+        assert rows_many > rows_one
@@ -0,0 +1,167 @@
+import gzip
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateTable
+
+from models import partitioning
+from models.db_model import Comments, PostsInteractions
+from models.partitioning import _add_months, create_month_partition, partition_name
+
+
+def _ddl(table, dialect) -> str:
+    return " ".join(str(CreateTable(table).compile(dialect=dialect)).split())
+
+
+def test_partitioned_table_ddl_on_postgresql():
+    ddl = _ddl(PostsInteractions.__table__, postgresql.dialect())
+    assert "PRIMARY KEY (id, created_at)" in ddl
+    assert ddl.endswith("PARTITION BY RANGE (created_at)")
+    # The ORM still identifies the rows by id alone.
+    assert [column.name for column in PostsInteractions.__table__.primary_key] == ['id']
+
+
+def test_other_tables_and_backends_are_not_partitioned():
+    assert "PRIMARY KEY (id)" in _ddl(Comments.__table__, postgresql.dialect())
+    ddl = _ddl(PostsInteractions.__table__, sqlite.dialect())
+    assert "PRIMARY KEY (id)" in ddl and "PARTITION" not in ddl
+
+
+@pytest.mark.parametrize('month, months, expected', [
+    (datetime(2024, 1, 1), 1, datetime(2024, 2, 1)),
+    (datetime(2024, 12, 1), 1, datetime(2025, 1, 1)),
+    (datetime(2024, 11, 1), 14, datetime(2026, 1, 1)),
+    (datetime(2024, 1, 1), -1, datetime(2023, 12, 1)),
+    (datetime(2024, 3, 1), -27, datetime(2021, 12, 1)),
+])
+def test_add_months(month, months, expected):
+    assert _add_months(month, months) == expected
+
+
+def test_partition_name():
+    assert partition_name('posts_interactions', datetime(2024, 3, 17, 12)) == 'posts_interactions_y2024m03'
+
+
+class _Result:
+    def __init__(self, values):
+        self._values = values
+
+    def scalars(self):
+        return iter(self._values)
+
+
+class _Connection:
+    """
+    Records the SQL executed, on the PostgreSQL dialect.
+    """
+
+    def __init__(self, log: list, partitions=()):
+        self.dialect = postgresql.dialect()
+        self.log = log
+        self.partitions = list(partitions)
+
+    def scalar(self, statement, parameters=None):
+        return None
+
+    def execute(self, statement, parameters=None):
+        self.log.append((" ".join(str(statement).split()), parameters))
+        return _Result(self.partitions)
+
+
+def test_create_month_partition_moves_the_rows_of_the_default_partition():
+    log = []
+    assert create_month_partition(_Connection(log), 'posts_interactions', datetime(2024, 12, 15))
+    statements = [statement for statement, _ in log]
+    assert statements[0] == ("CREATE TABLE posts_interactions_y2024m12 (LIKE posts_interactions INCLUDING DEFAULTS "
+                             "INCLUDING CONSTRAINTS)")
+    assert statements[1].startswith("WITH moved AS (DELETE FROM posts_interactions_default WHERE created_at >= :start")
+    assert statements[1].endswith("INSERT INTO posts_interactions_y2024m12 SELECT * FROM moved")
+    assert log[1][1] == {'start': datetime(2024, 12, 1), 'end': datetime(2025, 1, 1)}
+    assert statements[2] == ("ALTER TABLE posts_interactions ATTACH PARTITION posts_interactions_y2024m12 "
+                             "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01')")
+
+
+class _Engine:
+    """
+    Records the SQL executed and the COPY statements, in order. COPY TO writes one CSV row per table, COPY FROM
+    keeps what it read in loaded.
+    """
+
+    def __init__(self, partitions, fail_copy=False):
+        self.log = []
+        self.partitions = partitions
+        self.fail_copy = fail_copy
+        self.loaded = []
+
+    @contextmanager
+    def connect(self):
+        yield _Connection(self.log, self.partitions)
+
+    begin = connect
+
+    def raw_connection(self):
+        engine = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def copy_expert(self, statement, output):
+                if engine.fail_copy:
+                    raise OSError("disk full")
+                engine.log.append((statement, None))
+                if 'FROM STDIN' in statement:
+                    engine.loaded.append(output.read())
+                else:
+                    output.write("id,created_at\n1,{}\n".format(statement.split('"')[1]))
+
+        class RawConnection:
+            def cursor(self):
+                return Cursor()
+
+            def commit(self):
+                pass
+
+            def close(self):
+                pass
+
+        return RawConnection()
+
+
+def test_archive_dumps_before_detaching(tmp_path):
+    engine = _Engine(['posts_interactions_y2024m01', 'posts_interactions_y2024m02', 'posts_interactions_default'])
+    paths = partitioning.archive_partitions(engine, 'posts_interactions', datetime(2024, 2, 10), str(tmp_path))
+
+    assert paths == [str(tmp_path / 'posts_interactions_y2024m01.csv.gz')]
+    with gzip.open(paths[0], 'rt') as archive:
+        assert archive.read() == "id,created_at\n1,posts_interactions_y2024m01\n"
+    statements = [statement for statement, _ in engine.log[1:]]
+    assert statements == ['COPY "posts_interactions_y2024m01" TO STDOUT WITH (FORMAT csv, HEADER)',
+                          "ALTER TABLE posts_interactions DETACH PARTITION posts_interactions_y2024m01",
+                          "DROP TABLE posts_interactions_y2024m01"]
+    assert not list(tmp_path.glob('*.partial'))
+
+
+def test_failed_dump_leaves_the_partition_attached(tmp_path):
+    engine = _Engine(['posts_interactions_y2024m01'], fail_copy=True)
+    with pytest.raises(OSError):
+        partitioning.archive_partitions(engine, 'posts_interactions', datetime(2024, 2, 1), str(tmp_path))
+    assert not any('DETACH' in statement or 'DROP' in statement for statement, _ in engine.log)
+    assert not list(tmp_path.iterdir())
+
+
+def test_restore_loads_the_archive_into_a_new_partition(tmp_path):
+    path = tmp_path / 'posts_interactions_y2024m01.csv.gz'
+    with gzip.open(path, 'wt') as archive:
+        archive.write("id,created_at\n1,2024-01-05\n")
+    engine = _Engine([])
+    partitioning.restore_partition(engine, 'posts_interactions', datetime(2024, 1, 20), str(path))
+
+    assert engine.log[0][0].startswith("CREATE TABLE posts_interactions_y2024m01")
+    assert engine.log[-1][0] == 'COPY "posts_interactions_y2024m01" FROM STDIN WITH (FORMAT csv, HEADER)'
+    assert engine.loaded == ["id,created_at\n1,2024-01-05\n"]
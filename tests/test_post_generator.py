@@ -0,0 +1,61 @@
+import asyncio
+
+from generators.OpenAI.post_generator import PostDetails, generate_posts
+
+
+class _CountingClient:
+    """
+    Forwards chat completions to an AsyncOpenAI client, keeping the highest number of requests in flight at once.
+    Requests whose prompt contains `failing` raise instead.
+    """
+
+    def __init__(self, client, failing=None):
+        self.chat = self
+        self.completions = self
+        self.client = client
+        self.failing = failing
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    async def create(self, **kwargs):
+        self.in_flight += 1
+        self.requests += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.failing is not None and self.failing in kwargs['messages'][-1]['content']:
+                await asyncio.sleep(0.01)
+                raise RuntimeError("injected failure")
+            return await self.client.chat.completions.create(**kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+async def _collect(details_list, client, concurrency, failed=None) -> list:
+    return [post async for post in generate_posts(details_list, concurrency=concurrency, client=client,
+                                                  failed=failed)]
+
+
+def _details(count, theme="Science Education") -> list:
+    return [PostDetails(100, True, specific_theme=theme) for _ in range(count)]
+
+
+def test_concurrency_limits_the_requests_in_flight(fake_server):
+    client = _CountingClient(fake_server(is_async=True, delay=0.05))
+    posts = asyncio.run(_collect(_details(12), client, concurrency=3))
+
+    assert len(posts) == 12
+    assert all(post.content.startswith("Fake reply") for post in posts)
+    # A title and a content request per post.
+    assert client.requests == 24
+    assert client.max_in_flight == 3
+
+
+def test_a_failed_post_does_not_cancel_the_others(fake_server):
+    client = _CountingClient(fake_server(is_async=True, delay=0.05), failing="Broken Theme")
+    details_list = _details(3) + _details(1, theme="Broken Theme") + _details(3)
+    failed = []
+    posts = asyncio.run(_collect(details_list, client, concurrency=4, failed=failed))
+
+    assert len(posts) == 6
+    assert [(details.theme, str(error)) for details, error in failed] == [("Broken Theme", "injected failure")]
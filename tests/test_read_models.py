@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from generators.workload import generate_workload
+from models.db_model import Comments, Posts, PostsInteractions
+from models.read_models import (READ_MODELS, PostRow, comments_by_post_id, fetch_rows, iter_rows, posts_by_study_id,
+                                posts_interactions_by_post_id)
+
+
+@pytest.fixture
+def seeded(engine):
+    generate_workload(engine, studies=2, sources=3, posts_per_study=4, comments_per_post=2, participants_per_study=4,
+                      interactions=40, seed=5)
+    return engine
+
+
+@pytest.mark.parametrize('read_model', list(READ_MODELS))
+def test_fields_map_to_their_column(seeded, read_model):
+    table_class = READ_MODELS[read_model]
+    with Session(seeded) as session:
+        rows = fetch_rows(session, read_model)
+        instances = session.query(table_class).order_by(table_class.id).all()
+
+    assert len(rows) == len(instances) > 0
+    for row, instance in zip(rows, instances):
+        assert isinstance(row, read_model)
+        assert row._asdict() == {field: getattr(instance, field) for field in read_model._fields}
+
+
+@pytest.mark.parametrize('read_model', list(READ_MODELS))
+def test_rows_stay_out_of_the_identity_map(seeded, read_model):
+    with Session(seeded) as session:
+        fetched = fetch_rows(session, read_model)
+        streamed = list(iter_rows(session, read_model, chunk_size=3))
+        assert streamed == fetched
+        assert len(session.identity_map) == 0
+    with pytest.raises(AttributeError):
+        fetched[0].id = 0
+
+
+def test_criteria(seeded):
+    with Session(seeded) as session:
+        posts = posts_by_study_id(session, 2)
+        assert posts and all(post.fk_linked_study == 2 for post in posts)
+        post_id = posts[0].id
+        interactions = posts_interactions_by_post_id(session, post_id)
+        assert [row.id for row in interactions] == sorted(
+            instance.id for instance in PostsInteractions.get_all_by_post_id(session, post_id))
+        comments = comments_by_post_id(session, post_id)
+        assert [row.id for row in comments] == [comment.id for comment in session.query(Comments).filter(
+            Comments.fk_post_id == post_id).order_by(Comments.id)]
+        assert [row.id for row in iter_rows(session, PostRow, Posts.fk_linked_study == 2)] == [
+            post.id for post in posts]
+
+
+def test_read_models_cover_their_columns():
+    # Every field is a column of its model class.
+    for read_model, table_class in READ_MODELS.items():
+        assert set(read_model._fields) <= set(table_class.__table__.columns.keys())
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+from models.db_model import Posts, PostsInteractions, StudyReactionRollups
+from queries.rollups import refresh
+
+
+def _interaction(post_id: int, reaction_type) -> dict:
+    return {'order': 0, 'fk_participant_id': 1, 'fk_post_id': post_id, 'reaction_type': reaction_type,
+            'flagged': False, 'shared': False, 'first_time_to_interact_ms': -1, 'last_interaction_time_ms': -1,
+            'user_follower_before': 0, 'user_follower_after': 0, 'user_credibility_before': 0,
+            'user_credibility_after': 0, 'created_at': datetime(2024, 1, 1)}
+
+
+def test_null_groups_are_folded_into_a_single_rollup_row(nullable_engine):
+    engine = nullable_engine(PostsInteractions.reaction_type, Posts.is_true_fact)
+    post = {column.key: 0 for column in Posts.__table__.columns if column.key.startswith(('number_', 'changes_'))}
+    with engine.begin() as connection:
+        connection.execute(insert(Posts), [{**post, 'id': 1, 'ms_id': '1', 'fk_linked_study': 1, 'headline': 'h',
+                                            'content': 'c', 'is_true_fact': None, 'fk_source_id': 1,
+                                            'created_at': datetime(2024, 1, 1)}])
+        connection.execute(insert(PostsInteractions),
+                           [_interaction(1, None), _interaction(1, None), _interaction(1, 'none')])
+    assert refresh(engine, lag=0) == 3
+
+    # A second window with another NULL row must add to the same rollup row, not create a new one.
+    with engine.begin() as connection:
+        connection.execute(insert(PostsInteractions), [{**_interaction(1, None), 'created_at': datetime.now()}])
+    assert refresh(engine, lag=-60) == 1
+
+    with engine.connect() as connection:
+        rows = connection.execute(select(StudyReactionRollups.reaction_type, StudyReactionRollups.is_true_fact,
+                                         StudyReactionRollups.interactions)).all()
+    assert rows == [('none', False, 4)]
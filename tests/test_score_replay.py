@@ -0,0 +1,45 @@
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from generators.workload import generate_workload
+from models.db_model import Posts, PostsInteractions
+from queries.score_replay import load_study, replay, replay_study
+
+NULLABLE = {
+    Posts: ('changes_to_follower_on_share', 'changes_to_credibility_on_flag'),
+    PostsInteractions: ('shared', 'flagged', 'user_follower_before', 'user_follower_after',
+                        'user_credibility_before', 'user_credibility_after'),
+}
+""" Columns set to NULL by the test, as left by rows inserted through the SQL templates."""
+
+
+def _seed(engine):
+    generate_workload(engine, sources=3, posts_per_study=10, comments_per_post=1, participants_per_study=5,
+                      interactions=40, seed=1)
+
+
+def test_generated_workload_replays_without_mismatch(engine):
+    _seed(engine)
+    with Session(engine) as session:
+        result = replay_study(session, 1)
+    assert len(result.interaction_ids) == 40
+    assert not result.mismatch.any()
+
+
+def test_null_columns_load_as_zero(nullable_engine):
+    engine = nullable_engine(*(getattr(table_class, column) for table_class, columns in NULLABLE.items()
+                               for column in columns))
+    _seed(engine)
+    with engine.begin() as connection:
+        for table_class, columns in NULLABLE.items():
+            connection.execute(update(table_class).where(table_class.id == 1).values({column: None
+                                                                                      for column in columns}))
+
+    with Session(engine) as session:
+        arrays = load_study(session, 1)
+    assert arrays.follower_changes[0, 2] == 0 and arrays.credibility_changes[0, 3] == 0
+    row = list(arrays.interaction_ids).index(1)
+    assert not arrays.shared[row] and not arrays.flagged[row]
+    assert (arrays.follower_before[row], arrays.follower_after[row], arrays.credibility_before[row],
+            arrays.credibility_after[row]) == (0, 0, 0, 0)
+    assert replay(arrays).mismatch.any()
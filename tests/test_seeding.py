@@ -0,0 +1,22 @@
+from sqlalchemy import func, select
+
+import generators.seeding as seeding
+from generators.seeding import SeedingJob, seed_study
+from models.db_model import Posts
+
+
+def _posts(engine) -> int:
+    with engine.connect() as connection:
+        return connection.scalar(select(func.count()).select_from(Posts))
+
+
+def test_resume_skips_completed_posts_with_a_single_checkpoint_scan(engine, monkeypatch):
+    seed_study(engine, SeedingJob(study_id=1, posts=30), batch_size=7)
+    assert _posts(engine) == 30
+
+    calls = []
+    original = seeding.completed_items
+    monkeypatch.setattr(seeding, 'completed_items', lambda *args: calls.append(args) or original(*args))
+    seed_study(engine, SeedingJob(study_id=1, posts=40), batch_size=7)
+    assert _posts(engine) == 40
+    assert len(calls) == 1